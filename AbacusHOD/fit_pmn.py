@@ -12,12 +12,16 @@ $ python ./fit_pmn.py --help
 
 import argparse
 import os
+import sys
 
 import numpy as np
 import yaml
 from scipy import stats
 
 from abacusnbody.hod.abacus_hod import AbacusHOD
+# the compiled Gaussian likelihood lives in hod-variation/source (appended, so the local mypmn wins)
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'hod-variation', 'source')))
+from data_object import gaussian_chi2
 from mypmn import my_pmn
 
 # from abacusnbody.hod.utils import setup_logging
@@ -34,7 +38,7 @@ class ObsData:
         """Initialize with observed data and covariance matrix. Optional number density and its standard deviation."""
         self.data = data
         self.cov = cov
-        self.icov = np.linalg.inv(cov)  # inverse covariance matrix
+        self.like = gaussian_chi2(data, cov)  # Cholesky-whitened chi2, compiled once
         self.ngal = ngal
         self.ngal_std = ngal_std
 
@@ -50,8 +54,7 @@ class ObsData:
             chi_n = ( (n_data - n_mock)  / sigma_n ) ** 2  
             
         # Here we assume a Gaussian likelihood for simplicity
-        diff = self.data - theory_density['clustering']
-        chi_clustering = np.dot(diff.T, np.dot(self.icov, diff))
+        chi_clustering = self.like.chi2(theory_density['clustering'])
         
         # total chi-squared
         chi = chi_clustering + chi_n
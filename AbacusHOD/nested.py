@@ -13,6 +13,7 @@ $ python ./nested.py --help
 
 import argparse
 import os
+import sys
 
 import dill
 import numpy as np
@@ -21,6 +22,9 @@ from dynesty import NestedSampler
 from scipy import stats
 
 from abacusnbody.hod.abacus_hod import AbacusHOD
+# the compiled Gaussian likelihood lives in hod-variation/source (appended, so the local mypmn wins)
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'hod-variation', 'source')))
+from data_object import gaussian_chi2
 
 DEFAULTS = {}
 DEFAULTS['path2config'] = 'config/lrg_y3wp.yaml'
@@ -33,6 +37,7 @@ class ObsData:
         """Initialize with observed data and covariance matrix. Optional number density and its standard deviation."""
         self.data = data
         self.cov = cov
+        self.like = gaussian_chi2(data, cov)  # Cholesky-whitened chi2, compiled once
         self.ngal = ngal
         self.ngal_std = ngal_std
 
@@ -48,9 +53,7 @@ class ObsData:
             chi_n = ( (n_data - n_mock)  / sigma_n ) ** 2  
             
         # Here we assume a Gaussian likelihood for simplicity
-        diff = self.data - theory_density['clustering']
-        inv_cov = np.linalg.inv(self.cov)
-        chi_clustering = np.dot(diff.T, np.dot(inv_cov, diff))
+        chi_clustering = self.like.chi2(theory_density['clustering'])
         
         # total chi-squared
         chi = chi_clustering + chi_n
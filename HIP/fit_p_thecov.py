@@ -15,8 +15,8 @@ import sys, os
 src_path = os.path.abspath(os.path.join(THIS_REPO, 'src'))
 sys.path.insert(0, src_path)
 from HIPanOBSample import HIPanOBSample
-from io_def import ensure_dir, path_to_catalog, path_to_poles
-from thecov_helper import read_mock, power_spectrum, thecov_box
+from io_def import ensure_dir, path_to_catalog, path_to_poles, path_to_pscov
+from thecov_helper import read_mock, power_spectrum, thecov_box, load_pscov
 from desilike_helper import prepare_theory, plot_observable
 
 WORK_DIR = Path(sys.argv[1])
@@ -34,6 +34,7 @@ priors = {
 
 fname = path_to_catalog(sim_params=hip.cfgHOD['sim_params'], tracer=hip.OBSample['tracer'], prefix=prefix)
 path2poles = path_to_poles(sim_params=hip.cfgHOD['sim_params'], tracer=hip.OBSample['tracer'], prefix=prefix)
+path2pscov = path_to_pscov(sim_params=hip.cfgHOD['sim_params'], tracer=hip.OBSample['tracer'], prefix=prefix)
 ODIR = WORK_DIR / "HIP" / "mocks" / prefix
 ensure_dir(ODIR)
 fn_chain = ODIR / "chain_zeus"
@@ -47,9 +48,13 @@ klim = {0: [0.003, 0.1]}
 ## measure power spectrum
 boxL = 2000.0  # Mpc/h
 boxV = boxL**3  # (Mpc/h)^3
-pos, nbar = read_mock(fname, boxV=boxV)
-data = power_spectrum(pos, path2poles=path2poles)
-cov = thecov_box(pk_theory=data, nbar=nbar, volume=boxV, has_shotnoise_set=False)
+if os.path.exists(path2pscov):
+    # measured in memory when the mock was generated, no catalog round-trip
+    data, nbar, cov = load_pscov(path2pscov)
+else:
+    pos, nbar = read_mock(fname, boxV=boxV)
+    data = power_spectrum(pos, path2poles=path2poles)
+    cov = thecov_box(pk_theory=data, nbar=nbar, volume=boxV, has_shotnoise_set=False)
 
 theory = prepare_theory(z=hip.OBSample['zsnap'], cosmology='DESI', mode=mode, fnl=fnl, priors=priors, fix_fNL=True)
 
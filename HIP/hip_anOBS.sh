@@ -23,6 +23,10 @@ python HIP/hip_an_OBSample.py --tracer ${tracer} --zmin ${zmin} --zmax ${zmax} -
 source /global/common/software/desi/desi_environment.sh # for the numba version compatibility for AbacusHOD
 chain_root="/pscratch/sd/s/siyizhao/desi-dr2-hod/QSO-fnl100/z1_base-A/chain_v2.1_"
 python HIP/hip_an_HODchain.py --work_dir ${WORK_DIR} --chain_root ${chain_root} > ${WORK_DIR}/logs/hip_an_HODchain.log 2>&1 # would take ~10 mins
+## or distribute the mocks over ranks (one subsample load per rank; re-running skips finished samples):
+# srun -N 4 -n 8 -c 32 --cpu-bind=cores python HIP/hip_an_HODchain.py --work_dir ${WORK_DIR} --chain_root ${chain_root} --mpi > ${WORK_DIR}/logs/hip_an_HODchain.log 2>&1
+## --pscov measures the power spectrum and thecov covariance in memory instead of writing the catalogs;
+## it imports pypower, cosmoprimo and thecov, so only use it in an environment with both these and AbacusHOD's numba.
 
 source /global/common/software/desi/users/adematti/cosmodesi_environment.sh main # for pypower
 # python HIP/plot_sample_2PCF.py --WORKDIR ${WORK_DIR}
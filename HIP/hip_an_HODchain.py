@@ -15,8 +15,17 @@ argparser.add_argument('--zmin', type=float, default=2.8, help='Minimum redshift
 argparser.add_argument('--zmax', type=float, default=3.5, help='Maximum redshift of the sample')
 argparser.add_argument('--work_dir', type=str, default=None, help='Working directory for the analysis')
 argparser.add_argument('--chain_root', type=str, default=None, help='Root path of the HOD chain files')
+argparser.add_argument('--pscov', action='store_true', help='Measure the power spectrum and thecov covariance of the sampled mocks in memory (needs pypower, cosmoprimo and thecov next to AbacusHOD); default: write the h5 catalogs')
+argparser.add_argument('--write_cat', action='store_true', help='With --pscov, also write the h5 catalogs of the sampled mocks')
+argparser.add_argument('--mpi', action='store_true', help='Distribute the HOD mocks over MPI ranks (srun -n <ranks>)')
 args = argparser.parse_args()
 
+mpicomm, rank = None, 0
+if args.mpi:
+    from mpi4py import MPI
+    mpicomm = MPI.COMM_WORLD
+    rank = mpicomm.rank
+
 tracer = args.tracer
 zmin = args.zmin
 zmax = args.zmax
@@ -38,8 +47,12 @@ hip = HIPanOBSample(cfg_file=WORK_DIR / "config.yaml")
 if chain_root is None:
     chain_root = hip.HODfit['path2chain'] + '/' + hip.HODfit['chain_prefix']
 print(f"Sampling HOD parameters from chain root: {chain_root}\n")
-samples = hip.sample_HOD_params(chain_root=chain_root, num=100, plot=True)
-hip.sample_HOD_mocks(params_list=samples, nthread=nthread, write_cat=True, want_2PCF=True, want_poles=False)
+samples = None
+if rank == 0:
+    samples = hip.sample_HOD_params(chain_root=chain_root, num=100, plot=True)
+hip.sample_HOD_mocks(params_list=samples, nthread=nthread, write_cat=args.write_cat or not args.pscov, want_2PCF=True, want_poles=False, want_pscov=args.pscov, mpicomm=mpicomm)
+if rank != 0:
+    sys.exit(0)
 
 hip.fit_p_chain()
 
@@ -15,6 +15,7 @@ src_path = os.path.abspath(os.path.join(THIS_REPO, 'src'))
 sys.path.insert(0, src_path)
 from HIPanOBSample import HIPanOBSample
 from io_def import path_to_poles
+from load_poles import load_EZmocks
 
 # %%
 def argument_parser():
@@ -59,21 +60,6 @@ def load_sampled_HOD_mocks(data, k_1st=None, num=1):
         }
     return data
 
-# %%
-def load_EZmocks(dirEZmocks):
-    files = glob.glob(dirEZmocks+f'/pypowerpoles_r*.npy')
-    p0_ez = []
-    for fn in files:
-        poles = PowerSpectrumMultipoles.load(fn) 
-        k_ez, p0 = poles(ell=0, return_k=True, complex=False)
-        if not np.allclose(k_ez, k_1st, equal_nan=True):
-            raise ValueError("k arrays do not match!")
-        p0_ez.append(p0)
-    p0_ez_avg = np.mean(p0_ez, axis=0)
-    p0_err = np.std(p0_ez, axis=0)
-    print(f"Loaded {len(files)} EZmock power spectra from {dirEZmocks}")
-    return p0_ez, p0_ez_avg, p0_err
-    
 # %%
 if __name__ == "__main__":
     args = argument_parser()
@@ -103,7 +89,7 @@ if __name__ == "__main__":
     data = load_sampled_HOD_mocks(data, k_1st=k_1st, num=num)
     ### EZmocks loading
     if dirEZmocks is not None:
-        p0_ez, p0_ez_avg, p0_err = load_EZmocks(dirEZmocks)
+        p0_ez, p0_ez_avg, p0_err = load_EZmocks(dirEZmocks, k_1st=k_1st)
     
     ### define base
     if base in data.keys():
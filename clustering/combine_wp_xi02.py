@@ -5,6 +5,8 @@ import argparse
 import numpy as np
 from pycorr import TwoPointEstimator
 import h5py
+import os, sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
 
 parser = argparse.ArgumentParser(description='Process LRG data')
 parser.add_argument('--input', '-i', default='/global/cfs/cdirs/desi/users/arocher/Y3/loa-v1/v1.1/PIP/', help='Input directory containing rppi and smu data')
@@ -29,17 +31,8 @@ def readxi02(path):
     err=np.sqrt(np.diag(cov))
     return xi, cov, err, allcounts, sep
 
-def get_realizations(allcounts,idx,mode):
-    jk=np.empty((len(idx),len(allcounts.realizations)))
-    for i in allcounts.realizations:
-        jk[:,i]=allcounts.realization(i)[::2].get_corr(mode=mode,return_sep=True)[1].flatten()[idx]
-    return jk
-
-def get_combined_jkcov(allcountswp,allcountsxi,idxwp,idxxi02):
-    jkwp=get_realizations(allcountswp,idxwp,'wp')
-    jkxi02=get_realizations(allcountsxi,idxxi02,'poles')
-    jkall=np.concatenate((jkwp,jkxi02))
-    return (127 * np.cov(jkall,ddof=0)) ##127 is hardcoded, as jackknife have 128 subregions, if you are using a different number please change to Nsub-1
+# vectorised jackknife realizations, shared with src/HOD_prepare
+from jackknife_helper import get_realizations, get_combined_jkcov
 
 if tracer=='LRG':
     redshift_ranges = {'z0': '0.4-0.6', 'z1': '0.6-0.8', 'z2': '0.8-1.1'}
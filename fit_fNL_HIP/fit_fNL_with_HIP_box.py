@@ -40,7 +40,7 @@ fix_p = config.get('fix_p', False)
 p_fixed_value = config.get('p_fixed_value', 1.0)
 
 ### enable thecov box covariance, default is EZmocks
-cov_mode = config.get('cov_mode', 'EZmocks')  # 'EZmocks' or 'thecov_box'
+cov_mode = config.get('cov_mode', 'EZmocks')  # 'EZmocks', 'EZmocks_stream' or 'thecov_box'
 
 ## define output ---------------------------------------------------------------
 ensure_dir(odir)
@@ -65,9 +65,9 @@ theory = prepare_theory(z=z, mode=mode, priors=priors, fix_fNL=False, fix_p=fix_
 for key in theory.params:
     print(key, theory.params[key].value, theory.params[key].fixed, theory.params[key].derived, theory.params[key].prior, theory.params[key].ref)
 
-if cov_mode == 'EZmocks':
+if not isinstance(data, dict):
     observable = TracerPowerSpectrumMultipolesObservable(data=data, covariance=cov, ells=ells, klim={0: klim0}, theory=theory)
-elif cov_mode == 'thecov_box':
+else:  # 'thecov_box', 'EZmocks_stream', 'EZmocks' from a packed store: dict of k and P_0
     observable = TracerPowerSpectrumMultipolesObservable(data=data['P_0'], covariance=cov, ells=ells, k=data['k'], klim={0: klim0}, theory=theory)
 
 likelihood = ObservablesGaussianLikelihood(observables=[observable])
@@ -10,6 +10,7 @@ fix_p = False
 p_fixed_value = 1.6
 ## data
 # cov_mode = 'EZmocks'
+# cov_mode = 'EZmocks_stream'  # EZmock covariance accumulated in one pass, with the Hartlap factor
 cov_mode = 'thecov_box'
 ### data: EZmocks
 abacus_poles = '/pscratch/sd/s/siyizhao/desi-dr2-hod/mocks_base-A_v2/abacus_HF/DR2_v2.0/Abacus_pngbase_c302_ph000/Boxes/QSO/z3p000/MAP_QSO_pypower_poles.npy'
@@ -43,7 +44,7 @@ else:
         'scale': p_sigma,
         'limits': [0, 4]
     }
-if cov_mode == 'EZmocks':
+if cov_mode in ('EZmocks', 'EZmocks_stream'):
     configs['cov_mode'] = cov_mode
     configs['n_EZmocks'] = n_EZmocks
     configs['input']['abacus_poles'] = abacus_poles
@@ -23,7 +23,7 @@ from config_helpers import generate_config, fit_params_overrides, merge_override
 src_dir = os.path.join(file_dir,"..","src")
 if src_dir not in sys.path:
     sys.path.insert(0, src_dir)
-from io_def import ensure_dir, load_config, prefix_HOD
+from io_def import ensure_dir, load_config, prefix_HOD, ZBINS_DR2
 
 ### settings -------------------------------------------------------------------
 _DEFAULT_FNL = 100
@@ -73,10 +73,7 @@ fitdir=HOD.get("fit_dir", f"/pscratch/sd/s/siyizhao/desi-dr2-hod/loa-v2_HOD{vers
 ensure_dir(fitdir)
 
 ### Info: different redshift bins ----------------------------------------------
-zbins = {
-    'LRG': {'z1': (0.4, 0.6), 'z2': (0.6, 0.8), 'z3': (0.8, 1.1)},
-    'QSO': {'z1': (0.8, 1.1), 'z2': (1.1, 1.4), 'z3': (1.4, 1.7), 'z4': (1.7, 2.3), 'z5': (2.3, 2.8), 'z6': (2.8, 3.5)}
-}
+zbins = ZBINS_DR2  # shared with prep_data_batch.py
 ## from prep_data.py output
 nbar_all = {
     'LRG': {'z1': 0.0005241, 'z2': 0.0005247, 'z3': 0.0002834}, 
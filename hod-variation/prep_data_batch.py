@@ -0,0 +1,47 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""
+Prepare the data for HOD fitting (wp, xi02 and jackknife covariance files, zeff, nbar) of all
+the DR2 bins of prep_configs.py in one command, on a process pool, see
+HOD_prepare.prepare_HOD_fitting_batch. A manifest.yaml with the files, zeff, nbar and the
+per-stage timings of each bin is written in the output directory.
+
+Usage
+-----
+$ source /global/common/software/desi/users/adematti/cosmodesi_environment.sh main
+$ python prep_data_batch.py --nproc 9 [--tracers LRG QSO] [--outdir ../data/for_hod/v2_rp6s11/]
+
+Author: Siyi Zhao
+"""
+
+import argparse
+import os
+import sys
+file_dir = os.path.dirname(os.path.abspath(__file__))
+src_dir = os.path.join(file_dir,"..","src")
+if src_dir not in sys.path:
+    sys.path.insert(0, src_dir)
+from io_def import ZBINS_DR2
+from HOD_prepare import prepare_HOD_fitting_batch
+
+parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+parser.add_argument("--data_version", type=str, default='v2', help="loa-v1 version of the catalogs and measurements")
+parser.add_argument("--tracers", type=str, nargs='+', default=list(ZBINS_DR2), help="tracers of ZBINS_DR2 to prepare")
+parser.add_argument("--outdir", type=str, default=None, help="output directory, default ../data/for_hod/{data_version}_rp6s11/")
+parser.add_argument("--nproc", type=int, default=None, help="number of processes, default one per bin")
+args = parser.parse_args()
+data_version = args.data_version
+outdir = args.outdir or os.path.join(file_dir, f'../data/for_hod/{data_version}_rp6s11/')
+
+## arocher's meas, and mine for the high-z QSO (z4-z6), as in prep_data.py
+data_dir = {tracer: f'/global/cfs/cdirs/desi/users/arocher/Y3/loa-v1/{data_version}/PIP/cosmo_0/' for tracer in ZBINS_DR2}
+for tag in ['z4', 'z5', 'z6']:
+    data_dir[f'QSO_{tag}'] = f'/global/cfs/cdirs/desi/users/siyizhao/Y3/loa-v1/{data_version}/PIP/'
+y3nzdir = f'/global/cfs/cdirs/desi/survey/catalogs/DA2/LSS/loa-v1/LSScats/{data_version}/PIP/'
+y3catdir = f'/dvs_ro/cfs/cdirs/desi/survey/catalogs/Y3/LSS/loa-v1/LSScats/{data_version}/PIP/'
+
+if __name__ == "__main__":
+    zbins = {tracer: ZBINS_DR2[tracer] for tracer in args.tracers}
+    prepare_HOD_fitting_batch(zbins, outdir=outdir, data_dir=data_dir, cat_dir=y3catdir, nz_dir=y3nzdir,
+                              nproc=args.nproc or sum(len(bins) for bins in zbins.values()))
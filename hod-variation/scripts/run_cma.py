@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+This is a script for finding the best-fit HOD with CMA-ES, evaluating each generation with
+the batched likelihood (fit_helpers.log_likelihood_batch).
+
+The population size and the number of iterations are read from `cma_options` in the config
+(see config_helpers.DEFAULT_CONFIG). The search runs in the unit cube mapped onto the prior bounds.
+
+Usage
+-----
+$ python ./run_cma.py --help
+"""
+
+import argparse
+import yaml
+import os, sys
+import numpy as np
+# Add the source directory to the PYTHONPATH.
+current_dir = os.path.dirname(os.path.abspath(__file__))
+source_dir = os.path.abspath(os.path.join(current_dir, "..", "source"))
+if source_dir not in sys.path:
+    sys.path.insert(0, source_dir)
+from data_object import data_object
+from fit_helpers import set_global_objects, generate_prior, check_prepass, check_ngal_batch, log_likelihood_batch
+from cache_helpers import eval_cache, config_hash
+from prepass_helpers import halo_mass_histogram
+
+from abacusnbody.hod.abacus_hod import AbacusHOD
+
+def main():
+    import cma
+
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=ArgParseFormatter
+    )
+    parser.add_argument('--config', type=str, required=True, help="Path to YAML configuration file")
+    args = parser.parse_args()
+
+    with open(args.config, 'r') as f:
+        config_full = yaml.safe_load(f)
+    sim_params = config_full.get("sim_params", {})
+    HOD_params = config_full.get("HOD_params", {})
+    clustering_params = config_full.get("clustering_params", {})
+    data_params = config_full.get("data_params", {})
+    fit_params = config_full.get("fit_params", {})
+    chain_params = config_full.get("chain_params", {})
+    cma_options = dict(config_full.get("cma_options", {"popsize": 100, "maxiter": 200}))
+    nthread = config_full.get("nthread", 64)
+
+    data_obj = data_object(data_params, HOD_params, clustering_params)
+    prior, param_mapping = generate_prior(fit_params)
+    active_tracers = list(fit_params.keys())
+    global_config = {
+        "sim_params": sim_params,
+        "HOD_params": HOD_params,
+        "clustering_params": clustering_params,
+        "param_mapping": param_mapping,
+        "fit_params": fit_params,
+        "tracers": active_tracers,
+        "prepass_fsat_tol": chain_params.get('prepass_fsat_tol', 0.05),
+    }
+
+    newBall = AbacusHOD(sim_params, HOD_params, clustering_params)
+    mass_hist = halo_mass_histogram(newBall) if chain_params.get('prepass', True) else None
+
+    chain_prefix = chain_params['chain_prefix']
+    output_dir = chain_params['output_dir']
+    cache = None
+    if chain_params.get('eval_cache', True):
+        cache_dir = chain_params.get('eval_cache_dir', os.path.join(output_dir, 'eval_cache'))
+        namespace = config_hash(config_full) + '_' + sim_params['sim_name']
+        cache = eval_cache(cache_dir, namespace)
+    set_global_objects(data_obj, global_config, nthread, newBall, cache=cache, mass_hist=mass_hist)
+    # the prepass bound is checked against compute_ngal on a few prior draws
+    if mass_hist is not None and not check_prepass(chain_params.get('prepass_check', 8)):
+        mass_hist = None
+    # the one-pass ngal/fsat of log_likelihood_batch is used only if it agrees with compute_ngal
+    check_ngal_batch()
+
+    # The free-parameter vector is ordered by the provided indices.
+    ndim = len(prior)
+    low, high = np.zeros(ndim), np.zeros(ndim)
+    names = [''] * ndim
+    for tracer in active_tracers:
+        for pname, values in fit_params[tracer].items():
+            low[values[0]], high[values[0]] = values[1], values[2]
+            names[values[0]] = f"{tracer}.{pname}"
+
+    sigma0 = cma_options.pop('sigma0', 0.3)
+    cma_options.setdefault('bounds', [0, 1])
+    es = cma.CMAEvolutionStrategy(np.full(ndim, 0.5), sigma0, cma_options)
+    while not es.stop():
+        cubes = np.array(es.ask())
+        loglike = log_likelihood_batch(low + cubes * (high - low))
+        # CMA-ES minimizes; rejected points get a finite, very bad value.
+        es.tell(list(cubes), list(np.where(np.isfinite(loglike), -loglike, 1e101)))
+        es.disp()
+
+    best = low + np.asarray(es.result.xbest) * (high - low)
+    fn = os.path.join(output_dir, chain_prefix + '_cma_bestfit.txt')
+    np.savetxt(fn, best[None, :], header=' '.join(names) + f'  lnL = {-es.result.fbest}')
+    print(f"[write] -> {fn}")
+    if cache is not None:
+        cache.close()
+
+class ArgParseFormatter(
+    argparse.RawDescriptionHelpFormatter, argparse.ArgumentDefaultsHelpFormatter
+):
+    pass
+
+if __name__ == '__main__':
+    main()
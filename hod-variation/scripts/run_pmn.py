@@ -21,7 +21,9 @@ if source_dir not in sys.path:
     sys.path.insert(0, source_dir)
 from data_object import data_object
 from mypmn import my_pmn
-from fit_helpers import set_global_objects, generate_prior, log_likelihood
+from fit_helpers import set_global_objects, generate_prior, check_prepass, log_likelihood
+from cache_helpers import eval_cache, config_hash
+from prepass_helpers import halo_mass_histogram
 
 from abacusnbody.hod.abacus_hod import AbacusHOD
 # from abacusnbody.hod.utils import setup_logging
@@ -67,21 +69,32 @@ def main():
         "param_mapping": param_mapping,
         "fit_params": fit_params,
         "tracers": active_tracers,
+        "prepass_fsat_tol": chain_params.get('prepass_fsat_tol', 0.05),
     }
     print(global_config)
     
     # create a new abacushod object and load the subsamples
     newBall = AbacusHOD(sim_params, HOD_params, clustering_params)
-
-    # Note: We do NOT set the heavy AbacusHOD object here.
-    set_global_objects(data_obj, global_config, nthread, newBall)
-
-    
-
+    # halo mass histogram for the cheap ngal/fsat pre-pass
+    mass_hist = halo_mass_histogram(newBall) if chain_params.get('prepass', True) else None
 
     # pmn parameters
     chain_prefix = chain_params['chain_prefix']
     output_dir = chain_params['output_dir']
+
+    # Cache of the likelihood evaluations, reused when the chain is resumed or re-fitted.
+    cache = None
+    if chain_params.get('eval_cache', True):
+        cache_dir = chain_params.get('eval_cache_dir', os.path.join(output_dir, 'eval_cache'))
+        namespace = config_hash(config_full) + '_' + sim_params['sim_name']
+        cache = eval_cache(cache_dir, namespace)
+
+    # Note: We do NOT set the heavy AbacusHOD object here.
+    set_global_objects(data_obj, global_config, nthread, newBall, cache=cache, mass_hist=mass_hist)
+    # the prepass bound is checked against compute_ngal on a few prior draws
+    if mass_hist is not None and not check_prepass(chain_params.get('prepass_check', 8)):
+        mass_hist = None
+
     nlive = chain_params['nlive']
     tol  = chain_params['tol']
     labels = chain_params.get('labels', None)
@@ -100,6 +113,10 @@ def main():
     # print('lnL of the MAP on fNL=30:', test2)
     ## run 
     fit_.run_pmn()
+    if cache is not None:
+        cache.close()
+    if mass_hist is not None:
+        print(f"[prepass] {mass_hist.nreject} proposals rejected before compute_ngal.")
 
     ## plot
     # fit_.plot_result(plot_path=pmn_config_params['plot'])
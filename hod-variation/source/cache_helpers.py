@@ -0,0 +1,122 @@
+# source/cache_helpers.py
+# Persistent cache of log-likelihood evaluations for the HOD fitting.
+
+import os
+import glob
+import json
+import socket
+import sqlite3
+import hashlib
+from collections import OrderedDict
+
+import numpy as np
+
+
+def config_hash(config, sections=("sim_params", "HOD_params", "clustering_params", "data_params")):
+    """
+    Hash the parts of the configuration that change the value of the likelihood.
+
+    The prior bounds in fit_params are deliberately left out (only the parameter
+    index and the 'flat'/'log' type enter the hash), so that a re-fit with a changed
+    prior still hits the points evaluated before.
+
+    Parameters:
+      config (dict): The full YAML configuration or the global config of fit_helpers.
+      sections (tuple): Top-level keys entering the hash.
+
+    Returns:
+      str: Hex digest.
+    """
+    payload = {key: config.get(key, {}) for key in sections}
+    fit_params = config.get("fit_params", {})
+    payload["fit_params"] = {
+        tracer: {pname: [values[0], values[3] if len(values) > 3 else "flat"] for pname, values in params.items()}
+        for tracer, params in fit_params.items()
+    }
+    text = json.dumps(payload, sort_keys=True, default=str)
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+class eval_cache:
+    '''
+    Two-level cache of log-likelihood values keyed by the (rounded) free-parameter vector.
+
+    - memory: an LRU dictionary holding the most recent `maxsize` evaluations.
+    - disk: one SQLite file per writing process in `cache_dir`, so that MPI ranks never
+      share a writer. Files left by earlier runs (e.g. before a MultiNest resume) are
+      opened read-only and searched on a memory miss.
+    '''
+    def __init__(self, cache_dir, namespace, decimals=6, maxsize=100000, verbose=True):
+        '''
+        cache_dir: directory holding the SQLite shards, created if missing.
+        namespace: string identifying the likelihood, e.g. config_hash(...) + sim_name.
+        decimals: the parameter vector is rounded to this many decimals before hashing.
+        maxsize: number of entries kept in the in-memory LRU layer.
+        '''
+        self.cache_dir = cache_dir
+        self.namespace = namespace
+        self.decimals = decimals
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._memory = OrderedDict()
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        shard = os.path.join(self.cache_dir, f"evals_{socket.gethostname()}_{os.getpid()}.sqlite")
+        self._readers = []
+        for fn in sorted(glob.glob(os.path.join(self.cache_dir, "evals_*.sqlite"))):
+            if fn == shard:
+                continue
+            try:
+                self._readers.append(sqlite3.connect(f"file:{fn}?mode=ro", uri=True))
+            except sqlite3.Error as e:
+                print(f"Warning: cannot open cache shard {fn}: {e}")
+        self._writer = sqlite3.connect(shard)
+        self._writer.execute("CREATE TABLE IF NOT EXISTS evals (key TEXT PRIMARY KEY, loglike REAL)")
+        self._writer.commit()
+        if verbose:
+            print(f"[cache] {len(self._readers)} existing shard(s) in {self.cache_dir}, writing to {shard}")
+
+    def key(self, free_params):
+        'Hash of the namespace and the rounded parameter vector.'
+        rounded = np.round(np.asarray(free_params, dtype=np.float64), self.decimals) + 0.  # +0. maps -0. to 0.
+        text = self.namespace + "|" + ",".join(repr(float(v)) for v in rounded)
+        return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+    def get(self, free_params):
+        'Return the cached log-likelihood, or None on a miss.'
+        key = self.key(free_params)
+        if key in self._memory:
+            self._memory.move_to_end(key)
+            self.hits += 1
+            return self._memory[key]
+        for conn in [self._writer] + self._readers:
+            try:
+                row = conn.execute("SELECT loglike FROM evals WHERE key=?", (key,)).fetchone()
+            except sqlite3.Error:
+                row = None
+            if row is not None:
+                self._remember(key, row[0])
+                self.hits += 1
+                return row[0]
+        self.misses += 1
+        return None
+
+    def put(self, free_params, loglike):
+        'Store one evaluation in both layers.'
+        key = self.key(free_params)
+        loglike = float(loglike)
+        self._remember(key, loglike)
+        self._writer.execute("INSERT OR REPLACE INTO evals (key, loglike) VALUES (?, ?)", (key, loglike))
+        self._writer.commit()
+
+    def _remember(self, key, loglike):
+        self._memory[key] = loglike
+        self._memory.move_to_end(key)
+        if len(self._memory) > self.maxsize:
+            self._memory.popitem(last=False)
+
+    def close(self):
+        for conn in [self._writer] + self._readers:
+            conn.close()
+        print(f"[cache] {self.hits} hits, {self.misses} misses.")
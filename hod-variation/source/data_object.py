@@ -2,6 +2,45 @@
 # Credit: https://github.com/ahnyu/hod-variation/
 
 import numpy as np
+from scipy.linalg import cholesky, solve_triangular
+
+class gaussian_chi2:
+    '''
+    Gaussian chi2 of a fixed data vector, compiled once from its covariance.
+
+    With cov = L L^T, chi2 = |L^{-1} (data - theory)|^2. The whitening matrix L^{-1} and
+    the residual buffers are allocated at init, so one evaluation is a subtraction, a
+    triangular mat-vec and a dot product without new temporaries. A batch of theory
+    vectors of shape (N, ndata) is evaluated with one mat-mat product.
+    '''
+    def __init__(self, data, cov):
+        '''
+        data: observed data vector, shape (ndata,).
+        cov: covariance matrix, shape (ndata, ndata).
+        '''
+        self.data = np.ascontiguousarray(data, dtype=np.float64).ravel()
+        self.cov = np.asarray(cov, dtype=np.float64)
+        self.ndata = len(self.data)
+        if self.cov.shape != (self.ndata, self.ndata):
+            raise ValueError(f"Covariance of shape {self.cov.shape} does not match data of length {self.ndata}.")
+        self.chol = cholesky(self.cov, lower=True)
+        self.whiten = solve_triangular(self.chol, np.eye(self.ndata), lower=True)
+        self._diff = np.empty(self.ndata)
+        self._white = np.empty(self.ndata)
+
+    def chi2(self, theory):
+        'Chi2 of one theory vector of length ndata.'
+        np.subtract(self.data, theory, out=self._diff)
+        np.dot(self.whiten, self._diff, out=self._white)
+        return float(np.dot(self._white, self._white))
+
+    def chi2_batch(self, theory):
+        'Chi2 of a batch of theory vectors, shape (N, ndata) -> (N,).'
+        white = (self.data - np.asarray(theory, dtype=np.float64)) @ self.whiten.T
+        return np.einsum('ij,ij->i', white, white)
+
+    def loglike(self, theory):
+        return -0.5 * self.chi2(theory)
 
 class data_object:
     def __init__(self, data_params, hod_params, clustering_params):
@@ -22,6 +61,7 @@ class data_object:
           - self.xi02: Dictionary with composite keys → loaded xi02 arrays (using columns 1 and 3; only if clustering_type=='all').
           - self.cov: Dictionary with composite keys → loaded covariance arrays.
           - self.invcov: Dictionary with composite keys → inverse covariance matrices.
+          - self.chi2: Dictionary with composite keys → gaussian_chi2 objects used by compute_loglike.
           - self.density_mean: Dictionary keyed by tracer → observed mean densities.
           - self.density_std: Dictionary keyed by tracer → observed density standard deviations.
           - self.clustering: Dictionary with composite keys → flattened clustering data.
@@ -32,6 +72,7 @@ class data_object:
         self.xi02 = {}
         self.cov = {}
         self.invcov = {}
+        self.chi2 = {}
         self.density_mean = {}
         self.density_std = {}
         self.clustering = {}
@@ -64,6 +105,9 @@ class data_object:
                 print(f"Warning: Density mean not found for tracer {tracer}.")
             if tracer in density_std_all:
                 self.density_std[tracer] = density_std_all[tracer]
+            elif tracer in self.density_mean:
+                raise ValueError(f"Density std not found for tracer {tracer}, whose density mean is given: "
+                                 f"add it to tracer_density_std.")
             else:
                 print(f"Warning: Density std not found for tracer {tracer}.")
 
@@ -75,6 +119,18 @@ class data_object:
                 self.clustering[composite_key] = np.hstack([wp_flat, xi02_flat])
             else:
                 self.clustering[composite_key] = np.ravel(self.wp[composite_key])
+            self.chi2[composite_key] = gaussian_chi2(self.clustering[composite_key], self.cov[composite_key])
+
+        # Flattened for the hot path of compute_loglike.
+        self._clustering_keys = list(self.chi2.keys())
+        self._density_items = [(tracer, self.density_mean[tracer], self.density_std[tracer] ** 2)
+                               for tracer in self.density_mean]
+        self._warned = set()
+
+    def _warn_once(self, key, message):
+        if key not in self._warned:
+            self._warned.add(key)
+            print(message)
 
     def compute_loglike(self, theory_clustering, theory_density):
         """
@@ -94,21 +150,45 @@ class data_object:
         Returns:
           float: Total log-likelihood.
         """
-        loglike_cluster = 0.0
-        for comp_key, observed in self.clustering.items():
-            if comp_key not in theory_clustering:
-                print(f"Warning: No theory clustering for {comp_key}.")
+        loglike = 0.0
+        for comp_key in self._clustering_keys:
+            theory = theory_clustering.get(comp_key)
+            if theory is None:
+                self._warn_once(comp_key, f"Warning: No theory clustering for {comp_key}.")
+                continue
+            loglike -= 0.5 * self.chi2[comp_key].chi2(theory)
+
+        for tracer, obs_density, var in self._density_items:
+            theory = theory_density.get(tracer)
+            if theory is None:
+                self._warn_once(tracer, f"Warning: No theory density for tracer {tracer}.")
+                continue
+            loglike -= 0.5 * (obs_density - theory) ** 2 / var
+        return loglike
+
+    def compute_loglike_batch(self, theory_clustering, theory_density):
+        """
+        Batched version of compute_loglike.
+
+        Parameters:
+          theory_clustering (dict): composite keys → arrays of shape (N, ndata).
+          theory_density (dict): tracer keys → arrays of shape (N,).
+
+        Returns:
+          np.ndarray: Log-likelihoods, shape (N,).
+        """
+        loglike = 0.0
+        for comp_key in self._clustering_keys:
+            theory = theory_clustering.get(comp_key)
+            if theory is None:
+                self._warn_once(comp_key, f"Warning: No theory clustering for {comp_key}.")
                 continue
-            diff = observed - theory_clustering[comp_key]
-            chi2 = diff.dot(self.invcov[comp_key].dot(diff))
-            loglike_cluster += -0.5 * chi2
-
-        loglike_density = 0.0
-        for tracer, obs_density in self.density_mean.items():
-            if tracer not in theory_density:
-                print(f"Warning: No theory density for tracer {tracer}.")
+            loglike = loglike - 0.5 * self.chi2[comp_key].chi2_batch(theory)
+
+        for tracer, obs_density, var in self._density_items:
+            theory = theory_density.get(tracer)
+            if theory is None:
+                self._warn_once(tracer, f"Warning: No theory density for tracer {tracer}.")
                 continue
-            diff = obs_density - theory_density[tracer]
-            std = self.density_std[tracer]
-            loglike_density += -0.5 * (diff ** 2 / (std ** 2))
-        return loglike_cluster + loglike_density
+            loglike = loglike - 0.5 * (obs_density - np.asarray(theory)) ** 2 / var
+        return np.atleast_1d(loglike)
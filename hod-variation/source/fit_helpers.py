@@ -1,5 +1,6 @@
 # Credit: https://github.com/ahnyu/hod-variation/blob/main/source/pocomc_helpers.py , modified for our use case
 
+import time
 import numpy as np
 
 # Global variables to be set once per MPI process.
@@ -7,6 +8,9 @@ GLOBAL_BALL = None
 GLOBAL_DATA_OBJ = None       
 GLOBAL_CONFIG = None         
 GLOBAL_NTHREAD = None   
+GLOBAL_CACHE = None
+GLOBAL_MASS_HIST = None
+GLOBAL_NGAL_BATCH = None     # None: ngal_fsat_batch not checked yet against compute_ngal
 
 def generate_prior(fit_params):
     """
@@ -38,7 +42,7 @@ def generate_prior(fit_params):
     
     return prior, param_mapping
 
-def set_global_objects(data_obj, config, nthread, newBall):
+def set_global_objects(data_obj, config, nthread, newBall, cache=None, mass_hist=None):
     """
     Set the global objects used by the pocomc_loglike function.
     
@@ -51,12 +55,18 @@ def set_global_objects(data_obj, config, nthread, newBall):
       config: A dictionary with keys "sim_params", "HOD_params", "clustering_params",
               "param_mapping", and "tracers".
       nthread: Number of threads to use.
+      cache: Optional cache_helpers.eval_cache; if given, log_likelihood looks up and stores
+             evaluations there.
+      mass_hist: Optional prepass_helpers.halo_mass_histogram; if given, proposals whose
+             estimated fsat is clearly above 0.6 are rejected before compute_ngal.
     """
-    global GLOBAL_DATA_OBJ, GLOBAL_CONFIG, GLOBAL_NTHREAD, GLOBAL_BALL
+    global GLOBAL_DATA_OBJ, GLOBAL_CONFIG, GLOBAL_NTHREAD, GLOBAL_BALL, GLOBAL_CACHE, GLOBAL_MASS_HIST
     GLOBAL_DATA_OBJ = data_obj
     GLOBAL_CONFIG = config
     GLOBAL_NTHREAD = nthread
     GLOBAL_BALL = newBall
+    GLOBAL_CACHE = cache
+    GLOBAL_MASS_HIST = mass_hist
 
 def log_likelihood(free_params):
     """
@@ -68,6 +78,8 @@ def log_likelihood(free_params):
                        "param_mapping", and "tracers".
       - GLOBAL_NTHREAD: Number of threads (integer).
       - GLOBAL_BALL: Expensive AbacusHOD instance; if not already loaded, it is lazily initialized.
+      - GLOBAL_CACHE: Optional eval_cache; points evaluated before (e.g. before a resume)
+                      are returned without running the HOD.
     
     Parameters:
       free_params (np.ndarray): Free parameters vector (ordered as in the pocoMC prior).
@@ -75,18 +87,165 @@ def log_likelihood(free_params):
     Returns:
       float: Total log-likelihood.
     """
-    global GLOBAL_BALL, GLOBAL_DATA_OBJ, GLOBAL_CONFIG, GLOBAL_NTHREAD
+    config = GLOBAL_CONFIG
+    # The prior bounds are checked before the cache, so a changed prior is always respected.
+    if not _within_bounds(config, free_params):
+        return -np.inf
+    if GLOBAL_CACHE is None:
+        return _log_likelihood(free_params)
+    loglike = GLOBAL_CACHE.get(free_params)
+    if loglike is not None:
+        return loglike
+    if not _assign_params(GLOBAL_BALL, config, free_params):
+        loglike = -np.inf
+    elif _prepass_reject():
+        # Not cached: the rejection depends on the prepass settings, not only on the point.
+        return -np.inf
+    else:
+        loglike = _log_likelihood_assigned()
+    GLOBAL_CACHE.put(free_params, loglike)
+    return loglike
+
+def _log_likelihood(free_params):
+    """
+    Evaluate the log-likelihood by running the HOD, without looking at the cache.
+    The prior bounds are assumed to be checked by the caller.
+    """
+    if not _assign_params(GLOBAL_BALL, GLOBAL_CONFIG, free_params):
+        return -np.inf
+    if _prepass_reject():
+        return -np.inf
+    return _log_likelihood_assigned()
+
+def _prepass_reject():
+    """
+    Cheap pre-pass on the halo mass histogram for the parameters in GLOBAL_BALL.tracers:
+    True for the clear fsat violations, without touching the particle arrays.
+    """
+    if GLOBAL_MASS_HIST is None:
+        return False
+    tol = GLOBAL_CONFIG.get("prepass_fsat_tol", 0.05)
+    return GLOBAL_MASS_HIST.reject(GLOBAL_CONFIG["tracers"], GLOBAL_BALL.tracers, fsat_max=0.6, tol=tol)
+
+def _prior_draws(config, npoint, seed):
+    '''
+    npoint free-parameter vectors drawn uniformly within the prior bounds.
+    '''
+    bounds = {}
+    for tracer in config["tracers"]:
+        for param_name, mapping_idx in config["param_mapping"][tracer].items():
+            bounds[mapping_idx] = config["fit_params"][tracer][param_name][1:3]
+    low, high = np.array([bounds[i] for i in range(len(bounds))]).T
+    return np.random.default_rng(seed).uniform(low, high, size=(npoint, len(bounds)))
+
+def check_prepass(npoint=8, seed=0, max_draws=None):
+    """
+    Compare the prepass lower bound of fsat with the fsat of compute_ngal on npoint prior
+    draws (draws rejected by _assign_params are replaced, up to max_draws, default 10 * npoint,
+    in total). If the bound is above compute_ngal for one of them, or no draw could be
+    compared, the prepass is disabled (GLOBAL_MASS_HIST set to None).
+
+    Returns:
+      bool: True if the prepass is kept.
+    """
+    global GLOBAL_MASS_HIST
+    if GLOBAL_MASS_HIST is None:
+        return False
+    ball = GLOBAL_BALL
+    config = GLOBAL_CONFIG
+    tracers = [tracer for tracer in config["tracers"] if tracer in ('LRG', 'QSO')]
+    nchecked = 0
+    for free_params in _prior_draws(config, max_draws or 10 * npoint, seed):
+        if nchecked == npoint:
+            break
+        if not _assign_params(ball, config, free_params):
+            continue
+        for tracer in config["tracers"]:
+            ball.tracers[tracer]['ic'] = 1
+        fsat_dict = ball.compute_ngal(Nthread=GLOBAL_NTHREAD)[1]
+        for tracer in tracers:
+            bound = GLOBAL_MASS_HIST.fsat_lower_bound(tracer, ball.tracers[tracer])
+            if bound > fsat_dict[tracer] * (1 + 1e-6) + 1e-9:
+                print(f"[prepass] {tracer}: bound {bound:.6g} above the fsat {fsat_dict[tracer]:.6g} of compute_ngal at {free_params}, prepass disabled.")
+                GLOBAL_MASS_HIST = None
+                return False
+        nchecked += 1
+    if nchecked == 0:
+        print("[prepass] no valid prior draw to check the fsat bound against compute_ngal, prepass disabled.")
+        GLOBAL_MASS_HIST = None
+        return False
+    print(f"[prepass] fsat bound checked against compute_ngal on {nchecked} prior draws.")
+    return True
+
+def check_ngal_batch(npoint=4, seed=1, rtol=1e-6, max_draws=None):
+    """
+    Compare prepass_helpers.ngal_fsat_batch with compute_ngal (ngal and fsat of the LRG and
+    QSO tracers, at ic = 1) on npoint prior draws. Draws rejected by _assign_params are
+    replaced, up to max_draws (default 10 * npoint) in total. The result is stored in
+    GLOBAL_NGAL_BATCH: log_likelihood_batch only uses ngal_fsat_batch if they agree within
+    rtol on at least one draw.
 
+    Returns:
+      bool: True if they agree.
+    """
+    global GLOBAL_NGAL_BATCH
+    from prepass_helpers import ngal_fsat_batch
+    ball = GLOBAL_BALL
+    config = GLOBAL_CONFIG
+    tracers = [tracer for tracer in config["tracers"] if tracer in ('LRG', 'QSO')]
+    hods, exact = [], []
+    for free_params in _prior_draws(config, max_draws or 10 * npoint, seed):
+        if len(hods) == npoint:
+            break
+        if not _assign_params(ball, config, free_params):
+            continue
+        for tracer in config["tracers"]:
+            ball.tracers[tracer]['ic'] = 1
+        hods.append({tracer: dict(ball.tracers[tracer]) for tracer in tracers})
+        exact.append(ball.compute_ngal(Nthread=GLOBAL_NTHREAD))
+    if len(hods) == 0:
+        print("[batch] no valid prior draw to check ngal_fsat_batch against compute_ngal, using compute_ngal.")
+        GLOBAL_NGAL_BATCH = False
+        return False
+    GLOBAL_NGAL_BATCH = True
+    for tracer in tracers:
+        ngal, fsat = ngal_fsat_batch(ball, tracer, [hod[tracer] for hod in hods])
+        ngal_ref = np.array([ngal_dict[tracer] for ngal_dict, _ in exact])
+        fsat_ref = np.array([fsat_dict[tracer] for _, fsat_dict in exact])
+        if not (np.allclose(ngal, ngal_ref, rtol=rtol, atol=0.) and np.allclose(fsat, fsat_ref, rtol=rtol, atol=1e-12)):
+            print(f"[batch] {tracer}: ngal_fsat_batch differs from compute_ngal (ngal {ngal} vs {ngal_ref}, fsat {fsat} vs {fsat_ref}), using compute_ngal.")
+            GLOBAL_NGAL_BATCH = False
+    if GLOBAL_NGAL_BATCH:
+        print(f"[batch] ngal_fsat_batch agrees with compute_ngal on {len(hods)} prior draws.")
+    return GLOBAL_NGAL_BATCH
+
+def _log_likelihood_assigned():
+    """
+    Log-likelihood of the parameters already in GLOBAL_BALL.tracers, with compute_ngal.
+    """
     ball = GLOBAL_BALL
-    data_obj = GLOBAL_DATA_OBJ
     config = GLOBAL_CONFIG
     nthread = GLOBAL_NTHREAD
-    box_volume = ball.params['Lbox']**3
+    # Reset 'ic' and compute theoretical number density.
+    for tracer in config["tracers"]:
+        ball.tracers[tracer]['ic'] = 1
+    ngal_dict, fsat_dict = ball.compute_ngal(Nthread=nthread)
+    # ngal_dict, fsat_dict = reset_fic(ball, config["tracers"], GLOBAL_DATA_OBJ.density_mean, nthread=nthread)
+
+    theory = _theory(ngal_dict, fsat_dict)
+    if theory is None:
+        return -np.inf
+    # Return total log-likelihood.
+    return GLOBAL_DATA_OBJ.compute_loglike(*theory)
+
+def _assign_params(ball, config, free_params):
+    """
+    Copy the free parameters into ball.tracers. Returns False if the proposal violates
+    the lower limit on kappa * M_cut.
+    """
     for tracer in config["tracers"]:
         for param_name in config["param_mapping"][tracer]:
             mapping_idx = config["param_mapping"][tracer][param_name]
-            if free_params[mapping_idx] > config["fit_params"][tracer][param_name][2] or free_params[mapping_idx] < config["fit_params"][tracer][param_name][1]:
-                return -np.inf
             if config["fit_params"][tracer][param_name][3] == 'log':
                 ball.tracers[tracer][param_name] = 10**free_params[mapping_idx]#.item()
             else:
@@ -95,21 +254,28 @@ def log_likelihood(free_params):
                 
     for tracer in config["tracers"]:
         if tracer == 'LRG' and 10**ball.tracers[tracer]["logM_cut"]*ball.tracers[tracer]["kappa"]<1e12:
-            return -np.inf
+            return False
         elif tracer == 'QSO'and 10**ball.tracers[tracer]["logM_cut"]*ball.tracers[tracer]["kappa"]<2e11:
-            return -np.inf
-            
-    
-    # Reset 'ic' and compute theoretical number density.
-    for tracer in config["tracers"]:
-        ball.tracers[tracer]['ic'] = 1
-    ngal_dict, fsat_dict = ball.compute_ngal(Nthread=nthread)
-    # ngal_dict, fsat_dict = reset_fic(ball, config["tracers"], GLOBAL_DATA_OBJ.density_mean, nthread=nthread)
+            return False
+    return True
+
+def _theory(ngal_dict, fsat_dict):
+    """
+    Set 'ic', run the HOD and measure the clustering for the parameters in GLOBAL_BALL.tracers,
+    given the expected ngal and fsat at ic = 1.
+
+    Returns:
+      tuple or None: (theory_clustering_dict, theory_density_dict), or None if fsat > 0.6.
+    """
+    ball = GLOBAL_BALL
+    config = GLOBAL_CONFIG
+    nthread = GLOBAL_NTHREAD
+    box_volume = ball.params['Lbox']**3
 
     # Update 'ic' for non-ELG tracers.
     for tracer in config["tracers"]:
         if fsat_dict[tracer] > 0.6:
-            return -np.inf
+            return None
         if tracer == 'LRG':
             ngal = ngal_dict[tracer]
             if ngal > GLOBAL_DATA_OBJ.density_mean[tracer] * box_volume:
@@ -151,7 +317,121 @@ def log_likelihood(free_params):
             theory_density_dict[tracer] = ngal / box_volume
     # theory_density_dict = set_theory_density(ngal_dict, box_volume, GLOBAL_DATA_OBJ.density_mean, config["tracers"], nthread=nthread)
 
-    # Return total log-likelihood.
-    return data_obj.compute_loglike(theory_clustering_dict, theory_density_dict)
+    return theory_clustering_dict, theory_density_dict
+
+def log_likelihood_batch(free_params_batch, comm=None):
+    """
+    Batched log-likelihood for samplers proposing N points at once (pocoMC, dynesty in
+    batch mode, CMA-ES with cma_options.popsize).
 
+    The bounds, the cache and the kappa * M_cut limit are checked per row. The expected
+    ngal and fsat of all the remaining rows are then computed in one pass over the halo
+    catalog (prepass_helpers.ngal_fsat_batch, once check_ngal_batch has found it equal to
+    compute_ngal; otherwise, for ELG and for non-finite rows, compute_ngal per row),
+    galaxies are drawn and clustered per row, and the chi2 of the whole batch is
+    evaluated at once with data_object.compute_loglike_batch.
 
+    Parameters:
+      free_params_batch (np.ndarray): Free parameters, shape (N, ndim).
+      comm: Optional MPI communicator; if given, the throughput is also reported per node.
+
+    Returns:
+      np.ndarray: Log-likelihoods, shape (N,).
+    """
+    from prepass_helpers import ngal_fsat_batch
+
+    t0 = time.time()
+    ball = GLOBAL_BALL
+    config = GLOBAL_CONFIG
+    tracers = config["tracers"]
+    free_params_batch = np.atleast_2d(np.asarray(free_params_batch, dtype=np.float64))
+    nbatch = len(free_params_batch)
+    loglike = np.full(nbatch, -np.inf)
+
+    # Per-row checks: prior bounds, cache, kappa * M_cut limit and the histogram pre-pass.
+    todo, hods = [], []
+    for i, free_params in enumerate(free_params_batch):
+        if not _within_bounds(config, free_params):
+            continue
+        if GLOBAL_CACHE is not None:
+            cached = GLOBAL_CACHE.get(free_params)
+            if cached is not None:
+                loglike[i] = cached
+                continue
+        if not _assign_params(ball, config, free_params):
+            _cache_put(free_params, -np.inf)
+            continue
+        if _prepass_reject():
+            # not cached, as in log_likelihood
+            continue
+        todo.append(i)
+        hods.append({tracer: dict(ball.tracers[tracer], ic=1) for tracer in tracers})
+
+    # One pass over the halos for the occupation of all the remaining rows.
+    ngal_batch, fsat_batch = {}, {}
+    if GLOBAL_NGAL_BATCH is None and len(todo):
+        check_ngal_batch()
+    for tracer in tracers:
+        if GLOBAL_NGAL_BATCH and tracer in ('LRG', 'QSO') and len(todo):
+            ngal_batch[tracer], fsat_batch[tracer] = ngal_fsat_batch(ball, tracer, [hod[tracer] for hod in hods])
+
+    # Draw the galaxies and measure the clustering row by row.
+    rows, clustering_rows, density_rows = [], [], []
+    for j, i in enumerate(todo):
+        for tracer in tracers:
+            ball.tracers[tracer].update(hods[j][tracer])
+        finite = all(np.isfinite(ngal_batch[tracer][j]) and np.isfinite(fsat_batch[tracer][j]) for tracer in ngal_batch)
+        if len(ngal_batch) < len(tracers) or not finite:
+            ngal_dict, fsat_dict = ball.compute_ngal(Nthread=GLOBAL_NTHREAD)
+        else:
+            ngal_dict, fsat_dict = {}, {}
+        if finite:
+            for tracer in ngal_batch:
+                ngal_dict[tracer], fsat_dict[tracer] = ngal_batch[tracer][j], fsat_batch[tracer][j]
+        theory = _theory(ngal_dict, fsat_dict)
+        if theory is None:
+            _cache_put(free_params_batch[i], -np.inf)
+            continue
+        rows.append(i)
+        clustering_rows.append(theory[0])
+        density_rows.append(theory[1])
+
+    if rows:
+        theory_clustering = {key: np.array([np.ravel(row[key]) for row in clustering_rows])
+                             for key in clustering_rows[0]}
+        theory_density = {tracer: np.array([row[tracer] for row in density_rows]) for tracer in density_rows[0]}
+        loglike[rows] = GLOBAL_DATA_OBJ.compute_loglike_batch(theory_clustering, theory_density)
+        for i in rows:
+            _cache_put(free_params_batch[i], loglike[i])
+
+    report_throughput(nbatch, time.time() - t0, comm=comm)
+    return loglike
+
+def _within_bounds(config, free_params):
+    for tracer in config["tracers"]:
+        for param_name, mapping_idx in config["param_mapping"][tracer].items():
+            bounds = config["fit_params"][tracer][param_name]
+            if free_params[mapping_idx] > bounds[2] or free_params[mapping_idx] < bounds[1]:
+                return False
+    return True
+
+def _cache_put(free_params, loglike):
+    if GLOBAL_CACHE is not None:
+        GLOBAL_CACHE.put(free_params, loglike)
+
+def report_throughput(neval, elapsed, comm=None):
+    """
+    Print the number of likelihood evaluations per second. With an MPI communicator,
+    the rates of all ranks are summed and divided by the number of nodes.
+    """
+    rate = neval / elapsed if elapsed > 0 else np.inf
+    if comm is None:
+        print(f"[batch] {neval} evaluations in {elapsed:.2f} s: {rate:.3f} evals/s")
+        return rate
+    import socket
+    rates = comm.gather(rate, root=0)
+    hosts = comm.gather(socket.gethostname(), root=0)
+    if comm.rank == 0:
+        nnode = len(set(hosts))
+        print(f"[batch] {neval} evaluations per rank: {sum(rates) / nnode:.3f} evals/s per node ({nnode} node(s), {comm.size} rank(s))")
+    return rate
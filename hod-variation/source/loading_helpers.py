@@ -1,8 +1,15 @@
 # Credit: https://github.com/ahnyu/hod-variation/blob/main/source/loading_helpers.py
 
 
+import sys
+from pathlib import Path
 import numpy as np
 from pycorr import TwoPointEstimator
+src_dir = str(Path(__file__).resolve().parent.parent.parent / 'src')
+if src_dir not in sys.path:
+    sys.path.insert(0, src_dir)
+# shared with src/HOD_prepare: vectorised jackknife realizations
+from jackknife_helper import get_realizations, get_combined_jkcov
 
 def readwp(path):
     allcounts=TwoPointEstimator.load(path)
@@ -17,18 +24,6 @@ def readxi02(path):
     err=np.sqrt(np.diag(cov))
     return xi, cov, err, allcounts
 
-def get_realizations(allcounts,idx,mode):
-    jk=np.empty((len(idx),len(allcounts.realizations)))
-    for i in allcounts.realizations:
-        jk[:,i]=allcounts.realization(i)[::2].get_corr(mode=mode,return_sep=True)[1].flatten()[idx]
-    return jk
-
-def get_combined_jkcov(allcountswp,allcountsxi,idxwp,idxxi02):
-    jkwp=get_realizations(allcountswp,idxwp,'wp')
-    jkxi02=get_realizations(allcountsxi,idxxi02,'poles')
-    jkall=np.concatenate((jkwp,jkxi02))
-    return (127 * np.cov(jkall,ddof=0))
-
 def cov2corr(cov, return_std=False):
     cov = np.asanyarray(cov)
     std_ = np.sqrt(np.diag(cov))
@@ -43,27 +38,6 @@ def nz_comb(N,S,idx):
 
 
 def compute_zeff(*catalog_fns, cosmo=None, zrange=None):
-    import fitsio
-    import numpy as np
-    if cosmo is None:
-        from cosmoprimo.fiducial import DESI
-        cosmo = DESI()
-
-    def read(fn):
-        catalog = fitsio.read(fn)
-        z = catalog['Z']
-        weights = catalog['WEIGHT'] * catalog['WEIGHT_FKP']
-        mask = (z >= zrange[0]) & (z < zrange[1])
-        return z[mask], weights[mask]
-
-    z1, weights1 = [np.concatenate(tmp) for tmp in zip(*[read(fn) for fn in catalog_fns])]
-    zstep = 0.01
-    zbins = np.arange(zrange[0], zrange[1] + zstep / 2., zstep)
-    dbins = cosmo.comoving_radial_distance(zbins)
-    hist1 = np.histogram(z1, weights=weights1, density=False, bins=zbins)[0]
-    zhist1 = np.histogram(z1, weights=z1 * weights1, density=False, bins=zbins)[0]
-    z = zhist1 / hist1
-    z[np.isnan(z)] = 0.
-    dv = dbins[1:]**3 - dbins[:-1]**3
-    # sum(dv * density^2 * z) / sum(dv * density^2), where density = hist1 / dv
-    return np.sum(hist1**2 / dv * z) / np.sum(hist1**2 / dv)
\ No newline at end of file
+    # shared with src/HOD_prepare: columnar scan, z histograms cached per catalog
+    from zhist_helper import compute_zeff as _compute_zeff
+    return _compute_zeff(*catalog_fns, cosmo=cosmo, zrange=zrange)
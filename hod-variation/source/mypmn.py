@@ -65,7 +65,9 @@ class my_pmn:
             try:
                 log_like_value = self.log_likelihood(param_)
                 return log_like_value
-            except:
+            except Exception as e:
+                # keep the sampler alive, but do not hide the failure
+                print(f"Warning: log_likelihood failed at {param_}: {type(e).__name__}: {e}")
                 return -1e101
 
         pmn.run(loglike, 
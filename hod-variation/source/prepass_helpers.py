@@ -0,0 +1,141 @@
+# source/prepass_helpers.py
+# Cheap bounds and estimates of ngal and fsat from the halo catalog of the loaded snapshot.
+
+import numpy as np
+from scipy.special import erfc
+
+
+class halo_mass_histogram:
+    '''
+    Histogram of the (multiplicity-weighted) halo masses of an AbacusHOD snapshot.
+
+    Built once after the AbacusHOD object is loaded. A lower bound of the satellite fraction
+    of an HOD is then a sum over ~10^3 mass bins instead of a pass over all halos and
+    subsample particles, which is enough to reject the proposals that surely violate the
+    satellite-fraction limit before running compute_ngal and run_hod.
+    '''
+    def __init__(self, ball, dlogM=0.01):
+        '''
+        ball: loaded AbacusHOD instance.
+        dlogM: bin width in log10(M / [Msun/h]).
+        '''
+        hmass = np.asarray(ball.halo_data['hmass'], dtype=np.float64)
+        weights = ball.halo_data.get('hmultis', None)
+        weights = np.ones_like(hmass) if weights is None else np.asarray(weights, dtype=np.float64)
+        mask = hmass > 0
+        logM = np.log10(hmass[mask])
+        edges = np.arange(np.floor(logM.min() / dlogM) * dlogM, logM.max() + 2 * dlogM, dlogM)
+        counts = np.histogram(logM, bins=edges, weights=weights[mask])[0]
+        nonzero = counts > 0
+        self.counts = counts[nonzero]
+        # the halos of a bin are within its edges: the occupations are bounded at the edges
+        self.logM_lo = edges[:-1][nonzero]
+        self.logM_hi = edges[1:][nonzero]
+        self.dlogM = dlogM
+        self.nreject = 0
+        print(f"[prepass] halo mass histogram with {len(self.counts)} bins, {self.counts.sum():.4g} halos.")
+
+    def fsat_lower_bound(self, tracer, hod):
+        '''
+        Lower bound of the satellite fraction of the vanilla(+AB) HOD of `tracer`.
+
+        hod: dict of HOD parameters in AbacusHOD convention (logM_cut, logM1, sigma, alpha, kappa,
+        and Acent, Asat, Bcent, Bsat).
+        With assembly bias, each halo shifts logM_cut by up to dc = (|Acent| + |Bcent|) / 2 and
+        logM1 by up to ds = (|Asat| + |Bsat|) / 2 (the ranks are in [-0.5, 0.5]), independently of
+        the other halos. Ncen is bounded above with logM_cut - dc at the upper edge of each mass
+        bin, Nsat below with the smallest satellite occupation over the shifts and the bin edges,
+        and fsat >= Nsat_min / (Ncen_max + Nsat_min).
+        '''
+        dc = 0.5 * (abs(hod.get('Acent', 0.)) + abs(hod.get('Bcent', 0.)))
+        ds = 0.5 * (abs(hod.get('Asat', 0.)) + abs(hod.get('Bsat', 0.)))
+        logM_cut, logM1 = hod['logM_cut'], hod['logM1']
+
+        def ncen(lMc, logM):
+            return 0.5 * erfc((lMc - logM) / (np.sqrt(2) * hod['sigma']))
+
+        def nsat(lMc, lM1, logM):
+            excess = 10**logM - hod['kappa'] * 10**lMc
+            ratio = np.clip(excess, 0., None) / 10**lM1
+            with np.errstate(divide='ignore'):
+                return np.where(excess > 0, ratio**hod['alpha'], 0.)
+
+        ncen_max = ncen(logM_cut - dc, self.logM_hi)
+        # the excess ratio is monotonic in the mass and the shifts, so is ratio**alpha for either
+        # sign of alpha: its minimum is at the smallest or at the largest ratio
+        nsat_min = np.minimum(nsat(logM_cut + dc, logM1 + ds, self.logM_lo), nsat(logM_cut - dc, logM1 - ds, self.logM_hi))
+        if tracer == 'LRG':
+            nsat_min = nsat_min * ncen(logM_cut + dc, self.logM_lo)
+        Ncen = np.sum(self.counts * ncen_max)
+        Nsat = np.sum(self.counts * nsat_min)
+        ntot = Ncen + Nsat
+        return Nsat / ntot if ntot > 0 else 0.
+
+    def reject(self, tracers, hods, fsat_max=0.6, tol=0.05):
+        '''
+        True if the lower bound of fsat exceeds `fsat_max` + `tol` for one of the tracers.
+        '''
+        for tracer in tracers:
+            if tracer not in ('LRG', 'QSO'):
+                continue
+            if self.fsat_lower_bound(tracer, hods[tracer]) > fsat_max + tol:
+                self.nreject += 1
+                return True
+        return False
+
+
+def ngal_fsat_batch(ball, tracer, hods, chunksize=65536):
+    '''
+    Expected ngal and fsat of N HOD parameter sets in one pass over the halo catalog.
+
+    The halo arrays are read chunk by chunk and the occupations of all N sets are evaluated
+    on each chunk, so the memory traffic over the halos is paid once per batch instead of
+    once per set (as with N calls of compute_ngal). Only the LRG and QSO vanilla(+AB)
+    occupations are implemented.
+
+    ball: loaded AbacusHOD instance.
+    tracer: 'LRG' or 'QSO'.
+    hods: list of N dicts of HOD parameters in AbacusHOD convention.
+    chunksize: number of halos per chunk; the temporaries are (N, chunksize) float64.
+
+    Returns: ngal (N,), fsat (N,) as np.ndarray.
+    '''
+    if tracer not in ('LRG', 'QSO'):
+        raise NotImplementedError(f"ngal_fsat_batch is not implemented for {tracer}.")
+    halo_data = ball.halo_data
+    hmass = halo_data['hmass']
+    nhalo = len(hmass)
+    hmultis = halo_data.get('hmultis', None)
+    want_AB = getattr(ball, 'want_AB', False)
+    hdeltac = halo_data.get('hdeltac', None) if want_AB else None
+    hfenv = halo_data.get('hfenv', None) if want_AB else None
+
+    def column(name, default=0.):
+        return np.array([hod.get(name, default) for hod in hods], dtype=np.float64)[:, None]
+    logM_cut, logM1 = column('logM_cut'), column('logM1')
+    sigma, alpha, kappa = column('sigma'), column('alpha'), column('kappa')
+    Acent, Asat, Bcent, Bsat = column('Acent'), column('Asat'), column('Bcent'), column('Bsat')
+    ic = column('ic', 1.)[:, 0]
+
+    Ncen = np.zeros(len(hods))
+    Nsat = np.zeros(len(hods))
+    for start in range(0, nhalo, chunksize):
+        sl = slice(start, min(start + chunksize, nhalo))
+        M = np.asarray(hmass[sl], dtype=np.float64)[None, :]
+        logM = np.log10(M)
+        w = np.ones(M.shape[1]) if hmultis is None else np.asarray(hmultis[sl], dtype=np.float64)
+        lMc, lM1 = logM_cut, logM1
+        if hdeltac is not None:
+            dc = np.asarray(hdeltac[sl], dtype=np.float64)[None, :]
+            fe = np.asarray(hfenv[sl], dtype=np.float64)[None, :]
+            lMc = logM_cut + Acent * dc + Bcent * fe
+            lM1 = logM1 + Asat * dc + Bsat * fe
+        ncen = 0.5 * erfc((lMc - logM) / (np.sqrt(2) * sigma))
+        nsat = (np.clip(M - kappa * 10**lMc, 0., None) / 10**lM1)**alpha
+        if tracer == 'LRG':
+            nsat *= ncen
+        Ncen += ncen @ w
+        Nsat += nsat @ w
+    ntot = Ncen + Nsat
+    fsat = np.divide(Nsat, ntot, out=np.zeros_like(ntot), where=ntot > 0)
+    return ic * ntot, fsat
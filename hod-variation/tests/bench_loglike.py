@@ -0,0 +1,43 @@
+# python tests/bench_loglike.py
+# Microbenchmark of the compiled Gaussian likelihood (data_object.gaussian_chi2)
+# against the previous dense inverse-covariance implementation.
+
+import os, sys
+import time
+import numpy as np
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'source')))
+from data_object import gaussian_chi2
+
+def chi2_invcov(data, invcov, theory):
+    'The previous implementation of data_object.compute_loglike.'
+    diff = data - theory
+    return diff.dot(invcov.dot(diff))
+
+def timeit(func, nrepeat):
+    t0 = time.perf_counter()
+    for _ in range(nrepeat):
+        func()
+    return (time.perf_counter() - t0) / nrepeat
+
+rng = np.random.default_rng(42)
+nbatch = 256
+for ndata in [21, 39, 120]:  # wp; wp+xi0+xi2; a longer combined vector
+    A = rng.normal(size=(ndata, 4 * ndata))
+    cov = A @ A.T / (4 * ndata) + np.eye(ndata) * 1e-3
+    data = rng.normal(size=ndata)
+    theory = data + rng.normal(size=(nbatch, ndata)) * 0.1
+
+    invcov = np.linalg.inv(cov)
+    like = gaussian_chi2(data, cov)
+    ref = np.array([chi2_invcov(data, invcov, t) for t in theory])
+    new = np.array([like.chi2(t) for t in theory])
+    assert np.allclose(ref, new, rtol=1e-8), 'single evaluation mismatch'
+    assert np.allclose(ref, like.chi2_batch(theory), rtol=1e-8), 'batch evaluation mismatch'
+
+    nrepeat = 20000
+    t_inv = timeit(lambda: chi2_invcov(data, invcov, theory[0]), nrepeat)
+    t_inv_each = timeit(lambda: chi2_invcov(data, np.linalg.inv(cov), theory[0]), nrepeat // 10)
+    t_new = timeit(lambda: like.chi2(theory[0]), nrepeat)
+    t_batch = timeit(lambda: like.chi2_batch(theory), nrepeat // 100) / nbatch
+    print(f"ndata={ndata:4d}: inv per call {t_inv_each*1e6:8.2f} us | invcov {t_inv*1e6:6.2f} us "
+          f"| cholesky {t_new*1e6:6.2f} us | cholesky batch({nbatch}) {t_batch*1e6:6.3f} us per vector")
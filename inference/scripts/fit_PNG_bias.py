@@ -59,7 +59,12 @@ for key in priors:
 ## status of all parameters
 for key in theory.params:
     print(key, theory.params[key].value, theory.params[key].fixed, theory.params[key].derived, theory.params[key].prior, theory.params[key].ref)
-observable = TracerPowerSpectrumMultipolesObservable(data=data, covariance=cov, 
+if isinstance(data, dict):
+    # 'thecov_box', 'EZmocks_stream', 'EZmocks' from a packed store: dict of k and P_0, cov: array
+    data, kwargs = data['P_0'], {'k': data['k'], 'ells': ells}
+else:
+    kwargs = {}
+observable = TracerPowerSpectrumMultipolesObservable(data=data, covariance=cov, **kwargs,
         klim={0: klim0},
         # klim={0: [0.005, 0.2, 0.005], 2: [0.005, 0.2, 0.005]}, # fit monopole and quadrupole, between 0.005 and 0.2 h/Mpc
         theory=theory)
@@ -64,6 +64,7 @@ def write_cutsky_cfg(
     zmax: float = 0.6,
     write_to: str | None = None,
     make_executable: bool = False,
+    input_format: int = 0,
 ) -> str:
     """Write the cutsky configuration file.
 
@@ -81,12 +82,13 @@ def write_cutsky_cfg(
         zmax (float, optional but recommended): Maximum redshift. Defaults to 0.6.
         write_to (str | None, optional): If provided, write the configuration to this path. Defaults to None.
         make_executable (bool, optional): If True and write_to is provided, make the output file executable. Defaults to False.
+        input_format (int, optional): INPUT_FORMAT of cutsky: 0 for ASCII, 1 for a FITS table, 2 for an ASCII list of FITS files (e.g. the random shards of `random_box.py`). Defaults to 0.
     """
     if Omega_l is None:
         Omega_l = 1 - Omega_m
     conf_content = f"""# Configuration file for cutsky (default: `cutsky.conf').
 INPUT          = '{box_path}'
-INPUT_FORMAT  = 0
+INPUT_FORMAT  = {input_format}
 COMMENT        = '#'
 BOX_SIZE       = {boxsize}
 OMEGA_M        = {Omega_m}
@@ -122,6 +124,7 @@ if __name__ == "__main__":
     parser.add_argument('--nz_path', type=str, default='/global/homes/s/siyizhao/projects/fihobi/data/nz/QSO_NGC_nz_v2.txt', help='Path to the n(z) file.')
     parser.add_argument('--zmin', type=float, default=2.8, help='Minimum redshift.')
     parser.add_argument('--zmax', type=float, default=3.5, help='Maximum redshift.')
+    parser.add_argument('--input_format', type=int, choices=[0, 1, 2], default=0, help='INPUT_FORMAT of cutsky (2: list of FITS files, e.g. the random shards).')
     args = parser.parse_args()
     catalog_path = args.catalog_path
     boxsize = args.boxsize
@@ -153,6 +156,7 @@ if __name__ == "__main__":
         zmin=zmin,
         zmax=zmax,
         write_to=write_to,
+        input_format=args.input_format,
     )
     
     print(f"Done preparing cutsky configuration and input catalog. Just run:")
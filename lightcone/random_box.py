@@ -1,9 +1,18 @@
 #!/usr/bin/env python3
 # from Cheng Zhao, updated
+# Uniform randoms in a periodic box, written as FITS shards listed in an ASCII file, i.e. the
+# INPUT_FORMAT = 2 of cutsky. The randoms are drawn in fixed blocks of BLOCK rows, block b from
+# a Philox stream with counter b, so the shards can be written by any number of processes and
+# the catalog (and every shard file) only depends on the seed, the number and the shard count.
+import os
 import numpy as np
-import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+
+BLOCK = 1 << 22  # rows per counter block
 
 def write_random_catalog(ofile, num, Lbox, chunk_size=int(1e7), seed=42):
+  'ASCII version (INPUT_FORMAT = 0), single process; kept for small catalogs.'
+  import pandas as pd
   rng = np.random.default_rng(seed)
   buf = np.empty((chunk_size, 3), dtype=np.float32)
 
@@ -13,23 +22,90 @@ def write_random_catalog(ofile, num, Lbox, chunk_size=int(1e7), seed=42):
       rng.random((n, 3), dtype=np.float32, out=buf[:n])
       buf[:n] *= np.float32(Lbox)
       pd.DataFrame(buf[:n]).to_csv(f, index=False, float_format='%.8g', sep=' ', header=False)
-    
+
+def random_block(b, num, Lbox, seed):
+  'Rows [b*BLOCK, min((b+1)*BLOCK, num)) of the catalog, (n, 3) float32.'
+  n = min(BLOCK, num - b * BLOCK)
+  rng = np.random.Generator(np.random.Philox(key=seed, counter=b << 128))
+  pos = rng.random((n, 3), dtype=np.float32)
+  pos *= np.float32(Lbox)
+  return pos
+
+def shard_blocks(num, nshards):
+  'Block ranges [b0, b1) of each shard, as even as whole blocks allow.'
+  nblocks = -(-num // BLOCK)
+  edges = np.linspace(0, nblocks, min(nshards, nblocks) + 1).round().astype(int)
+  return [(int(b0), int(b1)) for b0, b1 in zip(edges[:-1], edges[1:])]
+
+def _write_shard(fn, blocks, num, Lbox, seed, fmt, velocities):
+  tmp = fn + '.tmp'
+  if fmt == 'npy':
+    b0, b1 = blocks
+    start = b0 * BLOCK
+    out = np.lib.format.open_memmap(tmp, mode='w+', dtype=np.float32, shape=(min(b1 * BLOCK, num) - start, 3))
+    for b in range(b0, b1):
+      pos = random_block(b, num, Lbox, seed)
+      out[b * BLOCK - start:b * BLOCK - start + len(pos)] = pos
+    out.flush()
+    del out
+  else:
+    import fitsio
+    names = ['x', 'y', 'z'] + (['vx', 'vy', 'vz'] if velocities else [])
+    with fitsio.FITS(tmp, 'rw', clobber=True) as fits:
+      for b in range(*blocks):
+        pos = random_block(b, num, Lbox, seed)
+        data = np.zeros(len(pos), dtype=[(name, 'f4') for name in names])
+        data['x'], data['y'], data['z'] = pos.T
+        if b == blocks[0]:
+          fits.write(data)
+        else:
+          fits[-1].append(data)
+  os.replace(tmp, fn)
+  return fn
+
+def write_random_shards(odir, num, Lbox, seed=42, nshards=None, nproc=8, fmt='fits', velocities=True):
+  """
+  Write `num` randoms in [0, Lbox)^3 as `nshards` files odir/random_{i:04d}.{fits,npy}, with nproc
+  processes. For fmt='fits' the shards have float32 columns x, y, z (and zero vx, vy, vz, read by
+  cutsky) and are listed in odir.rstrip('/') + '.list', the INPUT of cutsky with INPUT_FORMAT = 2.
+  Shards already written are kept, so an interrupted run can be resumed.
+
+  Returns: list of the shard filenames.
+  """
+  nshards = nshards or max(1, -(-num // int(1e8)))
+  os.makedirs(odir, exist_ok=True)
+  shards = shard_blocks(num, nshards)
+  fns = [os.path.join(odir, f'random_{i:04d}.{fmt}') for i in range(len(shards))]
+  todo = [(fn, blocks) for fn, blocks in zip(fns, shards) if not os.path.exists(fn)]
+  print(f"[randoms] {num} randoms in {len(shards)} shards ({len(shards) - len(todo)} done), {nproc} processes", flush=True)
+  with ProcessPoolExecutor(max_workers=nproc) as executor:
+    futures = [executor.submit(_write_shard, fn, blocks, num, Lbox, seed, fmt, velocities) for fn, blocks in todo]
+    for future in futures:
+      print(f"[write] -> {future.result()}", flush=True)
+  if fmt == 'fits':
+    flist = odir.rstrip('/') + '.list'
+    with open(flist, 'w') as f:
+      f.write(''.join(os.path.abspath(fn) + '\n' for fn in fns))
+    print(f"[write] -> {flist}")
+  return fns
+
 if __name__ == "__main__":
   n_LRG_S = int(1.5e9)
   n_LRG_N = int(2.3e9)
   n_QSO_N = int(3.1e8)
   n_QSO_S = int(2.4e8)
   Lbox = 6000
+  nproc = int(os.environ.get('SLURM_CPUS_ON_NODE', os.cpu_count()))
 
   odir_LRG = '/pscratch/sd/s/siyizhao/fihobi/lc_test/lcmock_LRGs_fnl100_base-A/RANDOM'
-  ofile_LRG_S = f'{odir_LRG}/Random_N1.5e9_L{Lbox}.dat'
-  ofile_LRG_N = f'{odir_LRG}/Random_N2.3e9_L{Lbox}.dat'
+  odir_LRG_S = f'{odir_LRG}/Random_N1.5e9_L{Lbox}'
+  odir_LRG_N = f'{odir_LRG}/Random_N2.3e9_L{Lbox}'
   odir_QSO = '/pscratch/sd/s/siyizhao/fihobi/lc_test/lcmock_QSOs_fnl100_base-A/RANDOM'
-  ofile_QSO_N = f'{odir_QSO}/Random_N3.1e8_L{Lbox}.dat'
-  ofile_QSO_S = f'{odir_QSO}/Random_N2.4e8_L{Lbox}.dat'
-
-  write_random_catalog(ofile_LRG_S, n_LRG_S, Lbox, seed=24242)
-  write_random_catalog(ofile_LRG_N, n_LRG_N, Lbox, seed=14242)
-  
-  write_random_catalog(ofile_QSO_N, n_QSO_N, Lbox, seed=4242)
-  write_random_catalog(ofile_QSO_S, n_QSO_S, Lbox, seed=34242)
+  odir_QSO_N = f'{odir_QSO}/Random_N3.1e8_L{Lbox}'
+  odir_QSO_S = f'{odir_QSO}/Random_N2.4e8_L{Lbox}'
+
+  write_random_shards(odir_LRG_S, n_LRG_S, Lbox, seed=24242, nproc=nproc)
+  write_random_shards(odir_LRG_N, n_LRG_N, Lbox, seed=14242, nproc=nproc)
+
+  write_random_shards(odir_QSO_N, n_QSO_N, Lbox, seed=4242, nproc=nproc)
+  write_random_shards(odir_QSO_S, n_QSO_S, Lbox, seed=34242, nproc=nproc)
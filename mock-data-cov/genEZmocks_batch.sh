@@ -0,0 +1,43 @@
+#!/bin/bash
+# Run EZmocks with PNG initial conditions on NERSC (Perlmutter), one long-lived process per task
+# Usage: run `bash genEZmocks_batch.sh; exit` on an interactive allocation (salloc -A desi -C cpu -q interactive -t 04:00:00 -N <num_nodes> --exclusive)
+# Each task runs scripts/genEZmockPNG_batch.py on a contiguous range of seeds: the EZmock grid and
+# pypower are set up once per task, and seeds already in $odir/pypowerpoles.store are skipped.
+
+# load cosmodesi for pypower
+source /global/common/software/desi/users/adematti/cosmodesi_environment.sh main 
+
+cd /global/homes/s/siyizhao/projects/fihobi/mock-data-cov
+
+# === Set and Create output dirs ===
+odir=/pscratch/sd/s/siyizhao/EZmock/output/mocks/QSO-z6_c302_fnl300
+config=configs/ezQSOz6fnl100.yaml
+mkdir -p logs/ezmock/ /pscratch/sd/s/siyizhao/2LPTdisp/ "$odir"
+
+TOTAL=1000      # total number of EZmocks to generate
+START=10001    # starting ID
+CPUS=16        # each task uses 16 CPUs
+INFLIGHT=1     # 2LPT runs ahead of the current seed in each task
+
+# === Detect environment ===
+NNODES=${SLURM_NNODES:-1}
+NTASKS_PER_NODE=$((128 / CPUS))   # 128 CPUs per Perlmutter node
+NPROC=$((NNODES * NTASKS_PER_NODE))
+PER_TASK=$(( (TOTAL + NPROC - 1) / NPROC ))
+
+echo "=== EZmock batch launcher ==="
+echo "Nodes: $NNODES, tasks: $NPROC, seeds per task: $PER_TASK"
+
+# === Launch tasks ===
+for ((t=0; t<NPROC; t++)); do
+    first=$((START + t * PER_TASK))
+    count=$(( PER_TASK < START + TOTAL - first ? PER_TASK : START + TOTAL - first ))
+    [ "$count" -le 0 ] && break
+    srun -N1 -n1 --cpus-per-task=$CPUS --exclusive --cpu-bind=cores \
+        --output=$odir/log_batch_r${first}.log \
+        env OMP_NUM_THREADS=$CPUS MKL_NUM_THREADS=$CPUS \
+        python scripts/genEZmockPNG_batch.py "$first" "$count" "$odir" "$config" --inflight $INFLIGHT &
+done
+
+wait
+echo "All EZmock tasks completed."
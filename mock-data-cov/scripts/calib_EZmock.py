@@ -0,0 +1,93 @@
+# !/usr/bin/env python3
+# the workdir is ~/projects/fihobi/mock-data-cov/
+# Calibrate the EZmock bias parameters (rho_c, rho_exp, pdf_base, sigma_v) against the Abacus
+# multipoles measured by scripts/abacus_pkl.py (pypower2powspec.txt).
+# The 2LPT displacement of one seed comes from the displacement cache and is reused by every trial; the trials are
+# guided by a quadratic response surface of the multipoles (source/ezcalib_helper.py), so the
+# fit needs a few tens of EZmock runs. Trials are saved after each run and reused on a re-run.
+#
+# usage: python scripts/calib_EZmock.py CONFIG REF_POWSPEC ODIR [--seed 1] [--n_iter 20]
+# CONFIG is an ez*.yaml; its optional `calib` section sets bounds, kmin, kmax, ells.
+
+import argparse
+import yaml
+import os, sys
+import numpy as np
+from EZmock import EZmock
+current_dir = os.getcwd()
+source_dir = os.path.join(current_dir, "source")
+if source_dir not in sys.path:
+    sys.path.insert(0, source_dir)
+from disp2LPT_helper import cached_disp, DISP_DIR
+from ezcalib_helper import PARAMS, load_reference, calibrate
+sys.path.insert(0, os.path.expanduser('../src'))
+from pypower_helpers import run_pypower
+
+DEFAULT_BOUNDS = {'rho_c': [0.8, 1.8], 'rho_exp': [4., 12.], 'pdf_base': [0.1, 0.6], 'sigma_v': [200., 700.]}
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Calibrate EZmock bias parameters against a reference power spectrum.')
+    parser.add_argument('config', type=str, help='EZmock configuration (yaml)')
+    parser.add_argument('ref', type=str, help='reference pypower2powspec.txt')
+    parser.add_argument('odir', type=str, help='output directory for the trials and the best fit')
+    parser.add_argument('--seed', type=int, default=1, help='2LPT seed of the fixed displacement field')
+    parser.add_argument('--n_iter', type=int, default=20, help='maximal number of surrogate-guided runs')
+    return parser.parse_args()
+
+args = parse_args()
+config = yaml.safe_load(open(args.config))
+calib = config.get('calib', {})
+bounds = {name: calib.get('bounds', {}).get(name, DEFAULT_BOUNDS[name]) for name in PARAMS}
+redshift = config['redshift']
+fnl = config['fnl4ezmocks']
+ntracer = config['ntracer']
+
+pdir=DISP_DIR
+Omega_m0 = 0.3137721
+Omega_nu = 0.00141976532
+z_pk = 1
+Lbox = 2000
+Ngrid = 512
+EZseed = 42
+nthread=int(os.environ.get('OMP_NUM_THREADS', 16))
+ells = tuple(calib.get('ells', (0, 2)))
+
+os.makedirs(args.odir, exist_ok=True)
+fn_trials = os.path.join(args.odir, 'calib_trials.npz')
+fn_best = os.path.join(args.odir, 'calib_bestfit.yaml')
+ref = load_reference(args.ref, nbar=ntracer / Lbox**3, kmin=calib.get('kmin', 0.01), kmax=calib.get('kmax', 0.3), ells=ells)
+
+ez = EZmock(Lbox=Lbox, Ngrid=Ngrid, seed=EZseed, nthread=nthread)
+ez.eval_growth_params(z_out=redshift, z_pk=z_pk, Omega_m=Omega_m0, Omega_nu=Omega_nu)
+rsd_fac = (1 + redshift) / (100 * np.sqrt(Omega_m0 * (1 + redshift)**3 + (1 - Omega_m0)))
+
+trials = []
+if os.path.exists(fn_trials):
+    with np.load(fn_trials) as f:
+        trials = [(dict(zip(PARAMS, map(float, p))), m) for p, m in zip(f['params'], f['models'])]
+    print(f"[calib] {len(trials)} trial(s) read from {fn_trials}")
+
+def save_trials(trials):
+    tmp = fn_trials[:-len('.npz')] + '.tmp.npz'
+    np.savez(tmp, params=np.array([[p[name] for name in PARAMS] for p, _ in trials]),
+             models=np.array([m for _, m in trials]), k=ref['k'], data=ref['data'], sigma=ref['sigma'])
+    os.replace(tmp, fn_trials)
+
+# fixed displacement field, 2LPTnonlocal runs only if the cache has no matching field
+with cached_disp(args.seed, redshift, fnl, Ngrid=Ngrid, Lbox=Lbox, fix_amp=0, pdir=pdir, nproc=nthread) as (mydx, mydy, mydz):
+    def evaluate(params):
+        # the density field is rebuilt from the cached displacement for every trial
+        ez.create_dens_field_from_disp(mydx, mydy, mydz, deepcopy=True)
+        x, y, z, vx, vy, vz = ez.populate_tracer(params['rho_c'], params['rho_exp'], params['pdf_base'], params['sigma_v'], ntracer)
+        poles = run_pypower(x, y, z, vz, rsd_fac, ells=ells)
+        model = np.concatenate([poles(ell=ell, complex=False)[ref['mask']] for ell in ells])
+        trials_done.append((params, model))
+        save_trials(trials + trials_done)
+        return model
+    trials_done = []
+    best, best_chi2, _ = calibrate(evaluate, ref, bounds, n_iter=args.n_iter, seed=args.seed, trials=trials)
+
+print(f"[calib] best fit after {len(trials) + len(trials_done)} trials: {best}, chi2 = {best_chi2:.2f} for {len(ref['data'])} bins")
+with open(fn_best, 'w') as f:
+    yaml.safe_dump({**{name: float(best[name]) for name in PARAMS}, 'chi2': best_chi2, 'ndata': len(ref['data'])}, f, sort_keys=False)
+print(f"[write] -> {fn_best}")
@@ -10,9 +10,10 @@ current_dir = os.getcwd()
 source_dir = os.path.join(current_dir, "source")
 if source_dir not in sys.path:
     sys.path.insert(0, source_dir)
-from disp2LPT_helper import run_disp_2lpt
+from disp2LPT_helper import cached_disp, DISP_DIR
 sys.path.insert(0, os.path.expanduser('../src'))
 from pypower_helpers import run_pypower
+from poles_store_helper import PolesStore, STORE_NAME
 # from pypower_helpers import run_pypower_redshift
 
 
@@ -25,7 +26,7 @@ fnl = config['fnl4ezmocks']
 ntracer = config['ntracer']
 rho_c, rho_exp, pdf_base, sigma_v = [config['rho_c'], config['rho_exp'], config['pdf_base'], config['sigma_v']]
 
-pdir='/pscratch/sd/s/siyizhao/2LPTdisp/'
+pdir=DISP_DIR
 Omega_m0 = 0.3137721
 Omega_nu = 0.00141976532
 z_pk = 1
@@ -35,21 +36,15 @@ EZseed = 42
 nthread=os.environ.get('OMP_NUM_THREADS', 16)
 ells = (0)
 
-# prepare displacement field with 2LPTnonlocal ---------------------------------
-run_disp_2lpt(seed=seed, redshift=redshift, fnl=fnl, Ngrid=Ngrid, Lbox=Lbox, fix_amp=0) # no fixed amplitude for generating EZmock
-
-
-
 # generate EZmock and save -----------------------------------------------------
 # ensure the Python process (and libraries) use the desired thread count for EZmock
 print(f"Generating EZmock for seed {seed}...")
 print(f"nthread={nthread}")
 ez = EZmock(Lbox=Lbox, Ngrid=Ngrid, seed=EZseed, nthread=nthread)
 ez.eval_growth_params(z_out=redshift, z_pk=z_pk, Omega_m=Omega_m0, Omega_nu=Omega_nu)
-mydx = np.loadtxt(pdir + f'dispx_{seed}.txt')
-mydy = np.loadtxt(pdir + f'dispy_{seed}.txt')
-mydz = np.loadtxt(pdir + f'dispz_{seed}.txt')
-ez.create_dens_field_from_disp(mydx, mydy, mydz, deepcopy=True)
+# displacement field from the cache, 2LPTnonlocal runs only on a miss (no fixed amplitude for generating EZmock)
+with cached_disp(seed, redshift, fnl, Ngrid=Ngrid, Lbox=Lbox, fix_amp=0, pdir=pdir) as (mydx, mydy, mydz):
+    ez.create_dens_field_from_disp(mydx, mydy, mydz, deepcopy=True)
 print("Displacement field loaded.")
 rsd_fac = (1 + redshift) / (100 * np.sqrt(Omega_m0 * (1 + redshift)**3 + (1 - Omega_m0)))
 x, y, z, vx, vy, vz = ez.populate_tracer(rho_c, rho_exp, pdf_base, sigma_v, ntracer)
@@ -66,9 +61,11 @@ print('EZmock generated, now measuring pypower poles...')
 # z_rsd = data[:, 2]
 # poles = run_pypower_redshift(x, y, z_rsd, ells=ells)
 poles = run_pypower(x, y, z, vz, rsd_fac, ells=ells)
-outpath = odir + f'/pypowerpoles_r{seed}.npy'
-poles.save(outpath)
-print(f"Saved pypower poles to {outpath}")
+# one packed store per mock set instead of one pickle per seed, appended under a file lock
+outpath = os.path.join(odir, STORE_NAME)
+meta = {'redshift': redshift, 'fnl': fnl, 'Lbox': Lbox, 'Ngrid': Ngrid, 'EZseed': EZseed}
+PolesStore(outpath).append(int(seed), poles, ells=(0,), meta=meta)
+print(f"Appended pypower poles of seed {seed} to {outpath}")
 # poles_all.append(poles)
 
 print(f'Finished seed {seed}.')
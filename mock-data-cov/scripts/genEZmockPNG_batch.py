@@ -0,0 +1,104 @@
+# !/usr/bin/env python3
+# the workdir is ~/projects/fihobi/mock-data-cov/
+# Batch version of genEZmockPNG.py: one process for a range of seeds.
+# The EZmock grid object, its growth parameters and pypower are set up once; the 2LPT
+# displacements of the next seeds (cache misses only) run in the background while the current seed is populated
+# and measured, with at most `--inflight` seeds ahead. The poles go to the packed store of odir.
+#
+# usage: python scripts/genEZmockPNG_batch.py START COUNT ODIR CONFIG [--inflight 2]
+
+import argparse
+import yaml
+import os, sys, time
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from EZmock import EZmock
+current_dir = os.getcwd()
+source_dir = os.path.join(current_dir, "source")
+if source_dir not in sys.path:
+    sys.path.insert(0, source_dir)
+from disp2LPT_helper import ensure_disp, cached_disp, balance_threads, DISP_DIR
+sys.path.insert(0, os.path.expanduser('../src'))
+from pypower_helpers import run_pypower
+from poles_store_helper import PolesStore, STORE_NAME
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Generate EZmocks with PNG initial conditions for a range of seeds.')
+    parser.add_argument('start', type=int, help='first seed')
+    parser.add_argument('count', type=int, help='number of seeds')
+    parser.add_argument('odir', type=str, help='output directory (packed store of the poles)')
+    parser.add_argument('config', type=str, help='EZmock configuration (yaml)')
+    parser.add_argument('--inflight', type=int, default=2, help='number of 2LPT runs ahead of the current seed')
+    parser.add_argument('--lpt_work', type=float, default=1., help='core-time of a 2LPT seed over that of an EZmock seed, to split the threads')
+    return parser.parse_args()
+
+# the convert_disp pools of the prefetch threads are spawned and re-import this script: keep it import-safe
+def main():
+    args = parse_args()
+    config = yaml.safe_load(open(args.config))
+    redshift = config['redshift']
+    fnl = config['fnl4ezmocks']
+    ntracer = config['ntracer']
+    rho_c, rho_exp, pdf_base, sigma_v = [config['rho_c'], config['rho_exp'], config['pdf_base'], config['sigma_v']]
+
+    pdir=DISP_DIR
+    Omega_m0 = 0.3137721
+    Omega_nu = 0.00141976532
+    z_pk = 1
+    Lbox = 2000
+    Ngrid = 512
+    EZseed = 42
+    ncores=int(os.environ.get('OMP_NUM_THREADS', 16))
+    # cores of the task split between the background 2LPT runs and EZmock + pypower
+    nthread_2lpt, nthread = balance_threads(ncores, args.inflight, work_ratio=args.lpt_work)
+    ells = (0)
+
+    store = PolesStore(os.path.join(args.odir, STORE_NAME))
+    meta = {'redshift': redshift, 'fnl': fnl, 'Lbox': Lbox, 'Ngrid': Ngrid, 'EZseed': EZseed}
+    done = set(store.index()) if os.path.exists(store.path) else set()
+    seeds = [seed for seed in range(args.start, args.start + args.count) if seed not in done]
+    print(f"{len(seeds)} seed(s) to run, {args.count - len(seeds)} already in {store.path}", flush=True)
+    print(f"{ncores} cores: {args.inflight} x {nthread_2lpt} threads for 2LPT, {nthread} for EZmock", flush=True)
+
+    # set up once for all the seeds -------------------------------------------------
+    ez = EZmock(Lbox=Lbox, Ngrid=Ngrid, seed=EZseed, nthread=nthread)
+    ez.eval_growth_params(z_out=redshift, z_pk=z_pk, Omega_m=Omega_m0, Omega_nu=Omega_nu)
+    rsd_fac = (1 + redshift) / (100 * np.sqrt(Omega_m0 * (1 + redshift)**3 + (1 - Omega_m0)))
+
+    disp_kw = dict(redshift=redshift, fnl=fnl, Ngrid=Ngrid, Lbox=Lbox, fix_amp=0, pdir=pdir)
+
+    def prefetch(seed):
+        # runs in a thread next to EZmock: parse the text with a spawn pool, not a fork of this process
+        ensure_disp(seed, nthread=nthread_2lpt, nproc=nthread_2lpt, mp_context='spawn', **disp_kw)
+        return seed
+
+    # at most `inflight` 2LPT runs ahead of the seed being populated and measured;
+    # with --inflight 0 the current seed is generated in the main thread by cached_disp
+    with ThreadPoolExecutor(max_workers=max(1, args.inflight)) as executor:
+        futures = {}
+        queue = iter(seeds)
+        for nxt in [next(queue) for _ in seeds[:args.inflight]]:
+            futures[nxt] = executor.submit(prefetch, nxt)
+        t_start = time.time()
+        for i, seed in enumerate(seeds):
+            t0 = time.time()
+            if seed in futures:
+                futures.pop(seed).result()
+            nxt = next(queue, None) if args.inflight > 0 else None
+            if nxt is not None:
+                futures[nxt] = executor.submit(prefetch, nxt)
+            with cached_disp(seed, **disp_kw) as (mydx, mydy, mydz):
+                ez.create_dens_field_from_disp(mydx, mydy, mydz, deepcopy=True)
+            x, y, z, vx, vy, vz = ez.populate_tracer(rho_c, rho_exp, pdf_base, sigma_v, ntracer)
+            poles = run_pypower(x, y, z, vz, rsd_fac, ells=ells)
+            del x, y, z, vx, vy, vz
+            store.append(seed, poles, ells=(0,), meta=meta)
+            rate = 3600. * (i + 1) / (time.time() - t_start)
+            print(f"Seed {seed} done in {time.time() - t0:.1f}s ({rate:.1f} seeds/hour), appended to {store.path}", flush=True)
+
+    print(f'Finished seeds {args.start}..{args.start + args.count - 1}.')
+
+
+if __name__ == "__main__":
+    main()
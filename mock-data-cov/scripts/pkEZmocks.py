@@ -5,14 +5,16 @@ pkEZmock.py
 Scan directories matching:
     /pscratch/sd/s/siyizhao/EZmock/output/mocks/QSO-z4_c300/EZmock_*
 For each directory, find a file containing at least three columns (x, y, z_rsd),
-call run_pypower_redshift from source/pypower_helpers.py and save the poles to
-/pscratch/sd/s/siyizhao/EZmock/output/mocks/QSO-z4_c300/pypowerpoles_*.npz
+call run_pypower_redshift from source/pypower_helpers.py and append the poles to the packed store
+/pscratch/sd/s/siyizhao/EZmock/output/mocks/QSO-z4_c300/pypowerpoles.store
 """
+import re
 import numpy as np
 from pathlib import Path
 import os, sys
 sys.path.insert(0, os.path.expanduser('../src'))
 from pypower_helpers import run_pypower_redshift
+from poles_store_helper import PolesStore, STORE_NAME
 
 
 IN_PATTERN = Path("/pscratch/sd/s/siyizhao/EZmock/output/mocks/QSO-z4_c300")
@@ -23,6 +25,7 @@ ells = (0, 2)
 
 def main():
     OUT_DIR.mkdir(parents=True, exist_ok=True)
+    store = PolesStore(OUT_DIR / STORE_NAME)
     matches = list(glob_pattern.parent.glob(glob_pattern.name))
     if not matches:
         print(f"No paths match pattern {glob_pattern}")
@@ -89,22 +92,16 @@ def main():
             print(f"run_pypower_redshift failed for {input_path}: {e}")
             continue
 
-        # construct output filename by replacing "EZmock" with "pypowerpoles"
-        out_name = input_path.name.replace("EZmock", "pypowerpoles")
-        if out_name.endswith(".txt"):
-            out_name = out_name[:-4] + ".npz"
-        elif not out_name.endswith(".npz"):
-            out_name = out_name + ".npz"
-        out_path = Path(OUT_DIR) / out_name
-
+        # seed from the file name, e.g. EZmock_r12.txt
+        m = re.search(r'(\d+)', input_path.stem)
+        if m is None:
+            print(f"No seed in the file name {input_path.name}, skipped")
+            continue
         try:
-            if isinstance(poles, dict):
-                np.savez(out_path, **poles)
-            else:
-                np.savez(out_path, poles=poles)
-            print(f"Saved pypower poles to {out_path}")
+            store.append(int(m.group(1)), poles, ells=ells)
+            print(f"Appended pypower poles of {input_path.name} to {store.path}")
         except Exception as e:
-            print(f"Failed to save poles to {out_path}: {e}")
+            print(f"Failed to append poles to {store.path}: {e}")
 
 if __name__ == "__main__":
     main()
@@ -101,15 +101,10 @@ else:
 
 ### EZmocks loading
 if dirEZmocks is not None:
-    files = glob.glob(dirEZmocks+f'/pypowerpoles_r*.npy')
-    p0_ez = []
-    for fn in files:
-        poles = PowerSpectrumMultipoles.load(fn) 
-        k_ez, p0 = poles(ell=0, return_k=True, complex=False)
-        p0_ez.append(p0)
-    p0_ez_avg = np.mean(p0_ez, axis=0)
-    p0_err = np.std(p0_ez, axis=0)
-    print(f"Loaded {len(files)} EZmock power spectra from {dirEZmocks}")
+    # packed store or pypowerpoles_r*.npy files, mean and std in one streaming pass
+    from load_poles import load_EZmocks
+    p0_ez, p0_ez_avg, p0_err = load_EZmocks(dirEZmocks)
+    k_ez = k_1st
 
     
 # Plot -------------------------------------------------------------------------
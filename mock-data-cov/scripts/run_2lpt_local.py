@@ -0,0 +1,47 @@
+# !/usr/bin/env python3
+# the workdir is ~/projects/fihobi/mock-data-cov/
+# Fill the 2LPT displacement cache for a range of seeds on one node: NJOBS 2LPTnonlocal
+# subprocesses run concurrently, each in its own temporary directory, with the cores of the node
+# split between them. The EZmock scripts then find the fields in the cache.
+#
+# usage: python scripts/run_2lpt_local.py START COUNT CONFIG [--njobs 4] [--ncores 128] [--exe PATH]
+# test:  FIHOBI_DISP_DIR=/tmp/disp/ FIHOBI_DISP_CACHE=/tmp/disp/cache \
+#        python scripts/run_2lpt_local.py 1 8 CONFIG --ngrid 32 --exe scripts/stub_2lptnonlocal.py
+
+import argparse
+import yaml
+import os, sys
+current_dir = os.getcwd()
+source_dir = os.path.join(current_dir, "source")
+if source_dir not in sys.path:
+    sys.path.insert(0, source_dir)
+from disp2LPT_helper import run_disp_many
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Run 2LPTnonlocal for a range of seeds concurrently on one node.')
+    parser.add_argument('start', type=int, help='first seed')
+    parser.add_argument('count', type=int, help='number of seeds')
+    parser.add_argument('config', type=str, help='EZmock configuration (yaml)')
+    parser.add_argument('--njobs', type=int, default=4, help='concurrent 2LPT runs')
+    parser.add_argument('--ncores', type=int, default=os.cpu_count(), help='cores shared by the runs')
+    parser.add_argument('--ngrid', type=int, default=512, help='Ngrid of the displacement field')
+    parser.add_argument('--exe', type=str, default=None, help='2LPT executable (default: $FIHOBI_2LPT_EXE or ~/lib/2LPTic_PNG/2LPTnonlocal)')
+    return parser.parse_args()
+
+# run_disp_many parses the text with spawn pools, which re-import this script: keep it import-safe
+def main():
+    args = parse_args()
+    config = yaml.safe_load(open(args.config))
+    nthread = max(1, args.ncores // args.njobs)
+    seeds = list(range(args.start, args.start + args.count))
+    print(f"{len(seeds)} seed(s), {args.njobs} concurrent 2LPT runs with {nthread} threads each", flush=True)
+
+    entries = run_disp_many(seeds, config['redshift'], config['fnl4ezmocks'], njobs=args.njobs, nthread=nthread,
+                            Ngrid=args.ngrid, Lbox=2000, fix_amp=0, exe=args.exe)
+    failed = sorted(set(seeds) - set(entries))
+    print(f"Finished {len(entries)} seed(s)" + (f", failed: {failed}" if failed else '.'))
+
+
+if __name__ == "__main__":
+    main()
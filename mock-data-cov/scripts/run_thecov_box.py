@@ -21,6 +21,8 @@ import sys, os
 sys.path.insert(0, os.path.expanduser('~/lib/thecov'))
 from thecov import geometry, covariance
 import cosmoprimo
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', 'src')))
+from box_cov_helper import t0_box_cov
 
 def read_bias(path2dir):
     """
@@ -106,24 +108,21 @@ def cal_thecov_box(pk_theory, zeff, b1, nbar, cosmo, volume=2000**3,
     gaussian.compute_covariance()
 
     # ========== Trispectrum (T0) Covariance ==========
-    t0 = covariance.RegularTrispectrumCovariance(geom)
-    t0.set_kbins(kmin, kmax, dk)
-
-    plin = cosmo.get_fourier()
-    t0.set_linear_matter_pk(np.vectorize(lambda k: plin.pk_kz(k, zeff)))
-    t0.set_params(fgrowth=cosmo.growth_rate(zeff), b1=b1)
-    t0.compute_covariance()
+    # cached on disk on a grid of b1 (FIHOBI_COV_CACHE), interpolated in b1
+    nk = len(pk_theory['P_0'])
+    kedges = kmin + dk * np.arange(nk + 1)
+    t0 = t0_box_cov(kedges, zeff, b1, cosmo, volume=volume, ells=(0, 2))
+    t0_cov_P0, t0_cov_P2 = t0[:nk, :nk], t0[nk:, nk:]
 
     # ========== Save both to disk ==========
     os.makedirs(os.path.dirname(save_prefix), exist_ok=True)
-    combine = gaussian+t0
     out_dict = {
         'gaussian_cov_P0': gaussian.get_ell_cov(0, 0).cov,
         'gaussian_cov_P2': gaussian.get_ell_cov(2, 2).cov,
-        't0_cov_P0': t0.get_ell_cov(0, 0).cov,
-        't0_cov_P2': t0.get_ell_cov(2, 2).cov,
-        'comb_cov_P0': combine.get_ell_cov(0, 0).cov,
-        'comb_cov_P2': combine.get_ell_cov(2, 2).cov,
+        't0_cov_P0': t0_cov_P0,
+        't0_cov_P2': t0_cov_P2,
+        'comb_cov_P0': gaussian.get_ell_cov(0, 0).cov + t0_cov_P0,
+        'comb_cov_P2': gaussian.get_ell_cov(2, 2).cov + t0_cov_P2,
         'k_min': kmin,
         'k_max': kmax,
         'dk': dk,
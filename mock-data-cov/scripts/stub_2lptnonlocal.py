@@ -0,0 +1,17 @@
+#!/usr/bin/env python3
+# Stand-in for 2LPTnonlocal to test the 2LPT scheduling without fftw2/gsl: reads Nmesh and Seed
+# from the parameter file and writes random dispx/dispy/dispz_{seed}.txt to its OutputDir.
+#
+# usage: FIHOBI_2LPT_EXE=scripts/stub_2lptnonlocal.py python scripts/run_2lpt_local.py ...
+
+import os, sys
+import numpy as np
+
+params = dict(line.split()[:2] for line in open(sys.argv[1]) if len(line.split()) >= 2)
+ngrid, seed = int(params['Nmesh']), int(params['Seed'])
+odir = params['OutputDir']
+os.makedirs(odir, exist_ok=True)
+rng = np.random.default_rng(seed)
+for c in 'xyz':
+    np.savetxt(os.path.join(odir, f'disp{c}_{seed}.txt'), rng.normal(size=ngrid**3), fmt='%.6e')
+print(f"stub 2LPT: seed {seed}, Ngrid {ngrid}, OMP_NUM_THREADS={os.environ.get('OMP_NUM_THREADS')}", flush=True)
@@ -2,8 +2,19 @@
 # 1. paths to fftw2 and gsl libraries
 # 2. glass file: conf_2lpt/glass1_le, conf_2lpt/abacus_c000_tk.dat
 
-import os, subprocess
+import io, os, json, time, fcntl, shutil, hashlib, tempfile, subprocess, multiprocessing
 from pathlib import Path
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+import numpy as np
+
+DISP_DIR = os.environ.get('FIHOBI_DISP_DIR', '/pscratch/sd/s/siyizhao/2LPTdisp/')  # where 2LPTnonlocal writes dispx/dispy/dispz_{seed}.txt
+CONF_DIR = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'conf_2lpt'))  # glass and transfer files
+LPT_EXE = os.environ.get('FIHOBI_2LPT_EXE', os.path.expanduser('~/lib/2LPTic_PNG/2LPTnonlocal'))
+TRANSFER_FILE = os.path.join(CONF_DIR, 'abacus_c000_tk.dat')  # FileWithInputTransfer of generate_2lpt_param
+DISP_CACHE = os.environ.get('FIHOBI_DISP_CACHE', os.path.join(DISP_DIR, 'cache'))  # binary displacement cache
+DISP_CACHE_GB = float(os.environ.get('FIHOBI_DISP_CACHE_GB', 200))  # size bound of the cache, LRU eviction
+DISP_CACHE_MIN_AGE = 600  # seconds: entries used more recently are never evicted
 
 def generate_2lpt_param(
     seed: int,
@@ -13,6 +24,8 @@ def generate_2lpt_param(
     Lbox: int = 2000,
     fix_amp: int = 0,
     output_path: str | None = None,
+    conf_dir: str = 'conf_2lpt',
+    output_dir: str = '/pscratch/sd/s/siyizhao/no_need_of_dir',
 ) -> str:
     """
     Build a parameter file (as text) and optionally write it to `output_path`.
@@ -22,14 +35,20 @@ def generate_2lpt_param(
     fix_amp : int
         Whether to fix the amplitude of the initial conditions.
         0: no (default), 1: yes.
+    conf_dir : str
+        Directory of the glass and transfer function files; pass an absolute path (CONF_DIR)
+        when 2LPTnonlocal does not run from mock-data-cov/.
+    output_dir : str
+        OutputDir of 2LPTnonlocal, where it writes dispx/dispy/dispz_{seed}.txt. The default
+        placeholder is also the one hashed by disp_cache_key, so the cache keys do not depend on it.
     """
 
     script = f"""Nmesh         {Ngrid}     
 Nsample       {Ngrid}                                    
 Box           {Lbox}
 FileBase      ics_{Ngrid}_{Lbox}
-OutputDir     /pscratch/sd/s/siyizhao/no_need_of_dir
-GlassFile     conf_2lpt/glass1_le
+OutputDir     {output_dir}
+GlassFile     {conf_dir}/glass1_le
 GlassTileFac  {Ngrid}     
 
 Omega               0.315192      
@@ -47,11 +66,11 @@ PhaseFlip        0
 SphereMode       0         
                                                       
 WhichSpectrum    0         
-FileWithInputSpectrum    conf_2lpt/no_need_of_file.txt
+FileWithInputSpectrum    {conf_dir}/no_need_of_file.txt
 InputSpectrum_UnitLength_in_cm  3.085678e24 
 ShapeGamma       0.201     
 WhichTransfer    2        
-FileWithInputTransfer     conf_2lpt/abacus_c000_tk.dat
+FileWithInputTransfer     {conf_dir}/abacus_c000_tk.dat
 
 Seed             {seed}       
 
@@ -73,43 +92,331 @@ WDM_PartMass_in_kev  10.0
 
     return script
 
-def run_disp_2lpt(seed, redshift, fnl, Ngrid=512, Lbox=2000, fix_amp=0):
+def run_disp_2lpt(seed, redshift, fnl, Ngrid=512, Lbox=2000, fix_amp=0, nthread=None, exe=None, log=None, pdir=DISP_DIR, odir=None):
     '''
     Generate 2LPT displacement field for given seed, redshift, fnl.
-    LOG: logs/2lpt_r{seed}.log
-    '''
-    ### prepare parameter file for 2LPTnonlocal --------------------------------
-    fn_config = f'conf_2lpt/params_2lpt/r{seed}.param'
-    generate_2lpt_param(seed=seed, redshift=redshift, fnl=fnl, Ngrid=Ngrid, Lbox=Lbox, fix_amp=fix_amp, output_path=fn_config)
-    print(f"Generated {fn_config}", flush=True)
-    
-    ### prepare displacement field with 2LPTnonlocal ---------------------------
-    print(f'Generating 2LPT displacement field for seed {seed}...', flush=True)
+    The parameter file is written to a private temporary directory, which is also the working
+    directory and the OutputDir of 2LPTnonlocal, and refers to the glass and transfer files by
+    absolute path, so several seeds can run at the same time from any directory.
 
+    nthread: OMP_NUM_THREADS of 2LPTnonlocal (default: inherited, else 1).
+    exe: 2LPT executable (default: LPT_EXE, i.e. $FIHOBI_2LPT_EXE or ~/lib/2LPTic_PNG/2LPTnonlocal).
+    log: file for the output of 2LPTnonlocal (default: the caller's stdout/stderr).
+    pdir: where the dispx/dispy/dispz_{seed}.txt files go (default: DISP_DIR). Builds of
+        2LPTnonlocal that ignore OutputDir write them there directly; the file names then only
+        carry the seed, so runs of the same seed (e.g. another fnl) are serialised by a lock in pdir
+        until their files are moved out. Different seeds still run at the same time.
+    odir: if given, the text files are moved there instead of pdir.
+    '''
+    exe = os.path.abspath(os.path.expanduser(exe or LPT_EXE))
     home = os.path.expanduser("~")
-    cmd = [
-        f"{home}/lib/2LPTic_PNG/2LPTnonlocal",
-        fn_config
-    ]
     # fftw2 and gsl paths: build LD_LIBRARY_PATH for the child process only
     new_ld = f"{home}/lib/fftw-2.1.5/lib:{home}/.conda/envs/ezmock_png/lib"
 
-    # Use a snapshot of os.environ for subprocess.run and ensure single-threaded
+    # Use a snapshot of os.environ for subprocess.run
     env = os.environ.copy()
     if env.get("LD_LIBRARY_PATH"):
         env["LD_LIBRARY_PATH"] = new_ld + ":" + env.get("LD_LIBRARY_PATH")
     else:
         env["LD_LIBRARY_PATH"] = new_ld
+    if nthread is not None:
+        env["OMP_NUM_THREADS"] = str(nthread)
     env.setdefault("OMP_NUM_THREADS", "1")
 
-    # Run the external program and let it inherit the caller's stdout/stderr
-    # so output goes to the same place as the caller (terminal or redirected file).
+    odir = odir or pdir
+    os.makedirs(pdir, exist_ok=True)
+    os.makedirs(odir, exist_ok=True)
+    # workdir next to odir: the text files (GBs at 512^3) are then renamed, not copied
+    with _flock(os.path.join(pdir, f'.r{seed}.lock')), \
+         tempfile.TemporaryDirectory(prefix=f'.2lpt_r{seed}_', dir=odir) as workdir:
+        ### prepare parameter file for 2LPTnonlocal ----------------------------
+        fn_config = os.path.join(workdir, f'r{seed}.param')
+        generate_2lpt_param(seed=seed, redshift=redshift, fnl=fnl, Ngrid=Ngrid, Lbox=Lbox, fix_amp=fix_amp, output_path=fn_config, conf_dir=CONF_DIR, output_dir=workdir)
+
+        ### prepare displacement field with 2LPTnonlocal -----------------------
+        print(f'Generating 2LPT displacement field for seed {seed} ({env["OMP_NUM_THREADS"]} threads)...', flush=True)
+        out = open(log, 'a') if log else None
+        try:
+            subprocess.run([exe, fn_config], env=env, cwd=workdir, check=True, stdout=out, stderr=subprocess.STDOUT if out else None)
+        except subprocess.CalledProcessError as e:
+            print(f"2LPT failed for seed {seed}, returncode {e.returncode}.", flush=True)
+            raise
+        finally:
+            if out:
+                out.close()
+        for fn_work, fn_pdir, fn_out in zip(disp_paths(seed, workdir), disp_paths(seed, pdir), disp_paths(seed, odir)):
+            src = next((fn for fn in (fn_work, fn_pdir) if os.path.exists(fn)), None)
+            if src is None:
+                raise FileNotFoundError(f"2LPT wrote no {os.path.basename(fn_work)} in {workdir} (OutputDir) or {pdir}.")
+            if src != fn_out:
+                shutil.move(src, fn_out)
+
+    print(f'Done. Displacement field saved to {odir}.', flush=True)
+
+def disp_paths(seed, pdir=DISP_DIR, ext='txt'):
+    'Paths of the x, y, z displacement files of a seed.'
+    return [os.path.join(pdir, f'disp{c}_{seed}.{ext}') for c in 'xyz']
+
+def _parse_chunk(fn, start, stop, dtype):
+    with open(fn, 'rb') as f:
+        f.seek(start)
+        buf = f.read(stop - start)
+    return np.loadtxt(io.BytesIO(buf), dtype=dtype, ndmin=1).ravel()
+
+def _chunk_bounds(fn, nchunks):
+    'Byte ranges of about equal size ending on line boundaries.'
+    size = os.path.getsize(fn)
+    bounds = [0]
+    with open(fn, 'rb') as f:
+        for i in range(1, nchunks):
+            f.seek(max(size * i // nchunks, bounds[-1]))
+            f.readline()
+            bounds.append(min(f.tell(), size))
+    bounds.append(size)
+    return [(a, b) for a, b in zip(bounds[:-1], bounds[1:]) if b > a]
+
+def convert_disp(seed, pdir=DISP_DIR, Ngrid=None, dtype=np.float32, nproc=None, remove_txt=True, mp_context=None):
+    """
+    Convert the ASCII displacement fields of 2LPTnonlocal to binary .npy files (float32 by default).
+
+    The text is parsed in line-aligned chunks by a process pool (nproc: $OMP_NUM_THREADS by default)
+    and written to a .tmp.npy renamed when complete. The text files are removed afterwards. Seeds
+    already converted are left untouched.
+
+    mp_context: start method of the pool (default: the platform's, i.e. fork on Linux). Pass 'spawn'
+    when calling from a worker thread while other threads of the process keep running (e.g. EZmock),
+    as forking a multi-threaded process can deadlock the children; the __main__ script must then be
+    guarded by `if __name__ == "__main__"`.
+
+    Returns: paths of the .npy files.
+    """
+    nproc = int(nproc or os.environ.get('OMP_NUM_THREADS', 1))
+    npys = disp_paths(seed, pdir, ext='npy')
+    for txt, npy in zip(disp_paths(seed, pdir), npys):
+        if os.path.exists(npy) and not os.path.exists(txt):
+            continue
+        chunks = _chunk_bounds(txt, 4 * nproc)
+        if nproc > 1:
+            ctx = multiprocessing.get_context(mp_context) if mp_context else None
+            with ProcessPoolExecutor(max_workers=nproc, mp_context=ctx) as executor:
+                parts = list(executor.map(_parse_chunk, [txt] * len(chunks), *zip(*chunks), [dtype] * len(chunks)))
+        else:
+            parts = [_parse_chunk(txt, a, b, dtype) for a, b in chunks]
+        size = sum(len(part) for part in parts)
+        if Ngrid is not None and size != Ngrid**3:
+            raise ValueError(f"{txt} holds {size} values, expected Ngrid^3 = {Ngrid**3}.")
+        tmp = npy[:-len('.npy')] + '.tmp.npy'
+        out = np.lib.format.open_memmap(tmp, mode='w+', dtype=dtype, shape=(size,))
+        start = 0
+        for part in parts:
+            out[start:start + len(part)] = part
+            start += len(part)
+        out.flush()
+        del out, parts
+        os.replace(tmp, npy)
+        if remove_txt:
+            os.remove(txt)
+        print(f"Converted {txt} -> {npy}", flush=True)
+    return npys
+
+@contextmanager
+def load_disp(seed, pdir=DISP_DIR, Ngrid=None, dtype=np.float32, keep=False, nproc=None):
+    """
+    Binary displacement fields (dx, dy, dz) of a seed for EZmock.create_dens_field_from_disp,
+    as read-only memmaps of the .npy files made by convert_disp. On exit the files are removed,
+    unless keep=True (e.g. to reuse the displacements for another set of EZmock parameters).
+
+    with load_disp(seed, Ngrid=512) as (dx, dy, dz):
+        ez.create_dens_field_from_disp(dx, dy, dz, deepcopy=True)
+    """
+    npys = convert_disp(seed, pdir=pdir, Ngrid=Ngrid, dtype=dtype, nproc=nproc)
+    try:
+        yield [np.load(fn, mmap_mode='r') for fn in npys]
+    finally:
+        if not keep:
+            for fn in npys:
+                if os.path.exists(fn):
+                    os.remove(fn)
+
+
+##### ----- displacement cache ----- #####
+def _file_hash(fn):
+    h = hashlib.blake2b(digest_size=16)
+    with open(fn, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+def disp_cache_key(seed, redshift, fnl, Ngrid=512, Lbox=2000, fix_amp=0, transfer=TRANSFER_FILE):
+    """
+    Key of a displacement field: hash of the full 2LPTnonlocal parameter file (seed, redshift,
+    fnl, Ngrid, Lbox, fix_amp and the cosmology) and of the content of the transfer function file.
+    """
+    text = generate_2lpt_param(seed=int(seed), redshift=redshift, fnl=fnl, Ngrid=Ngrid, Lbox=Lbox, fix_amp=fix_amp)
+    transfer_hash = _file_hash(transfer) if os.path.exists(transfer) else 'missing'
+    return hashlib.blake2b((text + transfer_hash).encode(), digest_size=20).hexdigest()
+
+def _dir_size(path):
+    size = 0
+    try:
+        for fn in os.scandir(path):
+            size += fn.stat().st_size
+    except FileNotFoundError:  # removed meanwhile by another job
+        pass
+    return size
+
+@contextmanager
+def _flock(path, blocking=True):
+    'Exclusive flock on `path` (created if needed); yields False if non-blocking and already held.'
+    with open(path, 'a') as f:
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+def _key_lock(cache_dir, key, blocking=True):
+    'Lock of a cache key, held while the entry is generated, opened or evicted.'
+    os.makedirs(cache_dir, exist_ok=True)
+    return _flock(os.path.join(cache_dir, f'.{key}.lock'), blocking=blocking)
+
+def evict_disp_cache(cache_dir=DISP_CACHE, max_gb=DISP_CACHE_GB, keep=(), min_age=DISP_CACHE_MIN_AGE):
+    """
+    Remove the least recently used entries until the cache is below max_gb. Entries in `keep`,
+    used within the last `min_age` seconds, or locked by another job (being generated or opened)
+    stay. Run directories left by crashed jobs are removed as well.
+    """
+    if not os.path.isdir(cache_dir):
+        return
+    now = time.time()
+    entries, stale = [], []
+    for d in os.scandir(cache_dir):
+        if not d.is_dir():
+            continue
+        try:
+            mtime = d.stat().st_mtime
+        except FileNotFoundError:
+            continue
+        (stale if d.name.startswith('.') else entries).append((mtime, d.name))
+    for _, name in stale:
+        # .{key}.run*: unfinished run directory, stale unless its key is being generated
+        with _key_lock(cache_dir, name[1:].split('.')[0], blocking=False) as free:
+            if free:
+                shutil.rmtree(os.path.join(cache_dir, name), ignore_errors=True)
+    entries.sort()
+    total = sum(_dir_size(os.path.join(cache_dir, name)) for _, name in entries)
+    for mtime, name in entries:
+        if total <= max_gb * 1024**3:
+            break
+        if name in keep or now - mtime < min_age:
+            continue
+        entry = os.path.join(cache_dir, name)
+        with _key_lock(cache_dir, name, blocking=False) as free:
+            # re-check under the lock: a hit may have touched the entry meanwhile
+            if not free or not os.path.isdir(entry) or time.time() - os.path.getmtime(entry) < min_age:
+                continue
+            size = _dir_size(entry)
+            shutil.rmtree(entry, ignore_errors=True)
+        total -= size
+        print(f"[cache] evicted displacement {name} ({size / 1024**3:.2f} GB)", flush=True)
+
+def _ensure_disp_locked(key, seed, redshift, fnl, Ngrid, Lbox, fix_amp, pdir, cache_dir, nproc, mp_context, **run_kw):
+    'ensure_disp with the key lock held.'
+    entry = os.path.join(cache_dir, key)
+    if os.path.isdir(entry):
+        os.utime(entry)
+        print(f"[cache] displacement of seed {seed} <- {entry}", flush=True)
+        return entry
+    # private run directory: the text files, .npy and meta of this key only, renamed into place when complete
+    rundir = tempfile.mkdtemp(dir=cache_dir, prefix=f'.{key}.run')
     try:
-        subprocess.run(cmd, env=env, check=True)
-    except subprocess.CalledProcessError as e:
-        print(f"2LPT failed for seed {seed}, returncode {e.returncode}.", flush=True)
+        run_disp_2lpt(seed=seed, redshift=redshift, fnl=fnl, Ngrid=Ngrid, Lbox=Lbox, fix_amp=fix_amp, pdir=pdir, odir=rundir, **run_kw)
+        npys = convert_disp(seed, pdir=rundir, Ngrid=Ngrid, nproc=nproc, mp_context=mp_context)
+        for c, fn in zip('xyz', npys):
+            os.rename(fn, os.path.join(rundir, f'disp{c}.npy'))
+        with open(os.path.join(rundir, 'meta.json'), 'w') as f:
+            json.dump({'seed': seed, 'redshift': redshift, 'fnl': fnl, 'Ngrid': Ngrid, 'Lbox': Lbox, 'fix_amp': fix_amp, 'created': time.time()}, f)
+        os.rename(rundir, entry)
+    except BaseException:
+        shutil.rmtree(rundir, ignore_errors=True)
         raise
+    return entry
 
-    print('Done. Displacement field saved to /pscratch/sd/s/siyizhao/2LPTdisp/.', flush=True)
+def ensure_disp(seed, redshift, fnl, Ngrid=512, Lbox=2000, fix_amp=0, pdir=DISP_DIR, cache_dir=DISP_CACHE, max_gb=DISP_CACHE_GB, nproc=None, mp_context=None, **run_kw):
+    """
+    Directory of the cached float32 displacements (dispx/dispy/dispz.npy) of a 2LPT run, generated
+    with run_disp_2lpt and convert_disp on a miss. A hit skips 2LPTnonlocal and marks the entry as
+    recently used. A miss is generated under a per-key lock file in cache_dir, in a private run
+    directory renamed into place when complete, so concurrent jobs needing the same key wait for a
+    single run and never see a partial entry. pdir is where 2LPTnonlocal writes its text files.
+    nproc and mp_context are passed to convert_disp, run_kw (nthread, exe, log) to run_disp_2lpt.
+    """
+    key = disp_cache_key(seed, redshift, fnl, Ngrid=Ngrid, Lbox=Lbox, fix_amp=fix_amp)
+    with _key_lock(cache_dir, key):
+        entry = _ensure_disp_locked(key, seed, redshift, fnl, Ngrid, Lbox, fix_amp, pdir, cache_dir, nproc, mp_context, **run_kw)
+    evict_disp_cache(cache_dir, max_gb=max_gb, keep=(key,))
+    return entry
 
+@contextmanager
+def cached_disp(seed, redshift, fnl, Ngrid=512, Lbox=2000, fix_amp=0, pdir=DISP_DIR, cache_dir=DISP_CACHE, max_gb=DISP_CACHE_GB, nproc=None, mp_context=None, **run_kw):
+    """
+    Like load_disp, but through the displacement cache: yields read-only memmaps (dx, dy, dz) and
+    leaves the entry in the cache. The arguments are those of ensure_disp.
+
+    with cached_disp(seed, redshift, fnl, Ngrid=512) as (dx, dy, dz):
+        ez.create_dens_field_from_disp(dx, dy, dz, deepcopy=True)
+    """
+    key = disp_cache_key(seed, redshift, fnl, Ngrid=Ngrid, Lbox=Lbox, fix_amp=fix_amp)
+    with _key_lock(cache_dir, key):
+        entry = _ensure_disp_locked(key, seed, redshift, fnl, Ngrid, Lbox, fix_amp, pdir, cache_dir, nproc, mp_context, **run_kw)
+        # opened under the lock, so the entry cannot be evicted in between; the memmaps then stay
+        # valid even if another job evicts the entry
+        disp = [np.load(os.path.join(entry, f'disp{c}.npy'), mmap_mode='r') for c in 'xyz']
+    evict_disp_cache(cache_dir, max_gb=max_gb, keep=(key,))
+    yield disp
+
+
+##### ----- local scheduler ----- #####
+def balance_threads(ncores, n2lpt, work_ratio=1.):
+    """
+    Split ncores between n2lpt concurrent 2LPT runs and one EZmock + pypower stage, so that both
+    stages of the pipeline take about the same wall time (assuming linear thread scaling).
+    work_ratio: core-time of one 2LPT seed over that of one EZmock seed.
 
+    Returns: (threads per 2LPT run, threads of the EZmock stage).
+    """
+    if n2lpt <= 0:
+        return 0, ncores
+    n_lpt = ncores * work_ratio / (1. + work_ratio)
+    t_lpt = max(1, int(round(n_lpt / n2lpt)))
+    return t_lpt, max(1, ncores - n2lpt * t_lpt)
+
+def run_disp_many(seeds, redshift, fnl, njobs=4, nthread=1, **kwargs):
+    """
+    Fill the displacement cache for many seeds on one node: njobs 2LPT subprocesses with nthread
+    OpenMP threads each run concurrently, each in its own temporary directory (see run_disp_2lpt).
+    kwargs are passed to ensure_disp; the text is parsed by 'spawn' pools since the runs are driven
+    by threads (see convert_disp). Failed seeds are reported and skipped.
+
+    Returns: {seed: cache entry} of the successful seeds.
+    """
+    kwargs.setdefault('nproc', nthread)
+    kwargs.setdefault('mp_context', 'spawn')
+    t0 = time.time()
+    entries = {}
+    with ThreadPoolExecutor(max_workers=njobs) as executor:
+        futures = {executor.submit(ensure_disp, seed, redshift, fnl, nthread=nthread, **kwargs): seed for seed in seeds}
+        for future in as_completed(futures):
+            seed = futures[future]
+            try:
+                entries[seed] = future.result()
+            except Exception as e:
+                print(f"[2lpt] seed {seed} failed: {e}", flush=True)
+                continue
+            dt = time.time() - t0
+            print(f"[2lpt] {len(entries)}/{len(seeds)} seeds in {dt:.0f}s, {3600. * len(entries) / dt:.1f} seeds/hour", flush=True)
+    return entries
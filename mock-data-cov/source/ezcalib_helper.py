@@ -0,0 +1,131 @@
+# Surrogate-based calibration of the EZmock bias parameters against a reference P(k).
+# The multipoles of EZmock are modelled, bin by bin, by a quadratic response surface of the
+# (normalised) parameters, fitted to the trials run so far; the surrogate chi2 is minimised
+# in a trust region around the best trial, the proposal is run, and the surface is refitted.
+
+import numpy as np
+from scipy.optimize import minimize
+
+PARAMS = ('rho_c', 'rho_exp', 'pdf_base', 'sigma_v')
+
+
+def load_reference(fn, nbar, kmin=0.01, kmax=0.3, ells=(0, 2)):
+    """
+    Reference multipoles from a pypower2powspec.txt file (see scripts/abacus_pkl.py), with the
+    Gaussian errors of a periodic box from the number of modes and the shot noise 1/nbar.
+
+    Returns: dict with 'k', 'data' (flattened [ell][k]), 'sigma', 'ells', 'mask' (on the file rows).
+    """
+    table = np.loadtxt(fn)
+    k, nmodes = table[:, 0], table[:, 4]
+    poles = {0: table[:, 5], 2: table[:, 6]}
+    mask = np.isfinite(k) & (k >= kmin) & (k <= kmax) & (nmodes > 0)
+    for ell in ells:
+        mask &= np.isfinite(poles[ell])
+    ptot = poles[0][mask] + 1. / nbar
+    data = np.concatenate([poles[ell][mask] for ell in ells])
+    sigma = np.concatenate([np.sqrt(2. * (2 * ell + 1) / nmodes[mask]) * ptot for ell in ells])
+    return {'k': k[mask], 'data': data, 'sigma': sigma, 'ells': tuple(ells), 'mask': mask}
+
+
+def latin_hypercube(n, ndim, rng):
+    'n points in [0, 1]^ndim, one per row and column stratum.'
+    u = (np.arange(n)[:, None] + rng.random((n, ndim))) / n
+    for i in range(ndim):
+        u[:, i] = rng.permutation(u[:, i])
+    return u
+
+
+def quadratic_features(u):
+    'Constant, linear and quadratic (with cross) terms of u (N, ndim) -> (N, 1 + ndim + ndim(ndim+1)/2).'
+    u = np.atleast_2d(u)
+    iu = np.triu_indices(u.shape[1])
+    quad = (u[:, :, None] * u[:, None, :])[:, iu[0], iu[1]]
+    return np.hstack([np.ones((len(u), 1)), u, quad])
+
+
+class quadratic_surrogate:
+    '''
+    Quadratic response surface of the model data vector, fitted by weighted least squares to
+    the trials; the weights favour the trials close to `center`, so the surface stays local
+    as the search contracts.
+    '''
+    def __init__(self, U, Y, center=None, scale=None, ridge=1e-8):
+        '''
+        U: (N, ndim) normalised parameters of the trials; Y: (N, ndata) model data vectors.
+        center, scale: Gaussian weights exp(-|u - center|^2 / 2 scale^2); None for uniform weights.
+        '''
+        X = quadratic_features(U)
+        w = np.ones(len(U)) if center is None else np.exp(-0.5 * np.sum((U - center)**2, axis=1) / scale**2)
+        Xw = X * w[:, None]
+        A = X.T @ Xw + ridge * np.eye(X.shape[1])
+        self.coeffs = np.linalg.solve(A, Xw.T @ Y)
+
+    def __call__(self, u):
+        return quadratic_features(u) @ self.coeffs
+
+
+def chi2(model, ref):
+    return float(np.sum(((model - ref['data']) / ref['sigma'])**2))
+
+
+def calibrate(evaluate, ref, bounds, n_init=None, n_iter=20, radius=0.25, shrink=0.6, tol=1e-3, seed=0, trials=None, verbose=True):
+    """
+    Fit the EZmock parameters to the reference multipoles.
+
+    evaluate: function(params dict) -> model data vector (same layout as ref['data']), i.e. one
+        EZmock run with a fixed displacement field.
+    bounds: {name: (low, high)} for the parameters in PARAMS order.
+    n_init: size of the initial Latin hypercube (default: number of quadratic coefficients + 2).
+    n_iter: maximal number of surrogate-guided runs; the trust region (radius in normalised
+        units) shrinks when a proposal does not improve on the best trial, and the loop stops
+        when it falls below tol.
+    trials: list of (params dict, data vector) already run, e.g. read back from a log; reused.
+
+    Returns: best params dict, its chi2, and the list of trials.
+    """
+    names = [name for name in PARAMS if name in bounds]
+    low = np.array([bounds[name][0] for name in names], dtype=float)
+    high = np.array([bounds[name][1] for name in names], dtype=float)
+    to_u = lambda params: (np.array([params[name] for name in names]) - low) / (high - low)
+    to_params = lambda u: {name: float(v) for name, v in zip(names, low + u * (high - low))}
+    ndim = len(names)
+    nfeat = quadratic_features(np.zeros((1, ndim))).shape[1]
+    rng = np.random.default_rng(seed)
+
+    trials = list(trials or [])
+    def run(u):
+        params = to_params(u)
+        model = np.asarray(evaluate(params), dtype=float)
+        trials.append((params, model))
+        if verbose:
+            print(f"[calib] trial {len(trials)}: {params} chi2 = {chi2(model, ref):.2f}", flush=True)
+        return model
+
+    n_init = nfeat + 2 if n_init is None else n_init
+    for u in latin_hypercube(max(n_init - len(trials), 0), ndim, rng):
+        run(u)
+
+    for it in range(n_iter):
+        U = np.array([to_u(params) for params, _ in trials])
+        Y = np.array([model for _, model in trials])
+        chi2s = np.array([chi2(model, ref) for model in Y])
+        best = np.argmin(chi2s)
+        center = U[best]
+        surrogate = quadratic_surrogate(U, Y, center=center, scale=max(2 * radius, 0.1))
+        objective = lambda u: chi2(surrogate(u)[0], ref)
+        box = [(max(c - radius, 0.), min(c + radius, 1.)) for c in center]
+        starts = [center] + [np.clip(center + radius * rng.uniform(-1, 1, ndim), 0., 1.) for _ in range(4)]
+        res = min((minimize(objective, x0, method='L-BFGS-B', bounds=box) for x0 in starts), key=lambda r: r.fun)
+        if np.max(np.abs(res.x - center)) < tol:
+            radius *= shrink  # surrogate optimum at the best trial: zoom in
+        else:
+            model = run(res.x)
+            if chi2(model, ref) >= chi2s[best]:
+                radius *= shrink
+        if radius < tol:
+            break
+
+    chi2s = np.array([chi2(model, ref) for _, model in trials])
+    best = int(np.argmin(chi2s))
+    return trials[best][0], float(chi2s[best]), trials
@@ -1,14 +1,95 @@
 # From Shengyu & Jiaxi
 
 import os
-import fitsio
 import numpy as np
-from astropy.table import Table
-import matplotlib.pyplot as plt
-import matplotlib.gridspec as gridspec
 from scipy.stats import gaussian_kde
 from scipy.interpolate import interp1d
 
+REPEAT_DIR = '/global/cfs/projectdirs/desi/users/jiaxiyu/repeated_observations/EDR_vs_Y3/LSS-scripts_repeats'
+
+_repeat_cache = {}
+
+def _repeat_pairs(tracer):
+    """
+    Delta_v and the two redshifts of the clean repeat pairs of a tracer, as (dv, z0, z1).
+    Only the needed columns are read, with fitsio, and the result is kept for the process, so
+    all the redshift bins of a tracer share one read and one set of quality cuts.
+    """
+    if tracer in _repeat_cache:
+        return _repeat_cache[tracer]
+    import fitsio
+    from desitarget.targetmask import desi_mask, bgs_mask
+    from desitarget.targetmask import zwarn_mask as zmtl_zwarn_mask
+
+    # Validate the tracer input
+    if tracer[:3] in ['LRG', 'ELG', 'QSO']:
+        repeatdir= f'{REPEAT_DIR}/main-repeats-kibo-dark-pairs.fits'
+        mask, mask_key = desi_mask, "DESI_TARGET"
+        effkey, effmin, effmax = "TSNR2_LRG", 0.85 * 1000, 1.5 * 1000
+    elif tracer[:3] == 'BGS':
+        repeatdir= f'{REPEAT_DIR}/main-repeats-kibo-bright-pairs.fits'
+        mask, mask_key = bgs_mask, "BGS_TARGET"
+        effkey, effmin, effmax = "TSNR2_BGS", 0.85 * 180, 1.5 * 180
+    else:
+        raise ValueError(f"Invalid tracer: {tracer[:3]}. Must be in/be a subsample of ['BGS', 'LRG', 'ELG', 'QSO'].")
+    goodkey = f"GOOD_{tracer[:3]}"
+    # Redrock redshift selections:
+    if tracer != 'QSO':
+        columns = ['DV', 'Z_0', 'Z_1', mask_key]
+        for i in '01':
+            columns += [f'{effkey}_{i}', f'ZMTL_ZWARN_{i}', f'COADD_FIBERSTATUS_{i}', f'{goodkey}_{i}', f'SURVEY_{i}']
+            if tracer[:3] == 'ELG':
+                columns += [f'GOOD_QSO_{i}']
+        d, hdr = fitsio.read(repeatdir, columns=columns, header=True)
+        # efftime_spec calculation for selections
+        snr2time = hdr["{}SNR2T".format(effkey.split("_")[1])]
+        efftime0s = snr2time * d["{}_0".format(effkey)]
+        efftime1s = snr2time * d["{}_1".format(effkey)]
+        # zmtl_zwarn_mask nodata + bad selections
+        nodata0 = (d["ZMTL_ZWARN_0"] & zmtl_zwarn_mask["NODATA"]) > 0
+        nodata1 = (d["ZMTL_ZWARN_1"] & zmtl_zwarn_mask["NODATA"]) > 0
+        badqa0 = (d["ZMTL_ZWARN_0"] & zmtl_zwarn_mask.mask("BAD_SPECQA|BAD_PETALQA")) > 0
+        badqa1 = (d["ZMTL_ZWARN_1"] & zmtl_zwarn_mask.mask("BAD_SPECQA|BAD_PETALQA")) > 0
+        # Apply the selection criteria to clean the data
+        sel = (d[mask_key] & mask[tracer]) > 0
+        sel &= (d["COADD_FIBERSTATUS_0"] == 0) & (d["COADD_FIBERSTATUS_1"] == 0)
+        sel &= (~nodata0) & (~nodata1)
+        sel &= (~badqa0) & (~badqa1)
+        sel &= (efftime0s > effmin) & (efftime1s > effmin)
+        sel &= (efftime0s < effmax) & (efftime1s < effmax)
+        sel &= (d["{}_0".format(goodkey)]) & (d["{}_1".format(goodkey)])
+        sel &= (np.char.strip(d['SURVEY_0'].astype(str))=='main')&(np.char.strip(d['SURVEY_1'].astype(str))=='main')
+        if tracer[:3] == 'ELG':
+            sel &= (~d["GOOD_QSO_0"]) & (~d["GOOD_QSO_1"])
+    else:
+        qsofn    = repeatdir[:-5]+'_QSO'+repeatdir[-5:]
+        d        = fitsio.read(qsofn, columns=['DV', 'Z_0', 'Z_1'])
+        sel      = ~np.isnan(d['DV'])
+    _repeat_cache[tracer] = (d['DV'][sel], d['Z_0'][sel], d['Z_1'][sel])
+    return _repeat_cache[tracer]
+
+def binned_kde(x, grid, bw_method=0.3):
+    """
+    Gaussian KDE of the 1D samples x on the regular `grid`, as scipy.stats.gaussian_kde(x,
+    bw_method)(grid) for a scalar bw_method, but in O(N + M log M): the samples are linearly
+    binned on the grid (extended to the samples and 5 kernel widths) and convolved by FFT.
+    """
+    from scipy.signal import fftconvolve
+    h     = grid[1] - grid[0]
+    sigma = bw_method * np.std(x, ddof=1)
+    pad   = int(np.ceil(5 * sigma / h))
+    k0    = int(np.floor((min(x.min(), grid[0]) - grid[0]) / h)) - pad
+    k1    = int(np.ceil((max(x.max(), grid[-1]) - grid[0]) / h)) + pad
+    t     = (x - grid[0]) / h - k0
+    i     = np.floor(t).astype(int)
+    f     = t - i
+    n     = k1 - k0 + 2
+    counts = np.bincount(i, weights=1 - f, minlength=n) + np.bincount(i + 1, weights=f, minlength=n)
+    offsets = np.arange(-pad, pad + 1) * h
+    kernel  = np.exp(-0.5 * (offsets / sigma)**2) / (np.sqrt(2 * np.pi) * sigma)
+    dens    = fftconvolve(counts, kernel, mode='same') / len(x)
+    return dens[-k0:-k0 + len(grid)]
+
 def vsmear_modelling(tracer,zmin,zmax,dvfn='./'):
     """
     vsmear_modelling function:
@@ -40,96 +121,60 @@ def vsmear_modelling(tracer,zmin,zmax,dvfn='./'):
     Example usage:
     --------------
     vsmear_modelling('LRG', 0.4, 0.6, dvfn='./output')
+
+    For several redshift bins, vsmear_modelling_bins reads and cleans the pairs only once.
     """
 
-    from desitarget.targetmask import desi_mask, bgs_mask
-    from desitarget.targetmask import zwarn_mask as zmtl_zwarn_mask
+    return vsmear_modelling_bins(tracer, [(zmin, zmax)], dvfn=dvfn)
 
-    # Validate the tracer input
-    if tracer[:3] in ['LRG', 'ELG', 'QSO']:
-        repeatdir= '/global/cfs/projectdirs/desi/users/jiaxiyu/repeated_observations/EDR_vs_Y3/LSS-scripts_repeats/main-repeats-kibo-dark-pairs.fits'
-        mask, mask_key = desi_mask, "DESI_TARGET"
-        effkey, effmin, effmax, effxlim = (
-            "TSNR2_LRG",
-            0.85 * 1000,
-            1.5 * 1000,
-            (500, 1500),
-        )
-    elif tracer[:3] == 'BGS':
-        repeatdir= '/global/cfs/projectdirs/desi/users/jiaxiyu/repeated_observations/EDR_vs_Y3/LSS-scripts_repeats/main-repeats-kibo-bright-pairs.fits'
-        mask, mask_key = bgs_mask, "BGS_TARGET"
-        effkey, effmin, effmax, effxlim = "TSNR2_BGS", 0.85 * 180, 1.5 * 180, (0, 500)
-    else:
-        raise ValueError(f"Invalid tracer: {tracer[:3]}. Must be in/be a subsample of ['BGS', 'LRG', 'ELG', 'QSO'].")
+def vsmear_modelling_bins(tracer,zbins,dvfn='./'):
+    """
+    vsmear_modelling for several redshift bins [(zmin, zmax), ...] of one tracer: the repeat
+    pairs are read and cleaned once (see _repeat_pairs), and the modelled PDF uses the FFT
+    binned KDE instead of scipy's gaussian_kde. Files that already exist are not rewritten.
+
+    Example usage:
+    --------------
+    vsmear_modelling_bins('LRG', [(0.4, 0.6), (0.6, 0.8), (0.8, 1.1)], dvfn='./output')
+    """
     # Create the output directory if not existed
-    if not os.path.exists(dvfn):
-        os.system(f'mkdir -p {dvfn}')
-    # Read the observed pairs 
-    
-    d     = Table.read(repeatdir)
+    os.makedirs(dvfn, exist_ok=True)
+    dv, z0, z1 = _repeat_pairs(tracer)
+    logdv      = np.log10(abs(dv))
     # Set parameters for the selection and calculation process
     catasmin, catasmax, catasbin = -3, 6, 0.2
-    goodkey = f"GOOD_{tracer[:3]}"
     if tracer == "QSO":
         catasmin = -2
-    # Redrock redshift selections:
-    if tracer != 'QSO':
-        # efftime_spec calculation for selections
-        snr2time = d.meta["{}SNR2T".format(effkey.split("_")[1])]
-        efftime0s = snr2time * d["{}_0".format(effkey)]
-        efftime1s = snr2time * d["{}_1".format(effkey)]
-        # zmtl_zwarn_mask nodata + bad selections
-        nodata0 = (d["ZMTL_ZWARN_0"] & zmtl_zwarn_mask["NODATA"]) > 0
-        nodata1 = (d["ZMTL_ZWARN_1"] & zmtl_zwarn_mask["NODATA"]) > 0
-        badqa0 = (d["ZMTL_ZWARN_0"] & zmtl_zwarn_mask.mask("BAD_SPECQA|BAD_PETALQA")) > 0
-        badqa1 = (d["ZMTL_ZWARN_1"] & zmtl_zwarn_mask.mask("BAD_SPECQA|BAD_PETALQA")) > 0
-        # Apply the selection criteria to clean the data
-        sel = (d[mask_key] & mask[tracer]) > 0
-        sel &= (d["COADD_FIBERSTATUS_0"] == 0) & (d["COADD_FIBERSTATUS_1"] == 0)
-        sel &= (~nodata0) & (~nodata1)
-        sel &= (~badqa0) & (~badqa1)
-        sel &= (efftime0s > effmin) & (efftime1s > effmin)
-        sel &= (efftime0s < effmax) & (efftime1s < effmax)
-        sel &= (d["{}_0".format(goodkey)]) & (d["{}_1".format(goodkey)])
-        sel &= (d['SURVEY_0']=='main')&(d['SURVEY_1']=='main')
-        if tracer[:3] == 'ELG':
-            sel &= (~d["GOOD_QSO_0"]) & (~d["GOOD_QSO_1"])
-    else:
-        qsofn    = repeatdir[:-5]+'_QSO'+repeatdir[-5:]
-        d        = Table(fitsio.read(qsofn))
-        d        = d[~np.isnan(d['DV'])]
-        sel      = np.full(len(d),True)
-        
-    # cut on redshift range 
-    selz = ((zmin<d["Z_0"])&(d["Z_0"]<zmax))|((zmin<d["Z_1"])&(d["Z_1"]<zmax))
-    dv_final = np.log10(abs(d['DV'][sel&selz]))  
-    
-    # provide the Delta_velocity distributions
-    dens,bins = np.histogram(dv_final,bins=np.arange(catasmin,catasmax,catasbin),density=True)
-    ## keep none-zero elements
-    sel_clean = dens>0
-    vmid      = (bins[1:]+bins[:-1])/2
-    vmid      = vmid[sel_clean]
-    ## save the observed PDF and CDF
-    cdffn_data= f'{dvfn}/{tracer[:3]}_z{zmin:.1f}-{zmax:.1f}_CDF'
-    if not os.path.exists(cdffn_data+'.npz'):       
-        vbin_fine = 0.005
-        dens_fine,bins_fine=np.histogram(dv_final,bins=np.arange(catasmin,catasmax,vbin_fine),density=True)
-        cdf_data     = np.cumsum(dens_fine) * vbin_fine 
-        np.savez(cdffn_data, vbin=(bins_fine[1:]+bins_fine[:-1])/2, pdf=dens_fine, cdf=cdf_data)
-                    
-    # interpolation for the observed Delta_v distribution
-    vnewbin = 0.005
-    vnew    = np.arange(vmid[0]-catasbin/2,vmid[-1]+catasbin/2+0.01,vnewbin)
-    vnewmid = (vnew[1:]+vnew[:-1])/2
-    kernel  = 0.3
-    ## compute the modelled PDF and CDF and save them
-    cdffn= f'{dvfn}/{tracer[:3]}_z{zmin:.1f}-{zmax:.1f}_kernel{kernel}_CDF'
-    if not os.path.exists(cdffn+'.npz'):       
-        interp  = gaussian_kde(dv_final, bw_method=kernel)
-        pdf     = interp(vnewmid)
-        cdf     = np.cumsum(pdf) * vnewbin  
-        np.savez(cdffn, vbin=vnewmid, pdf=pdf, cdf=cdf)
+    for zmin, zmax in zbins:
+        # cut on redshift range 
+        selz = ((zmin<z0)&(z0<zmax))|((zmin<z1)&(z1<zmax))
+        dv_final = logdv[selz]
+        # provide the Delta_velocity distributions
+        dens,bins = np.histogram(dv_final,bins=np.arange(catasmin,catasmax,catasbin),density=True)
+        ## keep none-zero elements
+        sel_clean = dens>0
+        vmid      = (bins[1:]+bins[:-1])/2
+        vmid      = vmid[sel_clean]
+        ## save the observed PDF and CDF
+        cdffn_data= f'{dvfn}/{tracer[:3]}_z{zmin:.1f}-{zmax:.1f}_CDF'
+        if not os.path.exists(cdffn_data+'.npz'):       
+            vbin_fine = 0.005
+            dens_fine,bins_fine=np.histogram(dv_final,bins=np.arange(catasmin,catasmax,vbin_fine),density=True)
+            cdf_data     = np.cumsum(dens_fine) * vbin_fine 
+            np.savez(cdffn_data, vbin=(bins_fine[1:]+bins_fine[:-1])/2, pdf=dens_fine, cdf=cdf_data)
+            print(f"[write] -> {cdffn_data}.npz ({len(dv_final)} pairs)")
+        # interpolation for the observed Delta_v distribution
+        vnewbin = 0.005
+        vnew    = np.arange(vmid[0]-catasbin/2,vmid[-1]+catasbin/2+0.01,vnewbin)
+        vnewmid = (vnew[1:]+vnew[:-1])/2
+        kernel  = 0.3
+        ## compute the modelled PDF and CDF and save them
+        cdffn= f'{dvfn}/{tracer[:3]}_z{zmin:.1f}-{zmax:.1f}_kernel{kernel}_CDF'
+        if not os.path.exists(cdffn+'.npz'):       
+            pdf     = binned_kde(dv_final, vnewmid, bw_method=kernel)
+            cdf     = np.cumsum(pdf) * vnewbin  
+            np.savez(cdffn, vbin=vnewmid, pdf=pdf, cdf=cdf)
+            print(f"[write] -> {cdffn}.npz")
     return 0
     
 def vsmear_modelling_slitless_internal(zmin,zmax,dvfn='./',desired_catas=0.05):
@@ -168,6 +213,7 @@ def vsmear_modelling_slitless_internal(zmin,zmax,dvfn='./',desired_catas=0.05):
     vsmear_modelling_slitless_internal(0.9, 1.2, dvfn='./output')
     """
 
+    from astropy.table import Table
     from desitarget.targetmask import desi_mask, bgs_mask
     from desitarget.targetmask import zwarn_mask as zmtl_zwarn_mask
 
@@ -255,7 +301,90 @@ def vsmear_modelling_slitless_internal(zmin,zmax,dvfn='./',desired_catas=0.05):
         """
     return
 
-def vsmear(tracer,zmin,zmax,Ngal,dvmode='obs',seed=42,verbose=False):
+class VsmearSampler:
+    """
+    Sampler of the signed redshift errors Delta_v for one CDF file of log10|Delta_v|.
+
+    The CDF is loaded once and inverted with the cubic interpolation of the former `vsmear` on a
+    dense uniform grid of the CDF; draws are then a linear interpolation in this table. The table
+    is refined until at most a fraction `eps` of the draws deviate by more than `tol` (in log10
+    km/s) from the cubic inverse, measured halfway between the nodes. The remaining ones fall on
+    the steep steps of the CDF (e.g. at its ends), and stay between the same two nodes as with
+    the cubic inverse, so the CDF of the draws differs from it by at most 1/nbins anyway.
+    `max_error` and `frac_above_tol` keep the achieved bounds.
+
+    Example usage:
+    --------------
+    sampler = VsmearSampler.from_tracer('LRG', 0.4, 0.6, dvmode='obs')
+    dv = sampler.draw(100000, rng=np.random.default_rng(42))
+    """
+    def __init__(self, fn_cdf, tol=1e-3, eps=1e-4, nmin=2**12, nmax=2**22):
+        data     = np.load(fn_cdf)
+        ## Remove duplicate values in the CDF
+        cdf, ind = np.unique(data["cdf"], return_index=True)
+        x_grid   = data["vbin"][ind]
+        inv_cdf  = interp1d(cdf/cdf[-1], x_grid, bounds_error=False, fill_value=(x_grid[0], x_grid[-1]), kind='cubic')
+        n = nmin
+        while True:
+            u     = np.linspace(0., 1., n + 1)
+            table = inv_cdf(u)
+            umid  = (u[1:] + u[:-1]) / 2
+            error = np.abs(inv_cdf(umid) - (table[1:] + table[:-1]) / 2)
+            self.max_error      = float(error.max())
+            self.frac_above_tol = float(np.mean(error > tol))
+            if self.frac_above_tol <= eps or n >= nmax:
+                break
+            n *= 2
+        self.fn_cdf = fn_cdf
+        self.nbins  = n
+        # log10 -> ln, so that draws use exp rather than the slower power
+        self.table  = table * np.log(10.)
+        self.slope  = np.append(np.diff(self.table), 0.)
+
+    @classmethod
+    def from_tracer(cls, tracer, zmin, zmax, dvmode='obs', cdf_dir=REPEAT_DIR, **kwargs):
+        'Sampler of the CDF file prepared by vsmear_modelling for this tracer, redshift bin and dvmode.'
+        if tracer[:3] not in ['BGS', 'LRG', 'ELG', 'QSO']:
+            raise ValueError(f"Invalid tracer: {tracer[:3]}. Must be one of ['BGS', 'LRG', 'ELG', 'QSO'].")
+        tracer_key = tracer[:3] if tracer.find('slitless') == -1 else tracer
+        if dvmode == 'obs':
+            fn_cdf = f'{cdf_dir}/{tracer_key}_z{zmin:.1f}-{zmax:.1f}_CDF.npz'
+        elif dvmode == 'model':
+            fn_cdf = f'{cdf_dir}/{tracer_key}_z{zmin:.1f}-{zmax:.1f}_kernel0.3_CDF.npz'
+        else:
+            raise ValueError(f"Invalid dvmode: {dvmode}. Must be 'obs' or 'model'.")
+        if not os.path.exists(fn_cdf):
+            raise ValueError(f"No prepared file: {fn_cdf}. \
+        Please use function Y3_redshift_systematics.vsmear_modelling to prepare them!")
+        return cls(fn_cdf, **kwargs)
+
+    def draw(self, Ngal, rng=None, out=None, chunk=2**20):
+        """
+        Signed Delta_v (km/s) for Ngal galaxies, positive and negative with equal probability.
+        One uniform number per galaxy gives both the sign and the quantile; the result is
+        written in place into `out` (float64, allocated if None), chunk by chunk.
+        """
+        rng = np.random.default_rng(rng)
+        if out is None:
+            out = np.empty(Ngal, dtype='f8')
+        n = self.nbins
+        for i in range(0, Ngal, chunk):
+            o = out[i:i + chunk]
+            rng.random(out=o)
+            neg = o >= 0.5
+            o *= 2 * n
+            o[neg] -= n
+            idx = o.astype(np.intp)
+            o -= idx
+            o *= self.slope[idx]
+            o += self.table[idx]
+            np.exp(o, out=o)
+            o[neg] *= -1.
+        return out
+
+_samplers = {}
+
+def vsmear(tracer,zmin,zmax,Ngal,dvmode='obs',seed=42,verbose=False,rng=None):
     """
     vsmear function:
 
@@ -281,6 +410,12 @@ def vsmear(tracer,zmin,zmax,Ngal,dvmode='obs',seed=42,verbose=False):
 
     - dvmode : str, optional (default 'model')
         The mode for selecting the velocity dispersion distribution. Options are 'obs' (observational) and 'model' (theoretical model).
+
+    - seed : int, optional (default 42)
+        Seed of the numpy Generator used for the draws, if `rng` is not given. The global numpy random state is not touched.
+
+    - rng : numpy.random.Generator, optional
+        Stream to draw from, e.g. one per mock.
     Returns:
     --------
     - dv : numpy.ndarray
@@ -290,42 +425,11 @@ def vsmear(tracer,zmin,zmax,Ngal,dvmode='obs',seed=42,verbose=False):
     --------------
     dv = vsmear('LRG', 0.4, 0.6, Ngal=100000, dvmode='obs')
     """
-    np.random.seed(seed)
-    if tracer[:3] not in ['BGS', 'LRG', 'ELG', 'QSO']:
-        raise ValueError(f"Invalid tracer: {tracer[:3]}. Must be one of ['BGS', 'LRG', 'ELG', 'QSO'].")
-    # Define redshift ranges in LSS mode and in fine-binning mode
-    #repeatdir = '/global/homes/j/jiaxi/DESI_spectroscopic_systematics/Y3'
-    repeatdir = '/global/cfs/projectdirs/desi/users/jiaxiyu/repeated_observations/EDR_vs_Y3/LSS-scripts_repeats'
-    # Extract tracer key and range info 
-    if tracer.find('slitless') == -1:
-        tracer_key = tracer[:3]
-    else:
-        tracer_key = tracer+''
-    # check if the CDF exists
-    if   dvmode == 'obs':
-        fn_cdf = f'{repeatdir}/{tracer_key}_z{zmin:.1f}-{zmax:.1f}_CDF.npz'
-    elif dvmode == 'model':
-        fn_cdf = f'{repeatdir}/{tracer_key}_z{zmin:.1f}-{zmax:.1f}_kernel0.3_CDF.npz'  
+    # one sampler per CDF file, with its inverse-CDF table, for the whole process
+    key = (tracer if tracer.find('slitless') != -1 else tracer[:3], round(zmin, 1), round(zmax, 1), dvmode)
+    if key not in _samplers:
+        _samplers[key] = VsmearSampler.from_tracer(tracer, zmin, zmax, dvmode=dvmode)
+    sampler = _samplers[key]
     if verbose:
-        print(f'load {fn_cdf} to add redshift uncertainties and catastrophics')
-    if not os.path.exists(fn_cdf):
-        raise ValueError(f"No prepared file: {fn_cdf}. \
-        Please use function Y3_redshift_systematics.vsmear_modelling to prepare them!")
-    # print(fn_cdf)
-    # Load the saved data
-    data     = np.load(fn_cdf)
-    xgrid_raw= data["vbin"]
-    cdf_raw  = data["cdf"]
-    # inverse the CDF with interpolation 
-    ## Remove duplicate values in the CDF
-    cdf, ind = np.unique(cdf_raw, return_index=True)
-    x_grid   = xgrid_raw[ind]
-    inv_cdf = interp1d(cdf/cdf[-1], x_grid, bounds_error=False, fill_value=(x_grid[0], x_grid[-1]), kind='cubic')
-    # Generate the exponents of Delta_v using the inverse CDF
-    random_uniform_samples = np.random.uniform(0, 1, int(Ngal/2))  # Uniform samples [0, 1]
-    exponent = inv_cdf(random_uniform_samples)  # Transform to match the redshift error distributions
-    dv       = np.append(10**exponent,-10**exponent) # get the actual Delta_v
-    np.random.shuffle(dv) # shuffle dv to get random positive and negative dv
-    if Ngal%2 ==1:
-        dv = np.append(np.zeros(1),dv)
-    return dv
+        print(f'load {sampler.fn_cdf} to add redshift uncertainties and catastrophics')
+    return sampler.draw(int(Ngal), rng=np.random.default_rng(seed) if rng is None else rng)
@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Benchmark VsmearSampler against the former interp1d-based vsmear on one CDF file.
+
+Reports the table size and its error bound, the time of the draws for each size, and the
+Kolmogorov-Smirnov distance of log10|dv| between the two implementations. Without --cdf, a
+synthetic CDF (a Gaussian core and a catastrophic tail, on the 0.005 grid of vsmear_modelling)
+is used.
+
+Usage
+-----
+$ python bench_vsmear.py [--cdf ../data/dv_draws/LRG_z0.4-0.6_CDF.npz] [--ngal 1e6 1e7 1e8]
+"""
+import os, time, argparse, tempfile
+import numpy as np
+from scipy.stats import ks_2samp
+from scipy.interpolate import interp1d
+from Y3_redshift_systematics import VsmearSampler
+
+def legacy_vsmear(fn_cdf, Ngal, seed=42):
+    'The former vsmear, for the comparison.'
+    np.random.seed(seed)
+    data     = np.load(fn_cdf)
+    cdf, ind = np.unique(data["cdf"], return_index=True)
+    x_grid   = data["vbin"][ind]
+    inv_cdf = interp1d(cdf/cdf[-1], x_grid, bounds_error=False, fill_value=(x_grid[0], x_grid[-1]), kind='cubic')
+    exponent = inv_cdf(np.random.uniform(0, 1, int(Ngal/2)))
+    dv       = np.append(10**exponent,-10**exponent)
+    np.random.shuffle(dv)
+    if Ngal%2 ==1:
+        dv = np.append(np.zeros(1),dv)
+    return dv
+
+def synthetic_cdf(fn):
+    vbin = np.arange(-3, 6, 0.005)[:-1] + 0.0025
+    pdf  = 0.99 * np.exp(-0.5 * ((vbin - 1.5) / 0.3)**2) / (0.3 * np.sqrt(2 * np.pi))
+    pdf += 0.01 * np.exp(-0.5 * ((vbin - 4.) / 0.5)**2) / (0.5 * np.sqrt(2 * np.pi))
+    pdf[(vbin < 0.) | (vbin > 5.5)] = 0.
+    np.savez(fn, vbin=vbin, pdf=pdf, cdf=np.cumsum(pdf) * 0.005)
+    return fn
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--cdf', type=str, default=None, help='CDF .npz written by vsmear_modelling')
+    parser.add_argument('--ngal', type=float, nargs='+', default=[1e6, 1e7, 1e8], help='numbers of draws')
+    parser.add_argument('--nlegacy', type=float, default=1e7, help='largest number of draws for the former vsmear')
+    args = parser.parse_args()
+    fn_cdf = args.cdf or synthetic_cdf(os.path.join(tempfile.mkdtemp(), 'synthetic_CDF.npz'))
+
+    t0 = time.time()
+    sampler = VsmearSampler(fn_cdf)
+    print(f"[bench] {fn_cdf}: table of {sampler.nbins} bins built in {time.time() - t0:.2f}s, "
+          f"{sampler.frac_above_tol:.1e} of the draws beyond 1e-3 dex of the cubic inverse (max {sampler.max_error:.2f} dex)")
+    rng = np.random.default_rng(42)
+    for ngal in map(int, args.ngal):
+        t0 = time.time()
+        dv = sampler.draw(ngal, rng=rng)
+        t_new = time.time() - t0
+        line = f"[bench] N={ngal:.0e}: sampler {t_new:.2f}s ({ngal / t_new / 1e6:.0f} M/s)"
+        if ngal <= args.nlegacy:
+            t0 = time.time()
+            dv_old = legacy_vsmear(fn_cdf, ngal)
+            t_old = time.time() - t0
+            nks = min(ngal, 10**6)
+            ks = ks_2samp(np.log10(np.abs(dv[:nks])), np.log10(np.abs(dv_old[dv_old != 0][:nks]))).statistic
+            line += f", former {t_old:.2f}s (x{t_old / t_new:.1f}), KS {ks:.4f}, fraction dv>0 {np.mean(dv > 0):.4f}"
+        print(line, flush=True)
+        del dv
+
+if __name__ == "__main__":
+    main()
@@ -17,9 +17,13 @@ from io_def import (
     path_to_HODchain,
     path_to_mocks,
     write_catalogs,
+    atomic_write,
     path_to_catalog,
     path_to_clustering,
     path_to_poles,
+    path_to_poles_store,
+    path_to_sample_params,
+    path_to_pscov,
     path_to_hip,
 )    
 
@@ -264,10 +268,12 @@ class HIPanOBSample:
         chain_root: str | None = None,
         num: int = 100, 
         plot: bool = False,
-        cmap: str = 'hsv'
+        cmap: str = 'hsv',
+        seed: int = 42,
     ) -> np.ndarray:
         """
         Sampling the posterior of the HOD fitting, return the sampled parameter-sets.
+        seed: of the draw, so that a rerun gives the same parameter-sets (and resumes the same mocks).
         """
         if chain_root is None:
             chain_path=self.HODfit['path2chain']
@@ -275,7 +281,7 @@ class HIPanOBSample:
             chain_root = Path(chain_path) / chain_prefix
         ew_sample = np.loadtxt(f"{chain_root}post_equal_weights.dat") # Contains the equally weighted posterior samples. Columns have parameter values followed by loglike value.
         if ew_sample.shape[0] >= num:
-            random_indices = np.random.choice(ew_sample.shape[0], size=num, replace=False)
+            random_indices = np.random.default_rng(seed).choice(ew_sample.shape[0], size=num, replace=False)
             samples = ew_sample[random_indices][:,:-1]  # exclude the last column (weight)
             print(f"sampled {num} HOD parameter-sets from {ew_sample.shape[0]} equal-weighted samples.")
         else:
@@ -284,6 +290,7 @@ class HIPanOBSample:
         self.HIP = {
             'chain_root': str(chain_root),
             'num_samples': num,
+            'seed': seed,
             'cmap': cmap,
         }
         self.cfg['HIP'] = self.HIP
@@ -318,10 +325,33 @@ class HIPanOBSample:
         write_cat: bool = False,
         want_2PCF: bool = False,
         want_poles: bool = True,
+        want_pscov: bool = False,
+        mpicomm=None,
+        resume: bool = True,
     ) -> None:   
+        """
+        Generate the AbacusHOD mock of each HOD parameter-set in params_list, and save the catalog,
+        the 2PCF and/or the pypower poles.
+
+        want_pscov: hand the galaxy positions in memory to pypower and thecov, and save the reduced
+            power spectrum with its covariance (io_def.path_to_pscov), as read by fit_p_from_mocks.
+            The poles are then saved as well (path_to_poles and the packed store), as with
+            want_poles. With want_pscov, write_cat is only needed to keep the catalogs.
+
+        mpicomm: MPI communicator. If given, every rank loads the subsample once and processes the
+            samples i with i % size == rank; params_list is broadcast from rank 0.
+        resume: skip the samples whose requested outputs all exist already and were made with the
+            same parameter vector (saved by io_def.path_to_sample_params once all the outputs of a
+            sample are written); samples with other parameters are redone. The outputs are written
+            atomically, so an existing file is always complete.
+        """
         from abacus_helper import AbacusHOD, assign_hod, reset_fic, get_enabled_tracers, compute_mock_and_multipole
         if want_poles:
             from pypower_helpers import run_pypower_redshift
+        if want_pscov:
+            from thecov_helper import power_spectrum_and_cov, save_pscov
+        if want_poles or want_pscov:
+            from poles_store_helper import PolesStore
         if self.cfgHOD is None:
             cfgHOD = load_config(self.HODfit['path2cfgHOD'])
         else:
@@ -331,32 +361,99 @@ class HIPanOBSample:
         clustering_params = cfgHOD['clustering_params']
         fit_params = cfgHOD['fit_params']
         mock_dir = self.HODfit['path2mock']
+        tracers = get_enabled_tracers(HOD_params)
+
+        ### shard the samples over the ranks
+        rank, size, comm_self = 0, 1, None
+        if mpicomm is not None:
+            from mpi4py import MPI
+            params_list = mpicomm.bcast(params_list, root=0)
+            rank, size, comm_self = mpicomm.rank, mpicomm.size, MPI.COMM_SELF
+        indices = range(rank, len(params_list), size)
+
+        def outputs(i):
+            paths = []
+            if write_cat:
+                cat_params = {'output_dir': mock_dir, 'sim_name': sim_params['sim_name'], 'z_mock': sim_params['z_mock']}
+                paths += [path_to_catalog(sim_params=cat_params, tracer=tracer, prefix=f'r{i}') for tracer in tracers]
+            if want_2PCF:
+                paths += [path_to_clustering(sim_params=sim_params, tracer=tracer, prefix=f'r{i}') for tracer in tracers]
+            if want_poles or want_pscov:
+                paths.append(path_to_poles(sim_params=sim_params, tracer=tracers[0], prefix=f'r{i}'))
+            if want_pscov:
+                paths.append(path_to_pscov(sim_params=sim_params, tracer=tracers[0], prefix=f'r{i}'))
+            return paths
+
+        def path2params(i):
+            return path_to_sample_params(sim_params=sim_params, tracer=tracers[0], prefix=f'r{i}')
+
+        def same_params(i):
+            path = path2params(i)
+            if not os.path.exists(path):
+                return False
+            saved = np.load(path)
+            return saved.shape == np.shape(params_list[i]) and np.allclose(saved, params_list[i], rtol=0., atol=1e-12)
+
+        if resume:
+            existing = [i for i in indices if all(os.path.exists(p) for p in outputs(i))]
+            done = [i for i in existing if same_params(i)]
+            if done:
+                print(f"[resume] rank {rank}: skip {len(done)} sample(s) with existing outputs: {done}")
+            changed = [i for i in existing if i not in done]
+            if changed:
+                print(f"[resume] rank {rank}: redo {len(changed)} sample(s) whose outputs were made with other parameters: {changed}")
+            indices = [i for i in indices if i not in done]
+        if len(indices) == 0:
+            print(f"[sample] rank {rank}: nothing to do.")
+            if mpicomm is not None:
+                mpicomm.Barrier()
+            return
+
         ### generate AbacusHOD mocks for each sample
         Ball = AbacusHOD(sim_params, HOD_params, clustering_params)
-
-        tracers = get_enabled_tracers(HOD_params)
-        tracer = tracers[0]
-        for i, sample in enumerate(params_list):
+        for i in indices:
+            sample = params_list[i]
             assign_hod(Ball, fit_params, sample)
             reset_fic(Ball, tracers, nthread=nthread)
             mock, clustering_rsd  = compute_mock_and_multipole(Ball, nthread=nthread)
             if write_cat:
                 ## save mock h5
-                write_catalogs(Ball, mock, fit_params,out_root=mock_dir, prefix=f'r{i}')
+                write_catalogs(Ball, mock, fit_params,out_root=mock_dir, prefix=f'r{i}', mpicomm=comm_self)
             for tracer, cat in mock.items():
                 if want_2PCF:
                     ## save clustering ASCII
                     path2cluster = path_to_clustering(sim_params=sim_params, tracer=tracer, prefix=f'r{i}')
-                    np.save(path2cluster, clustering_rsd[f'{tracer}_{tracer}'])
+                    with atomic_write(path2cluster) as tmp:
+                        np.save(tmp, clustering_rsd[f'{tracer}_{tracer}'])
                     print(f"[write] clustering for sample {i} to {path2cluster}")
-                if want_poles:
+                if want_pscov:
+                    ## positions stay in memory: FFT power spectrum -> thecov covariance
+                    boxV = Ball.params['Lbox']**3
+                    poles, data, nbar, cov = power_spectrum_and_cov(cat['x'], cat['y'], cat['z'], boxV=boxV, mpicomm=comm_self)
+                    path2pscov = path_to_pscov(sim_params=sim_params, tracer=tracers[0], prefix=f'r{i}')
+                    with atomic_write(path2pscov) as tmp:
+                        save_pscov(tmp, data, nbar, cov)
+                    print(f"[write] power spectrum and thecov covariance for sample {i} to {path2pscov}")
+                elif want_poles:
                     x = cat['x']
                     y = cat['y']
                     z = cat['z']
-                    poles = run_pypower_redshift(x,y,z)
+                    if comm_self is None:
+                        poles = run_pypower_redshift(x,y,z)
+                    else:
+                        poles = run_pypower_redshift(x,y,z, mpicomm=comm_self)
+                if want_poles or want_pscov:
                     path2poles = path_to_poles(sim_params=sim_params, tracer=tracers[0], prefix=f'r{i}')
-                    poles.save(path2poles)
+                    with atomic_write(path2poles) as tmp:
+                        poles.save(tmp)
                     print(f"[write] pypower poles for sample {i} to {path2poles}")
+                    ## all samples in one packed store, appended under a file lock by the ranks
+                    PolesStore(path_to_poles_store(sim_params=sim_params, tracer=tracers[0])).append(i, poles, ells=(0, 2))
+            ## last: the outputs of sample i are complete and belong to these parameters
+            with atomic_write(path2params(i)) as tmp:
+                np.save(tmp, np.asarray(sample, dtype=np.float64))
+        if mpicomm is not None:
+            mpicomm.Barrier()
     
     
     def sample_HOD_measure_ps(
@@ -470,19 +567,24 @@ class HIPanOBSample:
         klim: dict[int, list[float]] = {0: [0.003, 0.1]},
         nproc: int = 64,
         write_csv: bool = True,
+        want_T0: bool = False,
     ) -> pd.DataFrame:
         """
         Fit p from the HOD mocks, return the best-fit parameters for each mock.
         
         priors: dict of prior settings for each parameter, e.g., {'p': {'limits': (-1., 3.)}, 'sigmas': {'limits': (0., 20.)}}
         fnl: fixed fnl value to the simulation value
+        want_T0: add the trispectrum (T0) covariance to the Gaussian one of each mock, with b1 measured
+            from the mock P0 (as in mock_bias.txt); the T0 term is cached on a grid of b1, see box_cov_helper.t0_box_cov.
         """
-        from desilike_helper import fit_p_from_mock_thecov
+        from desilike_helper import load_mock_pscov, save_mocks_pscov, share_arrays, init_fit_worker, fit_p_from_shared
         
         boxL = 2000.0  # Mpc/h
         boxV = boxL**3  # (Mpc/h)^3
         zsnap = self.OBSample['zsnap']
         num = self.HIP['num_samples']
+        sim_params = self.cfgHOD['sim_params']
+        tracer = self.OBSample['tracer']
         # if cosmology == 'DESI':
         #     cosmo = cosmoprimo.fiducial.DESI()
         # else:
@@ -496,15 +598,50 @@ class HIPanOBSample:
         }
         # klin, plin_z = linear_matter_power_spectrum(zeff=zsnap)
         
-        ## loop over mocks
+        ## phase 1: power spectrum + covariance of each mock (read from pscov, or measured once and saved)
+        inputs = [None] * num
+        missing = [i for i in range(num) if not os.path.exists(path_to_pscov(sim_params=sim_params, tracer=tracer, prefix=f'r{i}'))]
+        for i in set(range(num)) - set(missing):
+            inputs[i] = load_mock_pscov(i, boxV, sim_params=sim_params, tracer=tracer)
+        if missing:
+            with ProcessPoolExecutor(max_workers=min(nproc, len(missing))) as executor:
+                futures = {executor.submit(load_mock_pscov, i, boxV, sim_params, tracer, False): i for i in missing}
+                measured = {futures[future]: future.result() for future in as_completed(futures)}
+            # covariances of all the measured mocks at once
+            for i, res in save_mocks_pscov(measured, boxV, sim_params=sim_params, tracer=tracer).items():
+                inputs[i] = res
+        nk = np.array([len(data['k']) for data, _, _ in inputs])
+        nkmax = nk.max()
+        arrays = {'nk': nk, 'k': np.zeros((num, nkmax)), 'P_0': np.zeros((num, nkmax)), 'cov': np.zeros((num, nkmax, nkmax))}
+        for i, (data, _, cov) in enumerate(inputs):
+            arrays['k'][i, :nk[i]] = data['k']
+            arrays['P_0'][i, :nk[i]] = data['P_0']
+            arrays['cov'][i, :nk[i], :nk[i]] = cov
+        if want_T0:
+            import cosmoprimo
+            from thecov_helper import linear_bias, data_kedges
+            from box_cov_helper import t0_box_cov
+            if cosmology != 'DESI':
+                raise NotImplementedError(f"cosmology {cosmology} not implemented.")
+            cosmo = cosmoprimo.fiducial.DESI()
+            klin = np.logspace(-4, 0, 1000)
+            plin_z = cosmo.get_fourier().pk_kz(klin, zsnap)
+            for i, (data, _, _) in enumerate(inputs):
+                b1 = linear_bias(data, klin, plin_z)
+                arrays['cov'][i, :nk[i], :nk[i]] += t0_box_cov(data_kedges(data), zsnap, b1, cosmo, volume=boxV, ells=(0,))
+        
+        ## phase 2: Minuit fits; the template is built once per worker, inputs are read from shared memory
+        spec, blocks = share_arrays(arrays)
         results = []
-        with ProcessPoolExecutor(max_workers=min(nproc, num)) as executor:
-            futures = {
-                executor.submit(fit_p_from_mock_thecov, i, boxV, theory_dict, klim, self.cfgHOD['sim_params'], self.OBSample['tracer']): i
-                for i in range(num)
-            }
-            for future in as_completed(futures):
-                results.append(future.result())
+        try:
+            with ProcessPoolExecutor(max_workers=min(nproc, num), initializer=init_fit_worker, initargs=(theory_dict, spec)) as executor:
+                futures = {executor.submit(fit_p_from_shared, i, klim): i for i in range(num)}
+                for future in as_completed(futures):
+                    results.append(future.result())
+        finally:
+            for shm in blocks:
+                shm.close()
+                shm.unlink()
         # results = fit_p_from_mock_thecov(0, boxV, theory_dict, klim, self.cfgHOD['sim_params'], self.OBSample['tracer'])  # test single
         # print('results:', results, flush=True)
         ## to DataFrame
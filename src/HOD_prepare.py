@@ -4,13 +4,19 @@ src.HOD_prepare
 Refer to: https://github.com/ahnyu/hod-variation/blob/main/source/loading_helpers.py
 """
 
+import os
+import time
+from functools import lru_cache
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import numpy as np
 from pycorr import TwoPointEstimator
 
 __all__ = [
     "save_data_for_HODfitting",
     "show_zeff",
-    "load_nz"
+    "load_nz",
+    "prepare_HOD_fitting_batch"
     ]
 
 # ======== small scale clusterings ========
@@ -28,17 +34,8 @@ def readxi02(path):
     err=np.sqrt(np.diag(cov))
     return xi, cov, err, allcounts
 
-def get_realizations(allcounts,idx,mode):
-    jk=np.empty((len(idx),len(allcounts.realizations)))
-    for i in allcounts.realizations:
-        jk[:,i]=allcounts.realization(i)[::2].get_corr(mode=mode,return_sep=True)[1].flatten()[idx]
-    return jk
-
-def get_combined_jkcov(allcountswp,allcountsxi,idxwp,idxxi02):
-    jkwp=get_realizations(allcountswp,idxwp,'wp')
-    jkxi02=get_realizations(allcountsxi,idxxi02,'poles')
-    jkall=np.concatenate((jkwp,jkxi02))
-    return (127 * np.cov(jkall,ddof=0))
+# jackknife realizations from the per-region counts with array operations, see jackknife_helper
+from jackknife_helper import get_realizations, get_combined_jkcov
 
 
 def save_data_for_HODfitting(
@@ -52,10 +49,13 @@ def save_data_for_HODfitting(
     idx_max_rp=21,
     idx_min_s=11,
     idx_max_s=21,
+    timings=None,
     ):
     """
     Refer to: https://github.com/ahnyu/hod-variation/blob/main/prep_data_v1.1.ipynb
+    timings: optional dict, filled with the seconds spent in 'read', 'jackknife' and 'write'.
     """
+    t0 = time.time()
     ## rp/s bin midpoints saved to data files
     rpbins=np.geomspace(0.01,100,25)
     print('x bins:', rpbins)
@@ -64,11 +64,13 @@ def save_data_for_HODfitting(
     fname = f"allcounts_{tracer}_GCcomb_{zmin:.1f}_{zmax:.1f}_pip_angular_bitwise_log_njack128_nran4_split20.npy"
     wp = readwp(y3rppidir / fname)
     xi = readxi02(y3smudir / fname)
+    t1 = time.time()
     ## get jackknife covariance
     idx_wp_cut   = np.arange(idx_min_rp, idx_max_rp)  
     idx_xi_cut  = np.arange(idx_min_s, idx_max_s)
     idx_xi02_cut = np.concatenate((idx_xi_cut, idx_xi_cut + 24))  
     cov = get_combined_jkcov(wp[3], xi[3], idx_wp_cut, idx_xi02_cut)
+    t2 = time.time()
     ## save cut data
     path2data = {
         "path2cov": str(outdir/f"cov_{tracer}_{zmin:.1f}_{zmax:.1f}_cut.dat"),
@@ -90,35 +92,16 @@ def save_data_for_HODfitting(
     ## save cov cut
     np.savetxt(path2data["path2cov"], cov)
     print(f"[write] -> {outdir}")
+    if timings is not None:
+        timings.update(read=t1 - t0, jackknife=t2 - t1, write=time.time() - t2)
     return path2data
 
 # ======== effective redshift of the catalog ========
 
 def compute_zeff(*catalog_fns, cosmo=None, zrange=None):
-    import fitsio
-    import numpy as np
-    if cosmo is None:
-        from cosmoprimo.fiducial import DESI
-        cosmo = DESI()
-
-    def read(fn):
-        catalog = fitsio.read(fn)
-        z = catalog['Z']
-        weights = catalog['WEIGHT'] * catalog['WEIGHT_FKP']
-        mask = (z >= zrange[0]) & (z < zrange[1])
-        return z[mask], weights[mask]
-
-    z1, weights1 = [np.concatenate(tmp) for tmp in zip(*[read(fn) for fn in catalog_fns])]
-    zstep = 0.01
-    zbins = np.arange(zrange[0], zrange[1] + zstep / 2., zstep)
-    dbins = cosmo.comoving_radial_distance(zbins)
-    hist1 = np.histogram(z1, weights=weights1, density=False, bins=zbins)[0]
-    zhist1 = np.histogram(z1, weights=z1 * weights1, density=False, bins=zbins)[0]
-    z = zhist1 / hist1
-    z[np.isnan(z)] = 0.
-    dv = dbins[1:]**3 - dbins[:-1]**3
-    # sum(dv * density^2 * z) / sum(dv * density^2), where density = hist1 / dv
-    return np.sum(hist1**2 / dv * z) / np.sum(hist1**2 / dv)
+    ''' zeff of the catalogs in zrange, from the cached columnar z histograms of zhist_helper '''
+    from zhist_helper import compute_zeff as _compute_zeff
+    return _compute_zeff(*catalog_fns, cosmo=cosmo, zrange=zrange)
 
 def show_zeff(tracer, zmin, zmax, catdir):
     ''' measure zeff for a given tracer 
@@ -135,14 +118,105 @@ def show_zeff(tracer, zmin, zmax, catdir):
 def nz_comb(N,S,idx):
     return (np.sum(N[idx,-2])+np.sum(S[idx,-2]))/(np.sum(N[idx,-1])+np.sum(S[idx,-1]))
 
+@lru_cache(maxsize=None)
+def _read_nz(path):
+    return np.loadtxt(path, skiprows=2)
+
 def load_nz(tracer, zmin, zmax, nzdir):
     ''' load n(z) for a given tracer 
     tracer: 'LRG', 'QSO', 'highz-QSO'
     '''
-    ## Read n(z) for NGC and SGC
-    nz_NGC=np.loadtxt(nzdir/f'{tracer}_NGC_nz.txt',skiprows=2)
-    nz_SGC=np.loadtxt(nzdir/f'{tracer}_SGC_nz.txt',skiprows=2)
+    ## Read n(z) for NGC and SGC, once per file
+    nz_NGC=_read_nz(str(nzdir/f'{tracer}_NGC_nz.txt'))
+    nz_SGC=_read_nz(str(nzdir/f'{tracer}_SGC_nz.txt'))
     ## combine NGC and SGC
     z_idx=np.where((nz_NGC[:,0]>=zmin) & (nz_NGC[:,0]<zmax))[0]
     nz_data=nz_comb(nz_NGC,nz_SGC,z_idx)
     return float(nz_data)
+
+# ======== all the bins at once ========
+
+def _prepare_bin(tracer, tag, zmin, zmax, outdir, data_dir):
+    'Worker: clustering files of one bin, returns (tracer, tag, path2data, timings).'
+    timings = {}
+    path2data = save_data_for_HODfitting(outdir=outdir, y3rppidir=data_dir / "rppi", y3smudir=data_dir / "smu",
+                                         tracer=tracer, zmin=zmin, zmax=zmax, timings=timings)
+    return tracer, tag, path2data, timings
+
+def _prepare_tracer(tracer, bins, cat_dir, nz_dir):
+    """
+    Worker: zeff and nbar of all the bins of a tracer. In one process, each catalog is scanned
+    once into its z histogram (see zhist_helper) and each n(z) table is read once.
+    """
+    t0 = time.time()
+    zeff = {tag: show_zeff(tracer=tracer, zmin=zmin, zmax=zmax, catdir=cat_dir) for tag, (zmin, zmax) in bins.items()}
+    t1 = time.time()
+    nbar = {tag: load_nz(tracer=tracer, zmin=zmin, zmax=zmax, nzdir=nz_dir) for tag, (zmin, zmax) in bins.items()}
+    return tracer, zeff, nbar, {'zeff': t1 - t0, 'nz': time.time() - t1}
+
+def _bin_data_dir(data_dir, tracer, tag):
+    if isinstance(data_dir, dict):
+        return Path(data_dir.get(f"{tracer}_{tag}", data_dir.get(tracer)))
+    return Path(data_dir)
+
+def prepare_HOD_fitting_batch(
+    zbins,
+    outdir,
+    data_dir,
+    cat_dir,
+    nz_dir=None,
+    nproc=None,
+    manifest='manifest.yaml',
+    ):
+    """
+    Prepare the data for HOD fitting of all the bins of zbins ({tracer: {tag: (zmin, zmax)}},
+    e.g. io_def.ZBINS_DR2) on a process pool: one task per bin for the wp, xi02 and jackknife
+    covariance files, one task per tracer for zeff and nbar, shared by its bins.
+
+    data_dir: directory with rppi/ and smu/, or dict {tracer or 'tracer_tag': directory}.
+    nz_dir: directory of the n(z) tables, default cat_dir.
+    Writes outdir/manifest with, per bin, the data files, zeff, nbar and the stage timings.
+
+    Returns: the manifest dict.
+    """
+    from io_def import ensure_dir, write_config
+    outdir, cat_dir = Path(outdir), Path(cat_dir)
+    nz_dir = cat_dir if nz_dir is None else Path(nz_dir)
+    ensure_dir(outdir)
+    nbins = sum(len(bins) for bins in zbins.values())
+    nproc = min(nproc or os.cpu_count(), nbins + len(zbins))
+    print(f"[batch] {nbins} bins of {list(zbins)} on {nproc} processes -> {outdir}", flush=True)
+    start = time.time()
+    entries = {tracer: {tag: {'zmin': zmin, 'zmax': zmax, 'data_dir': str(_bin_data_dir(data_dir, tracer, tag))}
+                        for tag, (zmin, zmax) in bins.items()} for tracer, bins in zbins.items()}
+    stages = {}
+    with ProcessPoolExecutor(max_workers=nproc) as executor:
+        ## the tracer tasks first: their catalog scans overlap with the pair count loading
+        futures = {executor.submit(_prepare_tracer, tracer, bins, cat_dir, nz_dir): 'tracer' for tracer, bins in zbins.items()}
+        futures.update({executor.submit(_prepare_bin, tracer, tag, zmin, zmax, outdir, _bin_data_dir(data_dir, tracer, tag)): 'bin'
+                        for tracer, bins in zbins.items() for tag, (zmin, zmax) in bins.items()})
+        for future in as_completed(futures):
+            result = future.result()
+            if futures[future] == 'bin':
+                tracer, tag, path2data, timings = result
+                entries[tracer][tag].update(path2data)
+                entries[tracer][tag]['timings'] = {k: round(v, 2) for k, v in timings.items()}
+                print(f"[batch] {tracer} {tag} done, " + ', '.join(f"{k} {v:.1f}s" for k, v in timings.items()), flush=True)
+            else:
+                tracer, zeff, nbar, timings = result
+                for tag in zeff:
+                    entries[tracer][tag].update(zeff=zeff[tag], nbar=nbar[tag])
+                print(f"[batch] {tracer} zeff and nbar done, " + ', '.join(f"{k} {v:.1f}s" for k, v in timings.items()), flush=True)
+            for k, v in timings.items():
+                stages[k] = stages.get(k, 0.) + v
+    wall = time.time() - start
+    summary = {
+        'outdir': str(outdir),
+        'cat_dir': str(cat_dir),
+        'nz_dir': str(nz_dir),
+        'timings': {'wall': round(wall, 2), **{f"{k}_total": round(v, 2) for k, v in stages.items()}},
+        'bins': entries,
+    }
+    write_config(summary, outdir / manifest)
+    print(f"[time] {nbins} bins in {wall:.1f}s wall, " + ', '.join(f"{k} {v:.1f}s" for k, v in stages.items()), flush=True)
+    return summary
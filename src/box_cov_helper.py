@@ -0,0 +1,182 @@
+"""
+Native Gaussian covariance of power spectrum multipoles in a periodic box.
+
+For a periodic box the Gaussian covariance is diagonal in k and has a closed form in terms
+of the multipoles, the shot noise and the number of modes in each k-bin:
+
+    C_{ll'}(k_i) = 2 (2l+1)(2l'+1) / N_k(i) * int_{-1}^{1} dmu/2 L_l(mu) L_l'(mu) [P(k_i, mu) + 1/nbar]^2,
+    N_k(i) = V (k_{i+1}^3 - k_i^3) / (6 pi^2),
+
+with P(k, mu) = sum_l P_l(k) L_l(mu). The mu integral of this polynomial is exact with a
+Gauss-Legendre rule, so many mocks are handled at once with a few array operations, without
+building thecov geometries. Set FIHOBI_COV_CHECK=1 to cross-check every call against thecov.
+
+The regular trispectrum (T0) term does not depend on the mock, only on the cosmology, zeff,
+b1, the k-bins and the volume: t0_box_cov computes it with thecov on a grid of b1, caches
+each grid point on disk and interpolates linearly in b1 between them.
+"""
+import os
+import json
+import hashlib
+import numpy as np
+from numpy.polynomial import legendre
+
+from io_def import path_to_cov_cache, atomic_write
+
+__all__ = ["nmodes_box", "gaussian_box_cov", "check_against_thecov", "t0_cache_key", "t0_box_cov"]
+
+T0_ELLS = (0, 2)  # multipoles stored in the T0 cache
+
+def nmodes_box(kedges: np.ndarray, volume: float) -> np.ndarray:
+    'Number of Fourier modes in each spherical shell of a box of volume V (continuous limit).'
+    kedges = np.asarray(kedges, dtype=float)
+    return volume * (kedges[1:]**3 - kedges[:-1]**3) / (6 * np.pi**2)
+
+def gaussian_box_cov(
+    poles: dict[int, np.ndarray],
+    nbar: float | np.ndarray,
+    kedges: np.ndarray,
+    volume: float = 2000**3,
+    ells: tuple = (0, 2),
+    has_shotnoise: bool = False,
+    check: bool | None = None,
+) -> np.ndarray:
+    """
+    Gaussian covariance of the multipoles `ells` for one or many mocks.
+
+    poles: {ell: array of shape (Nk,) or (Nmock, Nk)}, the measured (or theory) multipoles;
+        ells missing from the dict (e.g. 4) are taken as zero.
+    nbar: number density, scalar or (Nmock,).
+    kedges: (Nk+1,) bin edges.
+    has_shotnoise: whether poles[0] already includes the shot noise 1/nbar.
+    check: cross-check against thecov (default: $FIHOBI_COV_CHECK).
+
+    Returns: covariance of shape (Nmock, len(ells)*Nk, len(ells)*Nk), ordered as [ell][k],
+        or (len(ells)*Nk, len(ells)*Nk) for 1D inputs.
+    """
+    single = np.ndim(next(iter(poles.values()))) == 1
+    P = {ell: np.atleast_2d(np.asarray(p, dtype=float)) for ell, p in poles.items()}
+    nmock, nk = next(iter(P.values())).shape
+    nbar = np.broadcast_to(np.asarray(nbar, dtype=float), (nmock,))
+    Nk = nmodes_box(kedges, volume)
+    if len(Nk) != nk:
+        raise ValueError(f"{len(Nk)} k-bins from kedges but {nk} in the multipoles.")
+
+    # P(k, mu) + 1/nbar on Gauss-Legendre nodes: exact for the polynomial degrees involved
+    lmax = max(max(ells), max(P))
+    mu, wmu = legendre.leggauss(2 * lmax + max(ells) // 2 + 2)
+    Lmu = {ell: legendre.legval(mu, [0] * ell + [1]) for ell in set(ells) | set(P)}
+    Ptot = sum(P[ell][..., None] * Lmu[ell] for ell in P)  # (Nmock, Nk, Nmu)
+    if not has_shotnoise:
+        Ptot = Ptot + (1. / nbar)[:, None, None]
+    P2w = Ptot**2 * (wmu / 2)
+
+    nell = len(ells)
+    cov = np.zeros((nmock, nell * nk, nell * nk))
+    diag = np.arange(nk)
+    for i, ell1 in enumerate(ells):
+        for j, ell2 in enumerate(ells[i:], start=i):
+            block = 2 * (2 * ell1 + 1) * (2 * ell2 + 1) / Nk * np.sum(P2w * Lmu[ell1] * Lmu[ell2], axis=-1)
+            cov[:, i * nk + diag, j * nk + diag] = block
+            cov[:, j * nk + diag, i * nk + diag] = block
+
+    if check is None:
+        check = os.environ.get('FIHOBI_COV_CHECK', '0') not in ('0', '', 'false', 'False')
+    if check:
+        for imock in range(nmock):
+            check_against_thecov(cov[imock], {ell: P[ell][imock] for ell in P}, nbar[imock], kedges, volume, ells, has_shotnoise)
+    return cov[0] if single else cov
+
+def check_against_thecov(cov, poles, nbar, kedges, volume, ells, has_shotnoise, rtol=1e-4):
+    'Compare one covariance from gaussian_box_cov with thecov.GaussianCovariance; raise if they differ.'
+    geometry, covariance = _import_thecov()
+    geom = geometry.BoxGeometry(volume=volume, nbar=nbar)
+    gaussian = covariance.GaussianCovariance(geom)
+    dk = kedges[1] - kedges[0]
+    gaussian.set_kbins(kedges[0], kedges[-1], dk)
+    for ell, p in poles.items():
+        gaussian.set_galaxy_pk_multipole(p, ell, has_shotnoise=has_shotnoise if ell == 0 else False)
+    gaussian.compute_covariance()
+    nk = len(kedges) - 1
+    for i, ell1 in enumerate(ells):
+        for j, ell2 in enumerate(ells):
+            ref = gaussian.get_ell_cov(ell1, ell2).cov
+            mine = cov[i * nk:(i + 1) * nk, j * nk:(j + 1) * nk]
+            if not np.allclose(mine, ref, rtol=rtol, atol=rtol * np.abs(ref).max()):
+                raise AssertionError(f"Gaussian box covariance ({ell1},{ell2}) differs from thecov: max |diff| = {np.abs(mine - ref).max():.3e}")
+    print(f"[check] Gaussian box covariance agrees with thecov (rtol={rtol}).")
+
+def _import_thecov():
+    import sys
+    sys.path.insert(0, os.path.expanduser('~/lib/thecov'))
+    from thecov import geometry, covariance
+    return geometry, covariance
+
+def _cosmo_signature(cosmo) -> dict:
+    'Scalars identifying a cosmoprimo cosmology in the T0 cache key.'
+    sig = {}
+    for name in ('h', 'omega_b', 'omega_cdm', 'n_s', 'Omega_k', 'N_eff', 'm_ncdm', 'w0_fld', 'wa_fld'):
+        try:
+            sig[name] = np.asarray(cosmo[name], dtype=float).tolist()
+        except Exception:
+            continue
+    sig['sigma8_m'] = float(cosmo.sigma8_m)
+    return sig
+
+def t0_cache_key(cosmo, zeff: float, b1: float, kedges: np.ndarray, volume: float) -> str:
+    'Hash of the cosmology, zeff, the b1 grid point, the k-bins and the volume.'
+    payload = {'cosmo': _cosmo_signature(cosmo), 'zeff': round(float(zeff), 6), 'b1': round(float(b1), 6),
+               'kedges': np.round(np.asarray(kedges, dtype=float), 8).tolist(), 'volume': float(volume), 'ells': T0_ELLS}
+    return hashlib.blake2b(json.dumps(payload, sort_keys=True).encode(), digest_size=20).hexdigest()
+
+def _t0_grid_point(kedges, zeff, b1, cosmo, volume, cache_dir):
+    'T0 covariance of the T0_ELLS at one b1 grid point, read from or written to the cache.'
+    fn = os.path.join(cache_dir, f"t0_{t0_cache_key(cosmo, zeff, b1, kedges, volume)}.npy")
+    if os.path.exists(fn):
+        return np.load(fn)
+    geometry, covariance = _import_thecov()
+    # the regular trispectrum carries no shot noise: nbar does not enter the T0 term
+    geom = geometry.BoxGeometry(volume=volume, nbar=1.)
+    t0 = covariance.RegularTrispectrumCovariance(geom)
+    t0.set_kbins(kedges[0], kedges[-1], kedges[1] - kedges[0])
+    plin = cosmo.get_fourier()
+    t0.set_linear_matter_pk(np.vectorize(lambda k: plin.pk_kz(k, zeff)))
+    t0.set_params(fgrowth=cosmo.growth_rate(zeff), b1=b1)
+    t0.compute_covariance()
+    cov = np.block([[t0.get_ell_cov(ell1, ell2).cov for ell2 in T0_ELLS] for ell1 in T0_ELLS])
+    with atomic_write(fn) as tmp:
+        np.save(tmp, cov)
+    print(f"[cache] T0 covariance (b1={b1:.4f}) -> {fn}")
+    return cov
+
+def t0_box_cov(
+    kedges: np.ndarray,
+    zeff: float,
+    b1: float,
+    cosmo,
+    volume: float = 2000**3,
+    ells: tuple = (0,),
+    db1: float = 0.05,
+    cache_dir: str | None = None,
+) -> np.ndarray:
+    """
+    Regular trispectrum (T0) covariance of the multipoles `ells` in a periodic box.
+
+    The T0 term is computed with thecov at the two grid points b1_lo <= b1 < b1_lo + db1 of a
+    regular grid of step db1 (one file per grid point in cache_dir, io_def.path_to_cov_cache
+    by default) and interpolated linearly in b1, so a set of mocks with scattered biases only
+    costs a few thecov runs.
+
+    Returns: covariance of shape (len(ells)*Nk, len(ells)*Nk), ordered as [ell][k].
+    """
+    kedges = np.asarray(kedges, dtype=float)
+    if cache_dir is None:
+        cache_dir = path_to_cov_cache()
+    lo = np.floor(b1 / db1 + 1e-9) * db1
+    w = (b1 - lo) / db1
+    cov = _t0_grid_point(kedges, zeff, lo, cosmo, volume, cache_dir)
+    if w > 1e-8:
+        cov = (1 - w) * cov + w * _t0_grid_point(kedges, zeff, lo + db1, cosmo, volume, cache_dir)
+    nk = len(kedges) - 1
+    idx = np.concatenate([T0_ELLS.index(ell) * nk + np.arange(nk) for ell in ells])
+    return cov[np.ix_(idx, idx)]
@@ -8,8 +8,10 @@ from desilike.observables.galaxy_clustering import TracerPowerSpectrumMultipoles
 from desilike.likelihoods import ObservablesGaussianLikelihood
 from desilike.profilers import MinuitProfiler
 
-from io_def import path_to_catalog
-from thecov_helper import read_mock, power_spectrum, thecov_box
+from io_def import path_to_catalog, path_to_pscov, atomic_write
+from thecov_helper import read_mock, power_spectrum, thecov_box, load_pscov, save_pscov, data_kedges
+from box_cov_helper import gaussian_box_cov
+from poles_store_helper import PolesStore, find_store
 
 logging.basicConfig(
     level=logging.WARNING,
@@ -20,6 +22,8 @@ logging.basicConfig(
     ]
 )
 
+_WORKER = {}  # per-process state set by init_fit_worker: the theory template and the shared arrays
+
 def load_data(config):
     '''
     Prepare data and covariance for desilike.
@@ -32,13 +36,19 @@ def load_data(config):
     Returns
     -------
     data : pypower.PowerSpectrumMultipoles
-        The power spectrum multipoles of the Abacus mock.
+        The power spectrum multipoles of the Abacus mock
+        (dict with 'k' and 'P_0' for cov_mode 'thecov_box' and 'EZmocks_stream').
     cov : list of pypower.PowerSpectrumMultipoles or paths to such files
-        Covariance matrix estimated from EZmocks.
+        Covariance matrix estimated from EZmocks
+        (array for 'EZmocks_stream': streamed EZmock covariance of P_0 in klim0, divided by the Hartlap factor).
+
+    cov_mode 'EZmocks_stream' is opt-in: it is monopole-only, cut to klim0 before the klim of desilike,
+    and only the Hartlap factor is applied, whereas desilike corrects the covariance of the mocks
+    given with 'EZmocks' itself (Hartlap and Percival factors); the Percival factor is dropped.
     '''
     from pypower import PowerSpectrumMultipoles
 
-    cov_mode = config.get('cov_mode', 'EZmocks')  # 'EZmocks' or 'thecov_box'
+    cov_mode = config.get('cov_mode', 'EZmocks')  # 'EZmocks', 'EZmocks_stream' or 'thecov_box'
     config_input = config['input']
 
     ## load data
@@ -49,6 +59,29 @@ def load_data(config):
         ezmock_poles = config_input['ezmock_poles']  # path to the power spectrum multipoles from EZmocks, used to estimate covariance matrix
         data = PowerSpectrumMultipoles.load(abacus_poles)
         cov = load_EZmocks(ezmock_poles, n_EZmocks=n_EZmocks)
+        store = find_store(ezmock_poles)
+        if store is not None:
+            # P_0 arrays of the packed store: data as arrays too, desilike gets k as for 'thecov_box'
+            k, p0 = data(ell=0, return_k=True, complex=False)
+            if not np.allclose(PolesStore(store).records()['k'][0], k, equal_nan=True):
+                raise ValueError("k arrays of the EZmocks and of the Abacus mock do not match!")
+            mask = np.isfinite(k) & np.isfinite(p0)
+            data = {'k': k[mask], 'P_0': p0[mask]}
+            cov = [p[mask] for p in cov]
+    elif cov_mode == 'EZmocks_stream':
+        from mock_stats_helper import mock_mean_cov
+        abacus_poles = config_input['abacus_poles']
+        n_EZmocks = config.get('n_EZmocks', None)
+        ezmock_poles = config_input['ezmock_poles']
+        klim0 = config.get('klim0', [0.003, 0.1])
+        k, p0 = PowerSpectrumMultipoles.load(abacus_poles)(ell=0, return_k=True, complex=False)
+        mask = np.isfinite(k) & np.isfinite(p0) & (k >= klim0[0]) & (k <= klim0[1])
+        stats = mock_mean_cov(ezmock_poles, ells=(0,), n_mocks=n_EZmocks, mask=mask, nproc=config.get('nproc', 8))
+        if not np.allclose(stats['k'], k, equal_nan=True):
+            raise ValueError("k arrays of the EZmocks and of the Abacus mock do not match!")
+        print(f"Covariance from {stats['nmocks']} EZmocks, Hartlap factor {stats['hartlap']:.4f} (no Percival factor)")
+        data = {'k': k[mask], 'P_0': p0[mask]}
+        cov = stats['cov'] / stats['hartlap']
     elif cov_mode == 'thecov_box':
         boxV = config_input['box_volume']  # volume of the simulation box
         fname = config_input['abacus_catalog']  # path to the catalog of the AbacusHOD mock
@@ -62,8 +95,19 @@ def load_data(config):
     return data, cov
 
 def load_EZmocks(ezmock_poles, n_EZmocks=None):
+    '''
+    EZmocks handed to desilike to estimate the covariance: the pypower files of a directory, the
+    list saved in a single file, or, for a packed store (poles_store_helper), the P_0 arrays (Nk,)
+    of the mocks in order of seed.
+    '''
     ezmock_p = str(ezmock_poles)
-    if os.path.isdir(ezmock_p):
+    store = find_store(ezmock_p)
+    if store is not None:
+        store = PolesStore(store)
+        seeds = sorted(store.index())
+        cov = list(np.array(store.read(seeds=seeds)['poles'][:, store.ells.index(0)]))
+        print(f'Read {len(cov)} EZmocks from the packed store {store.path} ...')
+    elif os.path.isdir(ezmock_p):
         # load all .npy mock pypower.PowerSpectrumMultipoles files in the directory, the list of the file names will be passed to desilike to estimate covariance
         cov = sorted([os.path.join(ezmock_p, f) for f in os.listdir(ezmock_p) if f.lower().endswith(('.npy'))])
         if len(cov) == 0:
@@ -133,12 +177,16 @@ def prepare_theory(
     fix_fNL: bool=True,
     fix_p: bool=False,
     p: float=1.0,
+    template: FixedPowerSpectrumTemplate | None = None,
 ) -> PNGTracerPowerSpectrumMultipoles:
     """
     fnl: fNL value to fix, if fix_fNL is True.
+    template: a FixedPowerSpectrumTemplate at z to reuse (e.g. built once per worker by init_fit_worker);
+        built from z and cosmology if None.
     """
     
-    template = FixedPowerSpectrumTemplate(z=z, fiducial=cosmology)
+    if template is None:
+        template = FixedPowerSpectrumTemplate(z=z, fiducial=cosmology)
     # fnl_loc is degenerate with PNG bias bphi. Parameterization is controlled by "mode".
     # - "b-p": bphi = 2 * 1.686 * (b1 - p), p as a parameter
     # - "bphi": bphi as a parameter
@@ -197,6 +245,60 @@ def bestfit_p_inference(
     # best_p = bestfit_dict['p']
     return bestfit_dict
 
+def load_mock_pscov(
+    i: int,
+    boxV: float,
+    sim_params: dict = None,
+    tracer: str = None,
+    want_cov: bool = True,
+) -> tuple[dict, float, np.ndarray]:
+    """
+    Power spectrum, nbar and Gaussian box covariance of the sampled mock r{i}: read from the pscov file
+    written by sample_HOD_mocks(want_pscov=True), or measured from the catalog and saved there.
+    want_cov=False: for a mock without pscov file, return (data, nbar, None) and save nothing, so that
+        the covariances of many mocks can be computed at once with save_mocks_pscov.
+    """
+    path2pscov = path_to_pscov(sim_params=sim_params, tracer=tracer, prefix=f'r{i}')
+    if os.path.exists(path2pscov):
+        # measured in memory by sample_HOD_mocks(want_pscov=True)
+        return load_pscov(path2pscov)
+    fname = path_to_catalog(sim_params=sim_params, tracer=tracer, prefix=f'r{i}')
+    pos, nbar = read_mock(fname, boxV=boxV)
+    data = power_spectrum(pos)
+    if not want_cov:
+        return data, nbar, None
+    cov = thecov_box(pk_theory=data, nbar=nbar, volume=boxV, has_shotnoise_set=False)
+    with atomic_write(path2pscov) as tmp:
+        save_pscov(tmp, data, nbar, cov)
+    return data, nbar, cov
+
+def save_mocks_pscov(
+    inputs: dict,
+    boxV: float,
+    sim_params: dict = None,
+    tracer: str = None,
+) -> dict:
+    """
+    Gaussian box covariances of many mocks in one vectorised call per k-binning, saved to their pscov files.
+
+    inputs: {i: (data, nbar, None)} as returned by load_mock_pscov(..., want_cov=False).
+    Returns: {i: (data, nbar, cov)}.
+    """
+    groups = {}
+    for i, (data, nbar, _) in inputs.items():
+        groups.setdefault((float(data['kmin']), float(data['dk']), len(data['P_0'])), []).append(i)
+    out = {}
+    for ids in groups.values():
+        datas = [inputs[i][0] for i in ids]
+        nbars = np.array([inputs[i][1] for i in ids])
+        P = {0: np.stack([d['P_0'] for d in datas]), 2: np.stack([d['P_2'] for d in datas])}
+        covs = gaussian_box_cov(P, nbars, data_kedges(datas[0]), volume=boxV, ells=(0,), has_shotnoise=False)
+        for i, data, nbar, cov in zip(ids, datas, nbars, covs):
+            with atomic_write(path_to_pscov(sim_params=sim_params, tracer=tracer, prefix=f'r{i}')) as tmp:
+                save_pscov(tmp, data, nbar, cov)
+            out[i] = (data, float(nbar), cov)
+    return out
+
 def fit_p_from_mock_thecov(
     i: int, 
     boxV: float, 
@@ -210,14 +312,61 @@ def fit_p_from_mock_thecov(
     pid = os.getpid()
     logging.info(f"Mock {i+1} start (PID={pid})")
 
-    fname = path_to_catalog(sim_params=sim_params, tracer=tracer, prefix=f'r{i}')
-
-    pos, nbar = read_mock(fname, boxV=boxV)
-    data = power_spectrum(pos)
-    cov = thecov_box(pk_theory=data, nbar=nbar, volume=boxV, has_shotnoise_set=False)
-    theory = prepare_theory(z=theory_dict['zsnap'], cosmology=theory_dict['cosmology'], mode=theory_dict['mode'], fnl=theory_dict['fnl'], priors=theory_dict['priors'], fix_fNL=True)
+    data, nbar, cov = load_mock_pscov(i, boxV, sim_params=sim_params, tracer=tracer)
+    theory = prepare_theory(z=theory_dict['zsnap'], cosmology=theory_dict['cosmology'], mode=theory_dict['mode'], fnl=theory_dict['fnl'], priors=theory_dict['priors'], fix_fNL=True, template=_WORKER.get('template', None))
     bestfit_dict = bestfit_p_inference(theory=theory, data=data['P_0'], cov=cov, k=data['k'], klim=klim)
 
     end = time.time()
     logging.info(f"Mock {i+1} done (PID={pid}), elapsed {end - start:.3f}s")
-    return i, bestfit_dict
\ No newline at end of file
+    return i, bestfit_dict
+
+##### ----- workers of fit_p_from_mocks ----- #####
+def share_arrays(arrays: dict) -> tuple[dict, list]:
+    """
+    Copy numpy arrays into shared-memory blocks.
+    
+    Returns
+    -------
+    spec : dict, {name: (shm_name, shape, dtype)} to pass to init_fit_worker.
+    blocks : list of SharedMemory, to close() and unlink() in the parent once the workers are done.
+    """
+    from multiprocessing import shared_memory
+    spec, blocks = {}, []
+    for name, arr in arrays.items():
+        arr = np.ascontiguousarray(arr)
+        shm = shared_memory.SharedMemory(create=True, size=max(arr.nbytes, 1))
+        np.ndarray(arr.shape, dtype=arr.dtype, buffer=shm.buf)[...] = arr
+        spec[name] = (shm.name, arr.shape, arr.dtype.str)
+        blocks.append(shm)
+    return spec, blocks
+
+def init_fit_worker(theory_dict: dict, spec: dict | None = None) -> None:
+    """
+    ProcessPoolExecutor initializer: build the FixedPowerSpectrumTemplate (the cosmology solve) once
+    per worker, and attach the shared arrays of share_arrays.
+    """
+    from multiprocessing import shared_memory
+    _WORKER['template'] = FixedPowerSpectrumTemplate(z=theory_dict['zsnap'], fiducial=theory_dict['cosmology'])
+    _WORKER['theory_dict'] = theory_dict
+    _WORKER['blocks'], _WORKER['arrays'] = [], {}
+    for name, (shm_name, shape, dtype) in (spec or {}).items():
+        shm = shared_memory.SharedMemory(name=shm_name)  # the parent unlinks the blocks
+        _WORKER['blocks'].append(shm)
+        _WORKER['arrays'][name] = np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf)
+
+def fit_p_from_shared(i: int, klim: dict) -> tuple[int, dict]:
+    """
+    Fit p on mock i, with k, P_0 and cov read from the shared arrays ('k', 'P_0', 'cov', 'nk')
+    and the template built by init_fit_worker.
+    """
+    start = time.time()
+    arrays = _WORKER['arrays']
+    theory_dict = _WORKER['theory_dict']
+    nk = int(arrays['nk'][i])
+    k = np.array(arrays['k'][i, :nk])
+    p0 = np.array(arrays['P_0'][i, :nk])
+    cov = np.array(arrays['cov'][i, :nk, :nk])
+    theory = prepare_theory(z=theory_dict['zsnap'], cosmology=theory_dict['cosmology'], mode=theory_dict['mode'], fnl=theory_dict['fnl'], priors=theory_dict['priors'], fix_fNL=True, template=_WORKER['template'])
+    bestfit_dict = bestfit_p_inference(theory=theory, data=p0, cov=cov, k=k, klim=klim)
+    logging.info(f"Mock {i+1} done (PID={os.getpid()}), elapsed {time.time() - start:.3f}s")
+    return i, bestfit_dict
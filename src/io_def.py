@@ -3,14 +3,21 @@ from pathlib import Path
 THIS_REPO = Path(__file__).parent.parent
 import numpy as np
 import os
+from contextlib import contextmanager
 
 __all__ = ["z_to_tag", "def_OBSample",
-    "ensure_dir", "write_script_to_file", "load_config", "write_config",
+    "ensure_dir", "atomic_write", "write_script_to_file", "load_config", "write_config",
     "plot_style",
-    "path_to_ObsClus", "path_to_AbacusSubsample", "path_to_HODchain", "path_to_mocks",
+    "path_to_ObsClus", "path_to_AbacusSubsample", "path_to_ps_cache", "path_to_HODchain", "path_to_mocks",
     "prefix_HOD", "path_to_HODconfigs", 
-    "path_to_catalog", "path_to_clustering", "path_to_poles", 
-    "write_catalogs", "read_catalog"]
+    "path_to_catalog", "path_to_clustering", "path_to_poles", "path_to_pscov", 
+    "write_catalogs", "read_catalog", "ZBINS_DR2"]
+
+## redshift bins of the DR2 HOD fits, QSO z4-z6 are the high-z QSO measurements
+ZBINS_DR2 = {
+    'LRG': {'z1': (0.4, 0.6), 'z2': (0.6, 0.8), 'z3': (0.8, 1.1)},
+    'QSO': {'z1': (0.8, 1.1), 'z2': (1.1, 1.4), 'z3': (1.4, 1.7), 'z4': (1.7, 2.3), 'z5': (2.3, 2.8), 'z6': (2.8, 3.5)}
+}
 
 def z_to_tag(z):
     return f"{float(z):.3f}".replace('.', 'p')
@@ -30,6 +37,22 @@ def ensure_dir(path: str) -> str:
     os.makedirs(path, exist_ok=True)
     return path
 
+@contextmanager
+def atomic_write(path):
+    """
+    Yield a temporary path next to `path`, with the same suffix so that writers choosing the
+    format from the extension still work. The file is moved onto `path` only when the block
+    exits without error, so readers (and resumed runs) never see a partial file.
+    """
+    root, ext = os.path.splitext(str(path))
+    tmp = f"{root}.tmp{os.getpid()}{ext}"
+    try:
+        yield tmp
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
 def write_script_to_file(script, filename, make_executable=False):
     if filename:
         outp = Path(filename)
@@ -91,6 +114,27 @@ def path_to_AbacusSubsample():
     realpath = os.path.realpath(path)
     return Path(realpath)
 
+def path_to_ps_cache() -> Path:
+    'Content-addressed cache of pypower poles, see ps_cache_helper. Override with $FIHOBI_PS_CACHE.'
+    path = os.environ.get('FIHOBI_PS_CACHE', THIS_REPO / "data/ps_cache")
+    realpath = os.path.realpath(path)
+    ensure_dir(realpath)
+    return Path(realpath)
+
+def path_to_cov_cache() -> Path:
+    'Cache of the mock-independent covariance terms (T0), see box_cov_helper. Override with $FIHOBI_COV_CACHE.'
+    path = os.environ.get('FIHOBI_COV_CACHE', THIS_REPO / "data/cov_cache")
+    realpath = os.path.realpath(path)
+    ensure_dir(realpath)
+    return Path(realpath)
+
+def path_to_zhist_cache() -> Path:
+    'Cache of the weighted z histograms of the clustering catalogs, see zhist_helper. Override with $FIHOBI_ZHIST_CACHE.'
+    path = os.environ.get('FIHOBI_ZHIST_CACHE', THIS_REPO / "data/zhist_cache")
+    realpath = os.path.realpath(path)
+    ensure_dir(realpath)
+    return Path(realpath)
+
 def path_to_HODchain(work_dir: Path=None) -> Path:
     if work_dir is None:
         work_dir = THIS_REPO / "HIP"
@@ -188,8 +232,29 @@ def path_to_poles(sim_params, tracer='QSO', prefix=None):
     path = os.path.join(path_to_dir, fname)
     return path   
 
+def path_to_poles_store(sim_params, tracer='QSO'):
+    'Packed store of the pypower poles of the sampled mocks r{i} (seed i), see poles_store_helper.'
+    path_to_dir = path_to_cat_dir(sim_params=sim_params, tracer=tracer) 
+    return os.path.join(path_to_dir, "samples_pypower_poles.store")
+
+def path_to_sample_params(sim_params, tracer='QSO', prefix=None):
+    'HOD parameter vector of a sampled mock, written with its outputs to validate a resume.'
+    path_to_dir = path_to_cat_dir(sim_params=sim_params, tracer=tracer) 
+    fname = f"{prefix}_hod_params.npy" if prefix else "hod_params.npy"
+    return os.path.join(path_to_dir, fname)
 
-def write_catalogs(Ball, mock_real: dict, fit_params: dict, out_root=None, prefix=None) -> None:
+def path_to_pscov(sim_params, tracer='QSO', prefix=None):
+    'Reduced power spectrum + thecov covariance of a mock, see thecov_helper.save_pscov.'
+    path_to_dir = path_to_cat_dir(sim_params=sim_params, tracer=tracer) 
+    fname = f"{prefix}_pscov.npz" if prefix else "pscov.npz"
+    path = os.path.join(path_to_dir, fname)
+    return path   
+
+def write_catalogs(Ball, mock_real: dict, fit_params: dict, out_root=None, prefix=None, mpicomm=None) -> None:
+    """
+    Write one h5 catalog per tracer (atomically). Pass mpicomm=MPI.COMM_SELF when each rank
+    writes its own catalog, otherwise mpytools treats the data as distributed over COMM_WORLD.
+    """
     from mpytools.catalog import Catalog
 
     # Pull meta directly from Ball
@@ -260,17 +325,37 @@ def write_catalogs(Ball, mock_real: dict, fit_params: dict, out_root=None, prefi
         sim_params = {'output_dir': out_root, 'sim_name': sim_name, 'z_mock': zsnap}
         outpath = path_to_catalog(sim_params=sim_params, tracer=tracer, prefix=prefix)
 
-        Catalog(data=data).write(outpath, header=hdr)
+        catalog = Catalog(data=data) if mpicomm is None else Catalog(data=data, mpicomm=mpicomm)
+        with atomic_write(outpath) as tmp:
+            catalog.write(tmp, header=hdr)
         print(f"[write] {tracer} -> {outpath}")
 
-def read_catalog(path2mock: str) -> np.ndarray:
-    from mockfactory import Catalog
-    
-    cat=Catalog.read(path2mock)
-    # boxsize = cat.headers['BOXSIZE']
-    # z_mock = cat.headers['ZSNAP']
-    x = cat['X']
-    y = cat['Y']
-    z = cat['Z']
-    pos = np.vstack((x, y, z)).T
-    return pos
\ No newline at end of file
+def read_catalog(path2mock: str, dtype=np.float32, chunksize: int = 1 << 22) -> np.ndarray:
+    """
+    Read the X, Y, Z columns of an h5 catalog written by write_catalogs into one contiguous
+    (N, 3) buffer of `dtype`, ready for the mesh painter (run_pypower_pos).
+
+    Contiguous, uncompressed datasets are memory-mapped and copied column by column into
+    the buffer, chunked datasets are read `chunksize` rows at a time, so the only full-size
+    allocation is the output buffer (12 bytes per object in float32).
+    """
+    import h5py
+
+    with h5py.File(path2mock, 'r') as f:
+        group = f
+        if 'X' not in f:  # columns stored in a sub-group
+            group = next(f[name] for name in f if isinstance(f[name], h5py.Group) and 'X' in f[name])
+        columns = [group[name] for name in ('X', 'Y', 'Z')]
+        N = columns[0].shape[0]
+        pos = np.empty((N, 3), dtype=dtype)
+        for j, ds in enumerate(columns):
+            offset = ds.id.get_offset()
+            if ds.chunks is None and ds.compression is None and offset is not None:
+                col = np.memmap(path2mock, dtype=ds.dtype, mode='r', offset=offset, shape=ds.shape)
+                for start in range(0, N, chunksize):
+                    pos[start:start + chunksize, j] = col[start:start + chunksize]
+                del col
+            else:
+                for start in range(0, N, chunksize):
+                    pos[start:start + chunksize, j] = ds[start:start + chunksize]
+    return pos
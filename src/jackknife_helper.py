@@ -0,0 +1,110 @@
+"""
+Jackknife realizations of pycorr estimators with array operations.
+
+`allcounts.realization(i)[::2].get_corr(...)` rebuilds a full TwoPointEstimator per region.
+Here the per-region pair counts (auto, cross12, cross21) of each counter are read once, the
+leave-one-out counts of all the regions are formed at once (with the 'mohammad21' weighting of
+the cross pairs, as pycorr), rebinned, turned into correlation functions with the estimator
+formula, and projected with the linear map of pycorr's get_corr (tabulated from a few calls).
+The first realization is checked against pycorr; on any mismatch the slow loop is used.
+"""
+import numpy as np
+
+__all__ = ["jackknife_corr", "get_realizations", "get_combined_jkcov"]
+
+def _loo_counts(counter, realizations, alpha):
+    'Leave-one-out wcounts (nreal, ...) and wnorm (nreal,) of a jackknife counter.'
+    def stack(name):
+        return [np.array([getattr(getattr(counter, part)[ii], name) for ii in realizations], dtype='f8')
+                for part in ('auto', 'cross12', 'cross21')]
+    auto, c12, c21 = stack('wcounts')
+    wcounts = np.asarray(counter.wcounts, dtype='f8') - auto - alpha * (c12 + c21)
+    auto, c12, c21 = stack('wnorm')
+    wnorm = np.asarray(counter.wnorm, dtype='f8') - auto - alpha * (c12 + c21)
+    return wcounts, wnorm
+
+def _rebin(wcounts, factor):
+    'Sum `factor` consecutive bins along the first separation axis, as estimator[::factor].'
+    n = wcounts.shape[1] // factor * factor
+    return wcounts[:, :n].reshape(wcounts.shape[0], n // factor, factor, *wcounts.shape[2:]).sum(axis=2)
+
+def _corr(counts, count_names):
+    'Correlation function (nreal, ns, nmu) from the normalized counts, for the Landy-Szalay and natural estimators.'
+    RR = counts['R1R2']
+    with np.errstate(invalid='ignore', divide='ignore'):
+        if set(count_names) == {'D1D2', 'D1R2', 'R1D2', 'R1R2'}:
+            corr = (counts['D1D2'] - counts['D1R2'] - counts['R1D2']) / RR + 1
+        elif set(count_names) == {'D1D2', 'R1R2'}:
+            corr = counts['D1D2'] / RR - 1
+        else:
+            raise NotImplementedError(f"estimator with counts {count_names}")
+    corr[RR == 0] = np.nan
+    return corr
+
+def _projection(estimator, mode):
+    """
+    Coefficients (nout, ns, nmu) of the linear map corr -> get_corr(mode)[1] of a plain estimator.
+    Each output only depends on its own separation row, so each call tabulates one column per
+    row, and nmu calls (shifted diagonals of unit corr) give the whole map.
+    """
+    corr0 = estimator.corr
+    ns, nmu = corr0.shape
+    nout = np.asarray(estimator.get_corr(mode=mode, return_sep=True)[1]).size
+    coeffs = np.zeros((nout // ns, ns, nmu))
+    rows = np.arange(ns)
+    try:
+        for shift in range(nmu):
+            cols = (rows + shift) % nmu
+            estimator.corr = np.zeros_like(corr0)
+            estimator.corr[rows, cols] = 1.
+            out = np.asarray(estimator.get_corr(mode=mode, return_sep=True)[1]).reshape(-1, ns)
+            coeffs[:, rows, cols] = out
+    finally:
+        estimator.corr = corr0
+    return coeffs
+
+def _jackknife_corr_loop(allcounts, mode, rebin, correction):
+    return np.array([allcounts.realization(ii, correction=correction)[::rebin].get_corr(mode=mode, return_sep=True)[1].flatten()
+                     for ii in allcounts.realizations])
+
+def _jackknife_corr_fast(allcounts, mode, rebin, correction):
+    realizations = list(allcounts.realizations)
+    nreal = len(realizations)
+    alpha = nreal / (2. + np.sqrt(2.) * (nreal - 1)) if correction == 'mohammad21' else 1.
+    counts = {}
+    for name in allcounts.count_names:
+        wcounts, wnorm = _loo_counts(getattr(allcounts, name), realizations, alpha)
+        counts[name] = _rebin(wcounts, rebin) / wnorm.reshape((-1,) + (1,) * (wcounts.ndim - 1))
+    corr = _corr(counts, allcounts.count_names)
+    first = allcounts.realization(realizations[0], correction=correction)[::rebin]
+    coeffs = _projection(first, mode)
+    jk = np.einsum('lsm,rsm->rls', coeffs, corr).reshape(nreal, -1)
+    ref = np.asarray(first.get_corr(mode=mode, return_sep=True)[1]).flatten()
+    return jk, ref
+
+def jackknife_corr(allcounts, mode, rebin=2, correction='mohammad21', check=True):
+    """
+    All the jackknife realizations of allcounts.realization(i)[::rebin].get_corr(mode=mode)[1]
+    flattened, as an array (nreal, nout) in the order of allcounts.realizations.
+    With check, the first realization is compared to pycorr, and the pycorr loop is used if
+    they differ or if the estimator is not supported.
+    """
+    try:
+        jk, ref = _jackknife_corr_fast(allcounts, mode, rebin, correction)
+    except (NotImplementedError, AttributeError, ValueError) as e:
+        print(f"[jackknife] {mode}: {e!r}, using the pycorr loop")
+        return _jackknife_corr_loop(allcounts, mode, rebin, correction)
+    if check and not np.allclose(jk[0], ref, rtol=1e-8, atol=1e-12, equal_nan=True):
+        print(f"[jackknife] vectorised {mode} differs from pycorr (max {np.nanmax(np.abs(jk[0] - ref)):.2e}), using the pycorr loop")
+        return _jackknife_corr_loop(allcounts, mode, rebin, correction)
+    return jk
+
+def get_realizations(allcounts, idx, mode):
+    'Jackknife realizations (len(idx), nreal) of the selected bins, as the former loop.'
+    return jackknife_corr(allcounts, mode)[:, idx].T
+
+def get_combined_jkcov(allcountswp, allcountsxi, idxwp, idxxi02):
+    'Jackknife covariance of (wp[idxwp], xi02[idxxi02]).'
+    jkall = np.concatenate((get_realizations(allcountswp, idxwp, 'wp'), get_realizations(allcountsxi, idxxi02, 'poles')))
+    nreal = jkall.shape[1]
+    return ((nreal - 1) * np.cov(jkall, ddof=0))
@@ -2,7 +2,8 @@ import numpy as np
 import glob, os
 from pypower import PowerSpectrumMultipoles
 from matplotlib import pyplot as plt
-from io_def import path_to_poles
+from io_def import path_to_poles, path_to_poles_store
+from poles_store_helper import PolesStore, find_store
 
 
 def load_poles_data(data):
@@ -22,11 +23,21 @@ def load_poles_data(data):
 
 def load_sampled_HOD_mocks(data, k_1st=None, num=1, sim_params=None, tracer=None, cmap='viridis'):
     cmap = plt.get_cmap(cmap)
+    # read all the samples at once from the packed store when it holds them
+    store = find_store(path_to_poles_store(sim_params=sim_params, tracer=tracer))
+    if store is not None and set(range(num)) <= set(PolesStore(store).index()):
+        packed = PolesStore(store).read(seeds=range(num))
+        ell0 = packed['ells'].index(0)
+    else:
+        packed = None
     for i in range(num):
         key = f'r{i}'
-        path2poles = path_to_poles(sim_params=sim_params, tracer=tracer, prefix=f'r{i}')
-        poles = PowerSpectrumMultipoles.load(path2poles)
-        k, p0 = poles(ell=0, return_k=True, complex=False)
+        if packed is not None:
+            k, p0 = packed['k'][i], packed['poles'][i, ell0]
+        else:
+            path2poles = path_to_poles(sim_params=sim_params, tracer=tracer, prefix=f'r{i}')
+            poles = PowerSpectrumMultipoles.load(path2poles)
+            k, p0 = poles(ell=0, return_k=True, complex=False)
         if not np.allclose(k, k_1st, equal_nan=True):
             raise ValueError("k arrays do not match!")
         data[key] = {
@@ -39,16 +50,23 @@ def load_sampled_HOD_mocks(data, k_1st=None, num=1, sim_params=None, tracer=None
         }
     return data
 
-def load_EZmocks(dirEZmocks, k_1st=None):
-    files = glob.glob(dirEZmocks+f'/pypowerpoles_r*.npy')
-    p0_ez = []
-    for fn in files:
-        poles = PowerSpectrumMultipoles.load(fn) 
-        k_ez, p0 = poles(ell=0, return_k=True, complex=False)
-        if not np.allclose(k_ez, k_1st, equal_nan=True):
-            raise ValueError("k arrays do not match!")
-        p0_ez.append(p0)
-    p0_ez_avg = np.mean(p0_ez, axis=0)
-    p0_err = np.std(p0_ez, axis=0)
-    print(f"Loaded {len(files)} EZmock power spectra from {dirEZmocks}")
+def load_EZmocks(dirEZmocks, k_1st=None, nplot=50, nproc=8):
+    """
+    Mean and std of the EZmock P0 in one streaming pass (mock_stats_helper), plus the first
+    `nplot` spectra for plotting. Reads the packed store of the directory if there is one.
+    """
+    from mock_stats_helper import accumulate_mocks, read_poles_vector
+    acc = accumulate_mocks(dirEZmocks, ells=(0,), state=None, nproc=nproc)  # plotting: do not write a state next to the mocks
+    if k_1st is not None and not np.allclose(acc.k, k_1st, equal_nan=True):
+        raise ValueError("k arrays do not match!")
+    store = find_store(dirEZmocks)
+    if store is not None:
+        packed = PolesStore(store).read()
+        p0_ez = list(packed['poles'][:nplot, packed['ells'].index(0)])
+    else:
+        files = sorted(glob.glob(str(dirEZmocks)+f'/pypowerpoles_r*.npy'))[:nplot]
+        p0_ez = [read_poles_vector(fn, ells=(0,))[1] for fn in files]
+    p0_ez_avg = acc.mean
+    p0_err = np.sqrt(np.diag(acc.M2) / acc.n)  # as np.std
+    print(f"Loaded {acc.n} EZmock power spectra from {dirEZmocks}")
     return p0_ez, p0_ez_avg, p0_err
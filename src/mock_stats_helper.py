@@ -0,0 +1,217 @@
+"""
+Streaming mean and covariance of the power spectrum multipoles of a mock set (EZmocks).
+
+Each mock is read once, reduced to its (ell, k) data vector and folded into a Welford
+accumulator, so the memory does not grow with the number of mocks. Chunks of mocks are
+accumulated in parallel by a process pool and merged with the pairwise update of Chan et al.;
+the accumulator state is saved next to the mocks, so that a later call only reads the seeds
+finished since then. The mocks are read from a packed store (poles_store_helper) when there
+is one, otherwise from the pypower files.
+"""
+import os
+import re
+import glob
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+from io_def import atomic_write
+from poles_store_helper import PolesStore, find_store
+
+__all__ = ["PolesAccumulator", "hartlap", "read_poles_vector", "accumulate_mocks", "mock_mean_cov"]
+
+class PolesAccumulator:
+    """
+    Welford accumulator of the mean and of the sum of squared deviations M2 of flattened
+    (ell, k) data vectors, with the keys of the mocks folded in (see accumulate_mocks).
+    """
+    def __init__(self, k: np.ndarray | None = None, ells: tuple = (0,)):
+        self.k = None if k is None else np.asarray(k, dtype=float)
+        self.ells = tuple(ells)
+        self.n = 0
+        self.mean = None
+        self.M2 = None
+        self.keys = set()
+
+    def _check_k(self, k):
+        if self.k is None:
+            self.k = np.asarray(k, dtype=float)
+        elif not np.allclose(k, self.k, equal_nan=True):
+            raise ValueError("k arrays do not match!")
+
+    def add(self, x: np.ndarray, key: str | None = None, k: np.ndarray | None = None) -> None:
+        'Fold in one data vector.'
+        if k is not None:
+            self._check_k(k)
+        x = np.asarray(x, dtype=np.float64).ravel()
+        if self.mean is None:
+            self.mean = np.zeros_like(x)
+            self.M2 = np.zeros((x.size, x.size))
+        self.n += 1
+        delta = x - self.mean
+        self.mean += delta / self.n
+        self.M2 += np.outer(delta, x - self.mean)
+        if key is not None:
+            self.keys.add(key)
+
+    def merge(self, other: 'PolesAccumulator') -> 'PolesAccumulator':
+        'Fold in another accumulator (Chan et al. pairwise update).'
+        if other.n == 0:
+            return self
+        if other.k is not None:
+            self._check_k(other.k)
+        if self.n == 0:
+            self.n, self.mean, self.M2 = other.n, other.mean.copy(), other.M2.copy()
+        else:
+            n = self.n + other.n
+            delta = other.mean - self.mean
+            self.mean = self.mean + delta * (other.n / n)
+            self.M2 = self.M2 + other.M2 + np.outer(delta, delta) * (self.n * other.n / n)
+            self.n = n
+        self.keys |= other.keys
+        return self
+
+    @property
+    def cov(self) -> np.ndarray:
+        'Unbiased sample covariance, (Nell*Nk, Nell*Nk).'
+        return self.M2 / (self.n - 1)
+
+    @property
+    def std(self) -> np.ndarray:
+        return np.sqrt(np.diag(self.cov))
+
+    def save(self, path: str) -> None:
+        with atomic_write(path) as tmp:
+            np.savez(tmp, n=self.n, mean=self.mean, M2=self.M2, k=np.array([] if self.k is None else self.k), ells=np.array(self.ells), keys=np.array(sorted(self.keys)))
+        print(f"[write] accumulator of {self.n} mocks -> {path}")
+
+    @classmethod
+    def load(cls, path: str) -> 'PolesAccumulator':
+        with np.load(path) as f:
+            acc = cls(k=f['k'] if f['k'].size else None, ells=tuple(int(ell) for ell in f['ells']))
+            acc.n = int(f['n'])
+            acc.mean, acc.M2 = f['mean'], f['M2']
+            acc.keys = set(str(key) for key in f['keys'])
+        return acc
+
+def hartlap(nmocks: int, nbins: int) -> float:
+    'Hartlap et al. (2007) factor (N - p - 2) / (N - 1); multiply the inverse covariance by it.'
+    if nmocks <= nbins + 2:
+        raise ValueError(f"{nmocks} mocks are not enough for {nbins} bins.")
+    return (nmocks - nbins - 2) / (nmocks - 1)
+
+def read_poles_vector(fn: str, ells: tuple = (0,)) -> tuple[np.ndarray, np.ndarray]:
+    'k and the flattened multipoles `ells` of a pypower PowerSpectrumMultipoles file.'
+    from pypower import PowerSpectrumMultipoles
+    poles = PowerSpectrumMultipoles.load(fn)
+    k, pk = poles(ell=list(ells), return_k=True, complex=False)
+    return k, np.ravel(pk)
+
+def _file_key(fn):
+    'Key of a mock file: its name, size and mtime, so that a regenerated file is read again.'
+    st = os.stat(fn)
+    return f"{os.path.basename(fn)}@{st.st_size}:{st.st_mtime_ns}"
+
+def _accumulate_files(items: list, ells: tuple) -> PolesAccumulator:
+    acc = PolesAccumulator(ells=ells)
+    for key, fn in items:
+        k, x = read_poles_vector(fn, ells=ells)
+        acc.add(x, key=key, k=k)
+    return acc
+
+def _accumulate_rows(path: str, items: list, ells: tuple) -> PolesAccumulator:
+    store = PolesStore(path)
+    rec = store.records()
+    iell = [store.ells.index(ell) for ell in ells]
+    acc = PolesAccumulator(ells=ells)
+    for key, row in items:
+        acc.add(rec['poles'][row][iell], key=key, k=rec['k'][row])
+    return acc
+
+def _seed(fn):
+    m = re.search(r'r(\d+)', os.path.basename(fn))
+    return int(m.group(1)) if m else -1
+
+def accumulate_mocks(
+    source: str | list,
+    ells: tuple = (0,),
+    n_mocks: int | None = None,
+    state: str | None = 'auto',
+    nproc: int = 8,
+    chunksize: int = 32,
+) -> PolesAccumulator:
+    """
+    Accumulate the mocks of `source` not yet in the saved state.
+
+    source: packed store (or directory holding poles_store_helper.STORE_NAME), directory of
+        pypowerpoles_r*.npy files (or *.npy), or a list of files.
+    n_mocks: use only the first n_mocks seeds.
+    state: path of the accumulator state; 'auto' for `ezmock_stats_ell{...}[_n{n_mocks}].npz` in the
+        directory, None to neither read nor save it. The mocks are keyed by file name, size and
+        mtime (store: seed and row), and the state is discarded if one of its mocks changed.
+    nproc: processes reading the files; each one accumulates chunks of `chunksize` mocks.
+    """
+    store = find_store(source) if isinstance(source, (str, os.PathLike)) else None
+    if store is not None:
+        directory = os.path.dirname(store)
+        index = PolesStore(store).index()
+        # (key, row); a seed appended again gets a new row, hence a new key
+        items = [(f"r{seed}@row{index[seed]}", index[seed]) for seed in sorted(index)]
+    else:
+        if isinstance(source, (str, os.PathLike)):
+            directory = str(source)
+            files = glob.glob(os.path.join(directory, 'pypowerpoles_r*.npy')) or glob.glob(os.path.join(directory, '*.npy'))
+            files = [fn for fn in files if not os.path.basename(fn).startswith('ezmock_stats')]
+        else:
+            directory, files = None, list(source)
+        items = [(_file_key(fn), fn) for fn in sorted(files, key=lambda fn: (_seed(fn), fn))]
+    if n_mocks is not None:
+        if n_mocks > len(items):
+            raise ValueError(f"Requested n_EZmocks={n_mocks} exceeds available {len(items)} EZmocks!")
+        items = items[:n_mocks]
+    if len(items) == 0:
+        raise FileNotFoundError(f'No mocks found in {source}')
+
+    if state == 'auto':
+        state = None if directory is None else os.path.join(directory, f"ezmock_stats_ell{''.join(map(str, ells))}" + ('' if n_mocks is None else f'_n{n_mocks}') + '.npz')
+    acc = PolesAccumulator(ells=ells)
+    if state is not None and os.path.exists(state):
+        acc = PolesAccumulator.load(state)
+        keys = set(key for key, _ in items)
+        if acc.ells != tuple(ells) or not acc.keys <= keys:
+            print(f"[stats] {state} does not match the mocks (changed or removed), accumulating from scratch.")
+            acc = PolesAccumulator(ells=ells)
+    todo = [item for item in items if item[0] not in acc.keys]
+    print(f"[stats] {acc.n} mocks in the saved state, {len(todo)} to read.")
+    if todo:
+        if store is not None:
+            chunksize = max(chunksize, -(-len(todo) // nproc))  # reading a memmap: one chunk per process
+            work, args = _accumulate_rows, lambda chunk: (store, chunk, ells)
+        else:
+            work, args = _accumulate_files, lambda chunk: (chunk, ells)
+        chunks = [todo[i:i + chunksize] for i in range(0, len(todo), chunksize)]
+        if nproc > 1 and len(chunks) > 1:
+            with ProcessPoolExecutor(max_workers=min(nproc, len(chunks))) as executor:
+                for part in executor.map(work, *zip(*map(args, chunks))):
+                    acc.merge(part)
+        else:
+            for chunk in chunks:
+                acc.merge(work(*args(chunk)))
+        if state is not None:
+            acc.save(state)
+    return acc
+
+def mock_mean_cov(source, ells: tuple = (0,), n_mocks: int | None = None, mask: np.ndarray | None = None, **kwargs) -> dict:
+    """
+    Mean, covariance and Hartlap factor of the mocks of `source` (see accumulate_mocks).
+
+    mask: boolean mask on the flattened (ell, k) vector (e.g. a k range); the Hartlap factor is
+        computed for the number of selected bins.
+
+    Returns: dict with 'k', 'ells', 'mean', 'cov', 'std', 'nmocks', 'hartlap'.
+    """
+    acc = accumulate_mocks(source, ells=ells, n_mocks=n_mocks, **kwargs)
+    mean, cov = acc.mean, acc.cov
+    if mask is not None:
+        mean, cov = mean[mask], cov[np.ix_(mask, mask)]
+    return {'k': acc.k, 'ells': acc.ells, 'mean': mean, 'cov': cov, 'std': np.sqrt(np.diag(cov)),
+            'nmocks': acc.n, 'hartlap': hartlap(acc.n, len(mean))}
@@ -0,0 +1,148 @@
+"""
+Append-only packed store of power spectrum multipoles, one file per mock set.
+
+Layout: an 8-byte magic, the header length (uint64) and a JSON header (ells, nk, k-edges,
+free metadata), padded to 64 bytes, then fixed-size records
+
+    seed (int64) | k (nk float64) | nmodes (nk float64) | poles (nell x nk float64)
+
+Concurrent jobs append under an exclusive flock; a record torn by a crashed writer is
+truncated by the next one. The records are read back as a numpy memmap, so that the
+multipoles of all mocks are one (Nmock, Nell, Nk) array instead of one pickle per mock.
+"""
+import os
+import json
+import fcntl
+import numpy as np
+
+__all__ = ["PolesStore", "find_store", "STORE_NAME"]
+
+MAGIC = b'FHPOLES1'
+ALIGN = 64
+STORE_NAME = 'pypowerpoles.store'  # name of the store in a directory of mocks
+
+def find_store(path) -> str | None:
+    'The store itself, or the STORE_NAME store of a directory, or None.'
+    path = str(path)
+    if os.path.isdir(path):
+        path = os.path.join(path, STORE_NAME)
+    if os.path.isfile(path):
+        with open(path, 'rb') as f:
+            if f.read(len(MAGIC)) == MAGIC:
+                return path
+    return None
+
+class PolesStore:
+    """
+    Packed store of multipoles, see module docstring.
+    """
+    def __init__(self, path: str):
+        self.path = str(path)
+        self._header = None
+
+    ## ----- layout ----- ##
+    @staticmethod
+    def _dtype(nell, nk):
+        return np.dtype([('seed', '<i8'), ('k', '<f8', (nk,)), ('nmodes', '<f8', (nk,)), ('poles', '<f8', (nell, nk))])
+
+    @staticmethod
+    def _encode_header(header):
+        text = json.dumps(header, sort_keys=True).encode()
+        size = len(MAGIC) + 8 + len(text)
+        text += b' ' * (-size % ALIGN)
+        return MAGIC + np.uint64(len(text)).tobytes() + text
+
+    def _read_header(self, f):
+        f.seek(0)
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{self.path} is not a poles store.")
+        length = int(np.frombuffer(f.read(8), dtype='<u8')[0])
+        header = json.loads(f.read(length))
+        header['offset'] = len(MAGIC) + 8 + length
+        return header
+
+    @property
+    def header(self) -> dict:
+        if self._header is None:
+            with open(self.path, 'rb') as f:
+                self._header = self._read_header(f)
+        return self._header
+
+    @property
+    def ells(self) -> tuple:
+        return tuple(self.header['ells'])
+
+    ## ----- write ----- ##
+    def append(self, seed: int, poles=None, ells=(0, 2), k=None, nmodes=None, pk=None, edges=None, meta: dict | None = None) -> None:
+        """
+        Append one mock. Either a pypower PowerSpectrumMultipoles `poles` (multipoles `ells`,
+        shot noise removed) or the arrays k (nk,), nmodes (nk,), pk (nell, nk).
+        meta: stored in the header when the store is created.
+        """
+        if poles is not None:
+            k, nmodes = poles.k, poles.nmodes
+            pk = poles(ell=list(ells), complex=False)
+            edges = poles.edges[0]
+        pk = np.atleast_2d(np.asarray(pk, dtype='<f8'))
+        nell, nk = pk.shape
+        with open(self.path, 'a+b') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                f.seek(0, os.SEEK_END)
+                if f.tell() == 0:
+                    header = {'ells': list(ells), 'nk': nk, 'edges': None if edges is None else np.asarray(edges, dtype=float).tolist(), 'meta': meta or {}}
+                    f.write(self._encode_header(header))
+                    f.flush()
+                header = self._read_header(f)
+                if tuple(header['ells']) != tuple(ells) or header['nk'] != nk:
+                    raise ValueError(f"{self.path} holds ells={header['ells']}, nk={header['nk']}, got ells={tuple(ells)}, nk={nk}.")
+                dtype = self._dtype(nell, nk)
+                end = f.seek(0, os.SEEK_END)
+                torn = (end - header['offset']) % dtype.itemsize
+                if torn:
+                    # left by a crashed writer
+                    f.truncate(end - torn)
+                record = np.zeros(1, dtype=dtype)
+                record['seed'], record['k'], record['nmodes'], record['poles'] = seed, k, nmodes, pk
+                f.write(record.tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+        self._header = None
+
+    ## ----- read ----- ##
+    def records(self) -> np.ndarray:
+        'Structured memmap of the complete records, fields seed, k, nmodes, poles.'
+        header = self.header
+        dtype = self._dtype(len(header['ells']), header['nk'])
+        nrec = (os.path.getsize(self.path) - header['offset']) // dtype.itemsize
+        if nrec == 0:
+            return np.zeros(0, dtype=dtype)
+        return np.memmap(self.path, dtype=dtype, mode='r', offset=header['offset'], shape=(nrec,))
+
+    def __len__(self) -> int:
+        return len(self.records())
+
+    @property
+    def seeds(self) -> np.ndarray:
+        return np.asarray(self.records()['seed'])
+
+    def index(self) -> dict:
+        'seed -> row; for a seed appended twice, the last row.'
+        return {int(seed): row for row, seed in enumerate(self.seeds)}
+
+    def read(self, seeds=None) -> dict:
+        """
+        Multipoles as arrays: 'seeds' (Nmock,), 'k', 'nmodes' (Nmock, Nk), 'poles' (Nmock, Nell, Nk)
+        and 'ells'. Without `seeds`, all records as memmap views (in order of appending);
+        otherwise the rows of the given seeds, in that order.
+        """
+        rec = self.records()
+        if seeds is not None:
+            index = self.index()
+            missing = [seed for seed in seeds if int(seed) not in index]
+            if missing:
+                raise KeyError(f"seeds {missing} not in {self.path}")
+            rec = rec[[index[int(seed)] for seed in seeds]]
+        return {'seeds': rec['seed'], 'k': rec['k'], 'nmodes': rec['nmodes'], 'poles': rec['poles'], 'ells': self.ells}
@@ -0,0 +1,78 @@
+"""
+Content-addressed cache of the pypower multipoles of box catalogs.
+
+The key is a blake2b hash of the galaxy positions and of every setting entering the FFT
+estimator (box size, Nmesh, resampler, interlacing, line of sight, edges, ells), so the
+same catalog measured again -- e.g. a HIP re-run with different priors or klim -- is
+served from the cache and never touches the FFT.
+"""
+import os
+import hashlib
+from collections import OrderedDict
+import numpy as np
+
+from io_def import path_to_ps_cache, atomic_write
+import pypower_helpers as pph
+
+__all__ = ["ps_cache_key", "cached_pypower_redshift", "cached_pypower_pos"]
+
+_MEMORY = OrderedDict()  # key -> PowerSpectrumMultipoles, most recent last
+_MEMORY_SIZE = 64
+_CHUNK = 1 << 22  # elements hashed per update, avoids a full copy of the positions
+
+def _update_array(h, arr):
+    arr = np.asarray(arr)  # 1D, possibly a strided column of an (N, 3) buffer
+    for start in range(0, arr.size, _CHUNK):
+        h.update(np.ascontiguousarray(arr[start:start + _CHUNK], dtype=np.float64).data)
+
+def ps_cache_key(x, y, z, Lbox=pph.Lbox, Nmesh=pph.Nmesh, resampler=pph.resampler, interlacing=pph.interlacing, edges=pph.edges, ells=pph.ells, los='z') -> str:
+    """
+    Hash of the positions (as float64, column by column) and of the estimator settings.
+    """
+    h = hashlib.blake2b(digest_size=20)
+    h.update(f"N={len(x)};Lbox={float(Lbox)!r};Nmesh={Nmesh};resampler={resampler};interlacing={interlacing};los={los};ells={tuple(ells)};".encode())
+    for edge in (edges if isinstance(edges, tuple) else (edges,)):
+        _update_array(h, edge)
+    for col in (x, y, z):
+        _update_array(h, col)
+    return h.hexdigest()
+
+def cached_pypower_redshift(x, y, z, mpicomm=None, cache_dir=None, **kwargs):
+    'cached_pypower_pos for separate x, y, z arrays.'
+    return cached_pypower_pos(np.column_stack((x, y, z)), mpicomm=mpicomm, cache_dir=cache_dir, **kwargs)
+
+def cached_pypower_pos(pos, mpicomm=None, cache_dir=None, **kwargs):
+    """
+    pypower_helpers.run_pypower_pos with a two-level cache: an in-process LRU of
+    PowerSpectrumMultipoles and one `<key>.npy` file per measurement in cache_dir
+    (io_def.path_to_ps_cache by default). kwargs are passed to run_pypower_pos and
+    enter the key.
+    """
+    from pypower import PowerSpectrumMultipoles
+
+    if mpicomm is not None:
+        kwargs['mpicomm'] = mpicomm
+    if kwargs.get('mpicomm', pph.mpicomm).size > 1:
+        # positions scattered over the ranks: the keys would differ from rank to rank
+        return pph.run_pypower_pos(pos, **kwargs)
+    settings = dict(Lbox=kwargs.get('Lbox', pph.Lbox), Nmesh=kwargs.get('Nmesh', pph.Nmesh),
+                    resampler=kwargs.get('resampler', pph.resampler), interlacing=kwargs.get('interlacing', pph.interlacing),
+                    edges=kwargs.get('edges', pph.edges), ells=kwargs.get('ells', pph.ells))
+    key = ps_cache_key(pos[:, 0], pos[:, 1], pos[:, 2], **settings)
+    if key in _MEMORY:
+        _MEMORY.move_to_end(key)
+        return _MEMORY[key]
+    if cache_dir is None:
+        cache_dir = path_to_ps_cache()
+    fn = os.path.join(cache_dir, f"{key}.npy")
+    if os.path.exists(fn):
+        poles = PowerSpectrumMultipoles.load(fn)
+        print(f"[cache] pypower poles <- {fn}")
+    else:
+        poles = pph.run_pypower_pos(pos, **kwargs)
+        with atomic_write(fn) as tmp:
+            poles.save(tmp)
+    _MEMORY[key] = poles
+    if len(_MEMORY) > _MEMORY_SIZE:
+        _MEMORY.popitem(last=False)
+    return poles
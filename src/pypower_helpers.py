@@ -14,10 +14,86 @@ kmax = Nmesh*np.pi/Lbox
 kedges = np.linspace(0, kmax, Nmesh//2+1)
 edges = (kedges, np.linspace(-1., 1., 5))
 ells=(0,2)
+resampler = 'tsc'
+interlacing = 3
+
+## mesh profiles: the smallest mesh / interlacing meeting an error bound at kmax
+RESAMPLER_ORDER = {'ngp': 1, 'cic': 2, 'tsc': 3, 'pcs': 4}
+
+def alias_error(k, Nmesh=Nmesh, resampler=resampler, interlacing=interlacing, Lbox=Lbox, mmax=64):
+    """
+    Bound on the relative aliasing error of the compensated power spectrum at k.
+
+    With x = k / (2 k_N), the image at k + 2 k_N m enters with the squared window ratio
+    (x / (x + m))^(2p), p the order of the resampler; interlacing of order n cancels the
+    images with m not a multiple of n. Assuming P(k) does not increase beyond k (true on
+    the scales we fit), eps(x) = 3 * sum_{m != 0, n | m} (x / (x + m))^(2p), where the
+    factor 3 accounts for the images along the three axes.
+    """
+    p = RESAMPLER_ORDER[resampler]
+    n = max(int(interlacing or 1), 1)
+    kN = np.pi * Nmesh / Lbox
+    x = np.asarray(k, dtype=float) / (2 * kN)
+    m = np.arange(n, mmax + 1, n, dtype=float)
+    m = np.concatenate([-m, m])
+    eps = 3 * np.sum((x[..., None] / (x[..., None] + m))**(2 * p), axis=-1)
+    return np.where(x < 0.5, eps, np.inf)
+
+def mesh_cost(Nmesh, resampler, interlacing, nobj=5e6):
+    'Relative cost: FFTs (one per interlacing shift) plus painting p^3 cells per object.'
+    n = max(int(interlacing or 1), 1)
+    ncell = float(Nmesh)**3
+    return n * (ncell * np.log2(ncell) + nobj * RESAMPLER_ORDER[resampler]**3)
+
+def mesh_profile(kmax, tol=1e-3, Lbox=Lbox, knyq_frac=0.5, nobj=5e6, nmesh_list=(64, 96, 128, 192, 256, 384, 512, 768, 1024), resamplers=('cic', 'tsc', 'pcs'), interlacings=(0, 2, 3)) -> dict:
+    """
+    Cheapest (Nmesh, resampler, interlacing) whose aliasing bound at kmax is below tol.
+    kmax is also required to stay below knyq_frac times the Nyquist frequency, where the
+    image model above is reliable. nobj (number of objects in the catalog) weighs the
+    painting against the FFTs in mesh_cost.
+
+    Returns a dict of keyword arguments for run_pypower_redshift (Nmesh, resampler, interlacing,
+    edges), plus 'kmax' and the achieved 'error'. Raises ValueError if no profile meets tol.
+    """
+    best = None
+    for nmesh in nmesh_list:
+        if kmax > knyq_frac * np.pi * nmesh / Lbox:
+            continue
+        for res in resamplers:
+            for inter in interlacings:
+                err = float(alias_error(kmax, Nmesh=nmesh, resampler=res, interlacing=inter, Lbox=Lbox))
+                if err > tol:
+                    continue
+                cost = mesh_cost(nmesh, res, inter, nobj=nobj)
+                if best is None or cost < best[0]:
+                    best = (cost, nmesh, res, inter, err)
+    if best is None:
+        raise ValueError(f"No mesh profile reaches a relative error {tol:g} at kmax={kmax:g} h/Mpc (Lbox={Lbox}).")
+    _, nmesh, res, inter, err = best
+    return {'Nmesh': nmesh, 'resampler': res, 'interlacing': inter if inter > 1 else False, 'edges': edges_for(nmesh, Lbox=Lbox), 'kmax': kmax, 'error': err}
+
+def edges_for(Nmesh, Lbox=Lbox):
+    'Same binning as the module default (dk = 2 pi / Lbox), up to the Nyquist frequency of Nmesh.'
+    kmax_N = Nmesh*np.pi/Lbox
+    return (np.linspace(0, kmax_N, Nmesh//2+1), np.linspace(-1., 1., 5))
+
+PROFILES = {
+    'default': {'Nmesh': Nmesh, 'resampler': resampler, 'interlacing': interlacing, 'edges': edges},
+}
+
+def get_profile(name_or_kmax, tol=1e-3) -> dict:
+    """
+    Keyword arguments for run_pypower_redshift: a name in PROFILES, or a kmax (float) for
+    mesh_profile(kmax, tol).
+    """
+    if isinstance(name_or_kmax, str):
+        return dict(PROFILES[name_or_kmax])
+    prof = mesh_profile(float(name_or_kmax), tol=tol)
+    return {key: prof[key] for key in ('Nmesh', 'resampler', 'interlacing', 'edges')}
 
 def apply_periodic(x, L):
         return (x + 0.5 * L) % L - 0.5 * L
-def run_pypower(x, y, z, vz, rsd_fac, Lbox=Lbox, Nmesh=Nmesh, edges=edges, ells=ells, mpicomm=mpicomm, mpiroot=mpiroot):    
+def run_pypower(x, y, z, vz, rsd_fac, Lbox=Lbox, Nmesh=Nmesh, edges=edges, ells=ells, mpicomm=mpicomm, mpiroot=mpiroot, resampler=resampler, interlacing=interlacing):    
     ## positions
     pos = np.vstack((x, y, z)).T
     ## add RSD to z direction
@@ -25,17 +101,23 @@ def run_pypower(x, y, z, vz, rsd_fac, Lbox=Lbox, Nmesh=Nmesh, edges=edges, ells=
     pos[:, 2]=z_RSD
     weight = np.ones(len(pos))
     result = CatalogFFTPower(pos, data_weights1=weight, boxsize=Lbox, nmesh=Nmesh, 
-                         resampler='tsc', interlacing=3, ells=ells, 
+                         resampler=resampler, interlacing=interlacing, ells=ells, 
                          los='z', edges=edges,  position_type='pos', mpicomm=mpicomm, mpiroot=mpiroot)
     poles = result.poles
     return poles
 
-def run_pypower_redshift(x, y, z, Lbox=Lbox, Nmesh=Nmesh, edges=edges, ells=ells, mpicomm=mpicomm, mpiroot=mpiroot):    
+def run_pypower_redshift(x, y, z, Lbox=Lbox, Nmesh=Nmesh, edges=edges, ells=ells, mpicomm=mpicomm, mpiroot=mpiroot, resampler=resampler, interlacing=interlacing):    
     ## positions
-    pos = np.vstack((x, y, z)).T
-    weight = np.ones(len(pos))
-    result = CatalogFFTPower(pos, data_weights1=weight, boxsize=Lbox, nmesh=Nmesh, 
-                         resampler='tsc', interlacing=3, ells=ells, 
+    pos = np.column_stack((x, y, z))
+    return run_pypower_pos(pos, Lbox=Lbox, Nmesh=Nmesh, edges=edges, ells=ells, mpicomm=mpicomm, mpiroot=mpiroot, resampler=resampler, interlacing=interlacing)
+
+def run_pypower_pos(pos, Lbox=Lbox, Nmesh=Nmesh, edges=edges, ells=ells, mpicomm=mpicomm, mpiroot=mpiroot, resampler=resampler, interlacing=interlacing):
+    """
+    Same as run_pypower_redshift for a contiguous (N, 3) position buffer (e.g. from io_def.read_catalog),
+    passed to the mesh painter as is. Weights are implicit unit weights (data_weights1=None).
+    """
+    result = CatalogFFTPower(data_positions1=pos, data_weights1=None, boxsize=Lbox, nmesh=Nmesh, 
+                         resampler=resampler, interlacing=interlacing, ells=ells, 
                          los='z', edges=edges,  position_type='pos', mpicomm=mpicomm, mpiroot=mpiroot)
     poles = result.poles
-    return poles
\ No newline at end of file
+    return poles
@@ -2,12 +2,12 @@ import numpy as np
 import cosmoprimo
 
 from io_def import read_catalog
-from pypower_helpers import run_pypower_redshift
+from pypower_helpers import run_pypower_redshift, run_pypower_pos, get_profile
+from ps_cache_helper import cached_pypower_redshift, cached_pypower_pos
 from mock_bias import load_Abacus_linear_power, grow_plin, measure_bias_k, average_bias
+from box_cov_helper import gaussian_box_cov, t0_box_cov
 
 import sys, os
-sys.path.insert(0, os.path.expanduser('~/lib/thecov'))
-from thecov import geometry, covariance
 
 def read_mock(fname: str, boxV: float) -> tuple[np.ndarray, float]:
     pos = read_catalog(fname)  
@@ -15,10 +15,26 @@ def read_mock(fname: str, boxV: float) -> tuple[np.ndarray, float]:
     nbar = n_galaxies / boxV
     return pos, nbar
 
-def power_spectrum(pos: np.ndarray, path2poles: str | None = None) -> dict:
-    poles = run_pypower_redshift(pos[:,0], pos[:,1], pos[:,2])
+def power_spectrum(pos: np.ndarray, path2poles: str | None = None, cache: bool = True, profile: str | float | None = None) -> dict:
+    """
+    pypower multipoles of a box catalog, reduced by poles_to_data. With cache=True the poles
+    of a catalog measured before (same positions and settings) are read from the cache.
+    profile: None for the pypower_helpers defaults, or a name / kmax for pypower_helpers.get_profile,
+        e.g. profile=0.1 for the smallest mesh keeping the aliasing error below 1e-3 up to k = 0.1.
+    """
+    kwargs = {} if profile is None else get_profile(profile)
+    if cache:
+        poles = cached_pypower_pos(pos, **kwargs)
+    else:
+        poles = run_pypower_pos(pos, **kwargs)
     if path2poles is not None:
         poles.save(path2poles)
+    return poles_to_data(poles)
+
+def poles_to_data(poles) -> dict:
+    """
+    Reduce pypower poles to the dict used by thecov_box and desilike: finite bins with 0.003 < k < 0.1.
+    """
     kbin = poles.edges[0]
     kmins, kmaxs = kbin[:-1], kbin[1:]
     k, p0 = poles(ell=0, return_k=True, complex=False)
@@ -36,6 +52,45 @@ def power_spectrum(pos: np.ndarray, path2poles: str | None = None) -> dict:
     }
     return data
 
+def power_spectrum_and_cov(
+    x: np.ndarray, y: np.ndarray, z: np.ndarray, 
+    boxV: float, 
+    mpicomm=None,
+    cache: bool = True,
+) -> tuple:
+    """
+    Stream galaxy positions (e.g. straight from AbacusHOD.run_hod) to the FFT estimator and the
+    thecov Gaussian covariance, without writing or reading the catalog.
+    
+    Returns: poles (pypower.PowerSpectrumMultipoles), data (dict, see poles_to_data), nbar, cov.
+    """
+    if cache:
+        poles = cached_pypower_redshift(x, y, z, mpicomm=mpicomm)
+    elif mpicomm is None:
+        poles = run_pypower_redshift(x, y, z)
+    else:
+        poles = run_pypower_redshift(x, y, z, mpicomm=mpicomm)
+    data = poles_to_data(poles)
+    nbar = len(x) / boxV
+    cov = thecov_box(pk_theory=data, nbar=nbar, volume=boxV, has_shotnoise_set=False)
+    return poles, data, nbar, cov
+
+def data_kedges(data: dict) -> np.ndarray:
+    'k-bin edges of a poles_to_data dict, as set in thecov by set_kbins(kmin, kmax, dk).'
+    return data['kmin'] + data['dk'] * np.arange(len(data['P_0']) + 1)
+
+def save_pscov(path: str, data: dict, nbar: float, cov: np.ndarray) -> None:
+    'Save the reduced power spectrum, the number density and the covariance to one .npz file.'
+    np.savez(path, nbar=nbar, cov=cov, **data)
+
+def load_pscov(path: str) -> tuple[dict, float, np.ndarray]:
+    'Inverse of save_pscov. Returns data (dict), nbar, cov.'
+    with np.load(path) as f:
+        data = {key: (f[key].item() if f[key].ndim == 0 else f[key]) for key in ('kmin', 'kmax', 'dk', 'k', 'P_0', 'P_2')}
+        nbar = float(f['nbar'])
+        cov = f['cov']
+    return data, nbar, cov
+
 def linear_matter_power_spectrum(zeff: float, IDIR: str = "/global/homes/s/siyizhao/lib/AbacusSummit/Cosmologies/abacus_cosm000/") -> tuple[np.ndarray, np.ndarray]:
     klin, plin_z1 = load_Abacus_linear_power(IDIR)
     plin_z = grow_plin(zeff, plin_z1, IDIR=IDIR, z_in=1.0)
@@ -57,11 +112,27 @@ def thecov_box(
     zeff: float | None = None,
     b1: float | None = None,
     cosmo: cosmoprimo.Cosmology | None = None,
+    engine: str = 'native',
 ) -> np.ndarray:
     """
     pk_theory: dict with keys 'kmin', 'kmax', 'dk', 'P_0', 'P_2',
     zeff, b1, cosmo: required if want_T0 is True
+    engine: 'native' for the closed-form Gaussian box covariance of box_cov_helper (no thecov
+        setup; set FIHOBI_COV_CHECK=1 to cross-check it against thecov), or 'thecov'.
+    want_T0: add the regular trispectrum term, computed by thecov on a grid of b1 cached on disk
+        (box_cov_helper.t0_box_cov) and interpolated in b1.
     """
+    if want_T0 and (zeff is None or b1 is None or cosmo is None):
+        raise ValueError("zeff, b1 and cosmo are required for the T0 covariance.")
+    if engine == 'native':
+        cov = gaussian_box_cov({0: pk_theory['P_0'], 2: pk_theory['P_2']}, nbar, data_kedges(pk_theory),
+                               volume=volume, ells=(0,), has_shotnoise=has_shotnoise_set)
+        if want_T0:
+            # mock-independent, cached on a b1 grid
+            cov = cov + t0_box_cov(data_kedges(pk_theory), zeff, b1, cosmo, volume=volume, ells=(0,))
+        return cov
+    sys.path.insert(0, os.path.expanduser('~/lib/thecov'))
+    from thecov import geometry, covariance
     # Create geometry
     geom = geometry.BoxGeometry(volume=volume, nbar=nbar)
     # Define k-bins
@@ -74,17 +145,9 @@ def thecov_box(
     gaussian.set_galaxy_pk_multipole(pk_theory['P_2'], 2)
     # gaussian.set_galaxy_pk_multipole(pk_theory['P_4'], 4)
     gaussian.compute_covariance()
+    comb_cov_P0 = gaussian.get_ell_cov(0, 0).cov
     
-    # # ========== Trispectrum (T0) Covariance ==========
-    # t0 = covariance.RegularTrispectrumCovariance(geom)
-    # t0.set_kbins(kmin, kmax, dk)
-
-    # plin = cosmo.get_fourier()
-    # t0.set_linear_matter_pk(np.vectorize(lambda k: plin.pk_kz(k, zeff)))
-    # t0.set_params(fgrowth=cosmo.growth_rate(zeff), b1=b1)
-    # t0.compute_covariance()
-    
-    # ========== Combine Gaussian and T0 Covariance ==========
-    combine = gaussian#+t0
-    comb_cov_P0 = combine.get_ell_cov(0, 0).cov
+    # ========== Trispectrum (T0) Covariance ==========
+    if want_T0:
+        comb_cov_P0 = comb_cov_P0 + t0_box_cov(data_kedges(pk_theory), zeff, b1, cosmo, volume=volume, ells=(0,))
     return comb_cov_P0
@@ -0,0 +1,109 @@
+"""
+Weighted redshift histograms of DESI clustering catalogs, for the effective redshifts.
+
+A catalog is scanned once, reading only the Z, WEIGHT and WEIGHT_FKP columns in row chunks,
+into a fine histogram (step ZSTEP_FINE from z=0) of sum(w) and sum(w*z); it is kept in memory
+and in `<key>.npz` in io_def.path_to_zhist_cache (key: path, size and mtime of the catalog), so
+all the z-bins of a tracer, and later runs, are served from that one scan.
+"""
+import os
+import hashlib
+import numpy as np
+
+from io_def import path_to_zhist_cache, atomic_write
+
+__all__ = ["scan_columns", "z_histogram", "zeff_from_hist", "compute_zeff"]
+
+ZSTEP_FINE = 1e-3
+ZMAX_FINE = 6.
+CHUNK_ROWS = 1 << 22
+COLUMNS = ('Z', 'WEIGHT', 'WEIGHT_FKP')
+
+_MEMORY = {}
+
+def scan_columns(fn, columns, chunk_rows=CHUNK_ROWS, ext=1):
+    'Yield the requested columns of a FITS table as structured arrays of at most chunk_rows rows.'
+    import fitsio
+    with fitsio.FITS(str(fn)) as fits:
+        hdu = fits[ext]
+        nrows = hdu.get_nrows()
+        for start in range(0, nrows, chunk_rows):
+            yield hdu[list(columns)][start:min(start + chunk_rows, nrows)]
+
+def _hist_key(fn):
+    st = os.stat(fn)
+    text = f"{os.path.realpath(fn)};size={st.st_size};mtime={st.st_mtime_ns};zstep={ZSTEP_FINE};zmax={ZMAX_FINE}"
+    return hashlib.blake2b(text.encode(), digest_size=16).hexdigest()
+
+def _accumulate(fn, edges):
+    'Stream the catalog into sum(w) and sum(w*z) on the given edges, with w = WEIGHT * WEIGHT_FKP.'
+    sumw = np.zeros(len(edges) - 1)
+    sumwz = np.zeros(len(edges) - 1)
+    for chunk in scan_columns(fn, COLUMNS):
+        z = chunk['Z'].astype('f8')
+        w = chunk['WEIGHT'].astype('f8') * chunk['WEIGHT_FKP']
+        mask = z < edges[-1]  # zrange is [zmin, zmax)
+        z, w = z[mask], w[mask]
+        sumw += np.histogram(z, bins=edges, weights=w)[0]
+        sumwz += np.histogram(z, bins=edges, weights=z * w)[0]
+    return sumw, sumwz
+
+def z_histogram(fn, cache_dir=None):
+    """
+    Fine histogram {'edges', 'sumw', 'sumwz'} of a catalog, from the memory or disk cache, or
+    from one columnar scan.
+    """
+    fn = str(fn)
+    key = _hist_key(fn)
+    if key in _MEMORY:
+        return _MEMORY[key]
+    path = os.path.join(str(cache_dir or path_to_zhist_cache()), f'{key}.npz')
+    if os.path.exists(path):
+        with np.load(path) as f:
+            hist = {name: f[name] for name in ('edges', 'sumw', 'sumwz')}
+        print(f"[cache] z histogram of {fn} <- {path}")
+    else:
+        edges = np.arange(0., ZMAX_FINE + ZSTEP_FINE / 2., ZSTEP_FINE)
+        sumw, sumwz = _accumulate(fn, edges)
+        hist = {'edges': edges, 'sumw': sumw, 'sumwz': sumwz}
+        with atomic_write(path) as tmp:
+            np.savez(tmp, **hist)
+        print(f"[write] -> {path}")
+    _MEMORY[key] = hist
+    return hist
+
+def _rebin(hist, zbins):
+    'Sums of the fine histogram in zbins, or None if zbins are not on the fine edges.'
+    idx = np.rint(zbins / ZSTEP_FINE).astype(int)
+    if np.any(np.abs(idx * ZSTEP_FINE - zbins) > 1e-9) or idx[0] < 0 or idx[-1] >= len(hist['edges']):
+        return None
+    return [np.array([hist[name][a:b].sum() for a, b in zip(idx[:-1], idx[1:])]) for name in ('sumw', 'sumwz')]
+
+def zeff_from_hist(sumw, sumwz, zbins, cosmo):
+    'Effective redshift from the weighted histograms on zbins, see compute_zeff.'
+    dbins = cosmo.comoving_radial_distance(zbins)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        z = sumwz / sumw
+    z[np.isnan(z)] = 0.
+    dv = dbins[1:]**3 - dbins[:-1]**3
+    # sum(dv * density^2 * z) / sum(dv * density^2), where density = hist1 / dv
+    return np.sum(sumw**2 / dv * z) / np.sum(sumw**2 / dv)
+
+def compute_zeff(*catalog_fns, cosmo=None, zrange=None, zstep=0.01, cache_dir=None):
+    """
+    Effective redshift of the catalogs in zrange, with bins of zstep and w = WEIGHT * WEIGHT_FKP.
+    The histograms come from z_histogram; a zrange off the fine grid falls back to a
+    columnar scan with the exact bins.
+    """
+    if cosmo is None:
+        from cosmoprimo.fiducial import DESI
+        cosmo = DESI()
+    zbins = np.arange(zrange[0], zrange[1] + zstep / 2., zstep)
+    sumw, sumwz = np.zeros(len(zbins) - 1), np.zeros(len(zbins) - 1)
+    for fn in catalog_fns:
+        rebinned = _rebin(z_histogram(fn, cache_dir=cache_dir), zbins)
+        if rebinned is None:
+            rebinned = _accumulate(fn, zbins)
+        sumw += rebinned[0]
+        sumwz += rebinned[1]
+    return zeff_from_hist(sumw, sumwz, zbins, cosmo)
@@ -0,0 +1,78 @@
+# python -m pytest tests/test_mock_stats.py  (or python tests/test_mock_stats.py)
+# Behaviour checks of the pure-numpy pieces of the EZmock statistics:
+# PolesAccumulator (Welford + pairwise merge) and the packed PolesStore.
+
+import os, sys
+import tempfile
+import multiprocessing
+import numpy as np
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'src')))
+from mock_stats_helper import PolesAccumulator, accumulate_mocks
+from poles_store_helper import PolesStore
+
+K = np.linspace(0.005, 0.2, 12)
+
+def _vectors(nmock, nbin, seed=0):
+    rng = np.random.default_rng(seed)
+    return rng.normal(size=(nmock, nbin)) @ rng.normal(size=(nbin, nbin)) + 1e4
+
+def test_accumulator_merge():
+    X = _vectors(57, 12)
+    parts = []
+    for chunk in np.array_split(np.arange(len(X)), [1, 20, 21, 40]):
+        acc = PolesAccumulator(k=K)
+        for i in chunk:
+            acc.add(X[i], key=f"r{i}")
+        parts.append(acc)
+    merged = PolesAccumulator()
+    merged.merge(PolesAccumulator())  # empty
+    for acc in parts:
+        merged.merge(acc)
+    assert merged.n == len(X)
+    assert merged.keys == {f"r{i}" for i in range(len(X))}
+    assert np.allclose(merged.mean, np.mean(X, axis=0), rtol=1e-12)
+    assert np.allclose(merged.cov, np.cov(X, rowvar=False), rtol=1e-9)
+
+def _append(path, seeds, pk):
+    store = PolesStore(path)
+    for seed in seeds:
+        store.append(seed, k=K, nmodes=np.ones_like(K), pk=pk[seed], ells=(0, 2))
+
+def test_store_round_trip():
+    pk = {seed: np.stack([np.full(len(K), seed), -np.full(len(K), seed)]).astype(float) for seed in range(40)}
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'pypowerpoles.store')
+        ## two processes append concurrently
+        procs = [multiprocessing.get_context('spawn').Process(target=_append, args=(path, seeds, pk))
+                 for seeds in (range(0, 40, 2), range(1, 40, 2))]
+        for proc in procs:
+            proc.start()
+        for proc in procs:
+            proc.join()
+            assert proc.exitcode == 0
+        store = PolesStore(path)
+        assert len(store) == 40 and sorted(store.seeds) == list(range(40))
+        ## a torn record (crashed writer) is truncated by the next append
+        with open(path, 'ab') as f:
+            f.write(b'\0' * 100)
+        assert len(store) == 40
+        pk[7] = pk[7] + 0.5  # seed 7 redone: the last row wins
+        _append(path, [7], pk)
+        rec_size = store.records().dtype.itemsize
+        assert (os.path.getsize(path) - store.header['offset']) % rec_size == 0
+        assert len(store) == 41
+        ## read back by seed
+        out = store.read(seeds=[7, 3, 39])
+        assert list(out['seeds']) == [7, 3, 39]
+        assert np.array_equal(out['poles'][0], pk[7]) and np.array_equal(out['poles'][1], pk[3])
+        assert out['ells'] == (0, 2) and np.allclose(out['k'], K)
+        ## the accumulator over the store uses the last row of seed 7
+        acc = accumulate_mocks(path, ells=(0,), state=None, nproc=1)
+        ref = np.array([pk[seed][0] for seed in range(40)])
+        assert acc.n == 40
+        assert np.allclose(acc.mean, ref.mean(axis=0)) and np.allclose(acc.cov, np.cov(ref, rowvar=False))
+
+if __name__ == "__main__":
+    test_accumulator_merge()
+    test_store_round_trip()
+    print("ok")